@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark for the enforcer's opcode dispatch loop.
+
+Loads synthetic pickles dominated by small opcodes (ints, short strings,
+dicts, tuples) with the enforcing unpickler, and with a subclass that runs the
+previous dict-based loop, and reports opcodes per second for both.
+"""
+
+import argparse
+import io
+import json
+import pickle
+import pickletools
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from enforcer_module import ENFORCER_PATH, import_enforcer
+
+
+def make_cases(size: int) -> dict:
+    return {
+        "ints": list(range(size)),
+        "strings": [f"s{i}" for i in range(size)],
+        "dicts": [{"a": i, "b": -i} for i in range(size // 4)],
+        "tuples": [(i, i + 1, (i, "t")) for i in range(size // 4)],
+    }
+
+
+def count_opcodes(data: bytes) -> int:
+    return sum(1 for _ in pickletools.genops(data))
+
+
+def legacy_unpickler(enforcer):
+    class LegacyUnpickler(enforcer._Unpickler):
+        """The enforcer running the read(1) + dispatch dict loop it used to."""
+
+        def load(self):
+            self._unframer = unframer = self._make_unframer()
+            self.read = read = unframer.read
+            self.readinto = unframer.readinto
+            self.readline = unframer.readline
+            self.metastack = []
+            self.stack = []
+            self.append = self.stack.append
+            self.proto = 0
+            dispatch = self.dispatch
+            try:
+                while True:
+                    key = read(1)
+                    if not key:
+                        raise EOFError
+                    dispatch[key[0]](self)
+            except enforcer._Stop as stopinst:
+                return stopinst.value
+            finally:
+                unframer.close()
+
+    return LegacyUnpickler
+
+
+def run(unpickler_cls, data: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        unpickler_cls(io.BytesIO(data)).load()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--protocol", type=int, default=pickle.HIGHEST_PROTOCOL)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    # Synthetic cases only use builtins, so an empty policy is sufficient.
+    policy_dir = tempfile.mkdtemp()
+    Path(policy_dir, "policy.json").write_text(
+        json.dumps({"bench": {"globals": [], "reduces": []}})
+    )
+    enforcer.POLICY_PATH = policy_dir
+
+    legacy = legacy_unpickler(enforcer)
+    print(f"{'case':<10}{'opcodes':>10}{'legacy op/s':>16}{'indexed op/s':>16}"
+          f"{'speedup':>10}")
+    for name, obj in make_cases(args.size).items():
+        data = pickle.dumps(obj, protocol=args.protocol)
+        opcodes = count_opcodes(data)
+        old = run(legacy, data, args.repeat)
+        new = run(enforcer._Unpickler, data, args.repeat)
+        print(f"{name:<10}{opcodes:>10}{opcodes / old:>16,.0f}"
+              f"{opcodes / new:>16,.0f}{old / new:>9.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
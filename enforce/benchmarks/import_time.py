@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""Import-time benchmark for the enforcer installed as the pickle module.
+
+Runs ``python -X importtime -c "import pickle"`` repeatedly against the stock
+standard library and against a copy of enforce.py placed first on the
+module path (as the enforce Dockerfiles install it), and reports the median
+cumulative import time of pickle, the wall time of the whole process and the
+modules each one imports.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from enforcer_module import ENFORCER_PATH
+
+PROBE = (
+    "import sys; before = set(sys.modules); import pickle; "
+    "print(pickle.__file__); print(' '.join(sorted(set(sys.modules) - before)))"
+)
+
+
+def run_once(python: str, env: dict) -> tuple:
+    """Return (pickle's cumulative import µs, wall seconds, file, modules)."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", PROBE],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[2].strip() == "pickle" and fields[2][1] != " ":
+            cumulative = int(fields[1])
+    if cumulative is None:
+        raise RuntimeError(f"no import time reported for pickle:\n{proc.stderr}")
+    path, modules = proc.stdout.splitlines()[:2]
+    return cumulative, wall, path, modules.split()
+
+
+def measure(python: str, env: dict, runs: int) -> dict:
+    # The first run warms the bytecode caches
+    run_once(python, env)
+    imports, walls = [], []
+    for _ in range(runs):
+        cumulative, wall, path, modules = run_once(python, env)
+        imports.append(cumulative)
+        walls.append(wall)
+    return {
+        "module": path,
+        "import_us": statistics.median(imports),
+        "process_ms": statistics.median(walls) * 1e3,
+        "modules": modules,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20,
+                        help="interpreter runs per configuration")
+    parser.add_argument("--python", default=sys.executable,
+                        help="interpreter to measure")
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH,
+                        help="enforce.py to install as pickle")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    args = parser.parse_args()
+
+    env = {k: v for k, v in os.environ.items() if not k.startswith("PYTHON")}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy(args.enforcer, Path(tmp) / "pickle.py")
+        results["stock"] = measure(args.python, env, args.runs)
+        results["enforcer"] = measure(
+            args.python, {**env, "PYTHONPATH": tmp}, args.runs
+        )
+    if not results["enforcer"]["module"].startswith(tmp):
+        print("enforce.py was not imported as pickle", file=sys.stderr)
+        return 1
+
+    stock_modules = set(results["stock"]["modules"])
+    print(f"{'':10} {'import [us]':>12} {'process [ms]':>13} {'modules':>8}")
+    for name, result in results.items():
+        print(f"{name:10} {result['import_us']:12.0f} "
+              f"{result['process_ms']:13.1f} {len(result['modules']):8d}")
+    extra = sorted(set(results["enforcer"]["modules"]) - stock_modules)
+    print(f"modules imported only by the enforcer: {' '.join(extra) or '-'}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
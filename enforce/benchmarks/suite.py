@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+
+"""Benchmark suite for the PickleBall enforcer.
+
+Generates synthetic pickles for protocols 0-5 in several payload shapes and
+loads each of them with the enforcer (enforce.py), the C unpickler (_pickle)
+and the standard library's pure-Python unpickler. Every load runs in its own
+worker process so that peak RSS can be attributed to a single configuration.
+
+Results are written as JSON. Pass a previous result file with --baseline to
+fail (exit status 1) when a configuration regresses by more than --tolerance.
+"""
+
+import argparse
+import importlib
+import io
+import json
+import os
+import pickle
+import pickletools
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from enforcer_module import ENFORCER_PATH, import_enforcer
+
+PROTOCOLS = list(range(pickle.HIGHEST_PROTOCOL + 1))
+IMPLS = ["enforce", "enforce-fast", "pickle", "pypickle"]
+# Implementations whose dispatch loop runs in Python and can be instrumented
+# per opcode.
+OPCODE_TIMED_IMPLS = {"enforce", "pypickle"}
+
+TYPES_MODULE = "pbbench_types"
+NUM_GLOBALS = 256
+
+# Module referenced by the synthetic pickles. It is written next to the
+# generated pickles so that every implementation imports the same classes.
+TYPES_SOURCE = f'''
+import collections
+
+NUM_GLOBALS = {NUM_GLOBALS}
+
+
+class Record:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __reduce__(self):
+        return (type(self), (self.value,))
+
+
+for _i in range(NUM_GLOBALS):
+    _name = "Record%d" % _i
+    globals()[_name] = type(_name, (Record,), {{"__slots__": ()}})
+
+
+class Point:
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __reduce__(self):
+        return (make_point, (self.x, self.y))
+
+
+def make_point(x, y):
+    return Point(x, y)
+
+
+class FloatStorage:
+    def __init__(self, key, numel):
+        self.key = key
+        self.numel = numel
+
+
+class Tensor:
+    def __init__(self, storage, size):
+        self.storage = storage
+        self.size = size
+
+    def __reduce__(self):
+        stride = (self.size[1], 1)
+        return (
+            _rebuild_tensor_v2,
+            (self.storage, 0, self.size, stride, False, collections.OrderedDict()),
+        )
+
+
+def _rebuild_tensor_v2(storage, offset, size, stride, requires_grad, hooks):
+    return (storage, offset, size, stride)
+'''
+
+
+def policy_json() -> dict:
+    records = [f"{TYPES_MODULE}.Record{i}" for i in range(NUM_GLOBALS)]
+    functions = [
+        f"{TYPES_MODULE}.make_point",
+        f"{TYPES_MODULE}._rebuild_tensor_v2",
+        "collections.OrderedDict",
+        "_codecs.encode",
+    ]
+    return {
+        "benchmark": {
+            "globals": records + functions + [f"{TYPES_MODULE}.FloatStorage"],
+            "reduces": records + functions,
+        }
+    }
+
+
+# --- payloads --------------------------------------------------------------
+
+
+def case_scalars(types, scale):
+    n = int(100_000 * scale)
+    return [(i, f"s{i}", i * 0.5, i % 2 == 0) for i in range(n)]
+
+
+def case_globals(types, scale):
+    # Every record class is referenced many times; the GLOBAL/STACK_GLOBAL
+    # opcodes are memoized per class by the pickler.
+    n = int(50_000 * scale)
+    classes = [getattr(types, f"Record{i}") for i in range(types.NUM_GLOBALS)]
+    return [classes[i % len(classes)](i) for i in range(n)]
+
+
+def case_reduces(types, scale):
+    n = int(100_000 * scale)
+    return [types.Point(i, -i) for i in range(n)]
+
+
+def case_nested(types, scale):
+    chains = max(1, int(200 * scale))
+    out = []
+    for c in range(chains):
+        node = c
+        for depth in range(200):
+            kind = depth % 3
+            if kind == 0:
+                node = [node, depth]
+            elif kind == 1:
+                node = {"child": node, "depth": depth}
+            else:
+                node = (node, depth)
+        out.append(node)
+    return out
+
+
+def case_blobs(types, scale):
+    count = max(1, int(16 * scale))
+    return [bytes([i % 256]) * (1 << 20) for i in range(count)]
+
+
+def case_torch(types, scale):
+    n = int(2_000 * scale)
+    state = OrderedDict()
+    for i in range(n):
+        storage = types.FloatStorage(str(i), 64 * 64)
+        state[f"layers.{i}.weight"] = types.Tensor(storage, (64, 64))
+    return state
+
+
+CASES = {
+    "scalars": case_scalars,
+    "globals": case_globals,
+    "reduces": case_reduces,
+    "nested": case_nested,
+    "blobs": case_blobs,
+    "torch": case_torch,
+}
+
+
+def make_pickler(types, protocol):
+    class TorchLikePickler(pickle.Pickler):
+        # torch.save records storages as persistent IDs of the form
+        # ("storage", storage_type, key, location, numel).
+        def persistent_id(self, obj):
+            if isinstance(obj, types.FloatStorage):
+                if protocol == 0:
+                    # Protocol 0 only supports ASCII string persistent IDs.
+                    return f"storage:{obj.key}:{obj.numel}"
+                return ("storage", types.FloatStorage, obj.key, "cpu", obj.numel)
+            return None
+
+    return TorchLikePickler
+
+
+def generate(workdir: Path, cases, protocols, scale):
+    """Write the types module, policy and pickles; return their metadata."""
+
+    (workdir / f"{TYPES_MODULE}.py").write_text(TYPES_SOURCE)
+    policy_dir = workdir / "policy"
+    policy_dir.mkdir(exist_ok=True)
+    (policy_dir / "policy.json").write_text(json.dumps(policy_json()))
+
+    sys.path.insert(0, str(workdir))
+    types = importlib.import_module(TYPES_MODULE)
+
+    pickles = {}
+    for case in cases:
+        obj = CASES[case](types, scale)
+        for protocol in protocols:
+            buf = io.BytesIO()
+            make_pickler(types, protocol)(buf, protocol=protocol).dump(obj)
+            data = buf.getvalue()
+            path = workdir / f"{case}-{protocol}.pkl"
+            path.write_bytes(data)
+            pickles[case, protocol] = {
+                "path": str(path),
+                "bytes": len(data),
+                "opcodes": sum(1 for _ in pickletools.genops(data)),
+            }
+    return pickles
+
+
+# --- worker ----------------------------------------------------------------
+
+
+def import_policy_enforcer(path: Path, policy_dir: str):
+    module = import_enforcer(path)
+    module.POLICY_PATH = policy_dir
+    return module
+
+
+def persistent_load(pid):
+    return pid
+
+
+def unpickler_class(impl, enforcer):
+    if impl == "enforce":
+        base = enforcer._Unpickler
+    elif impl == "enforce-fast":
+        base = enforcer.FastUnpickler
+    elif impl == "pickle":
+        base = pickle.Unpickler
+    elif impl == "pypickle":
+        base = pickle._Unpickler
+    else:
+        raise ValueError(f"unknown implementation {impl!r}")
+
+    class BenchUnpickler(base):
+        def persistent_load(self, pid):
+            return persistent_load(pid)
+
+    return BenchUnpickler
+
+
+def opcode_timed_class(cls):
+    """Subclass of a Python unpickler that times every opcode handler."""
+
+    names = {op.code.encode("latin-1")[0]: op.name for op in pickletools.opcodes}
+    totals = defaultdict(lambda: [0, 0])
+    clock = time.perf_counter_ns
+
+    def timed(name, handler):
+        def load_timed(self):
+            entry = totals[name]
+            start = clock()
+            try:
+                handler(self)
+            finally:
+                entry[0] += 1
+                entry[1] += clock() - start
+
+        return load_timed
+
+    class OpcodeTimedUnpickler(cls):
+        dispatch = {
+            code: timed(names.get(code, hex(code)), handler)
+            for code, handler in cls.dispatch.items()
+        }
+
+    return OpcodeTimedUnpickler, totals
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss survives exec on Linux and would report the driver's peak, so
+    # prefer the high-water mark of this process's own address space.
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def worker(args) -> dict:
+    data = Path(args.pickle).read_bytes()
+    enforcer = None
+    if args.impl.startswith("enforce"):
+        enforcer = import_policy_enforcer(args.enforcer, args.policy_dir)
+    cls = unpickler_class(args.impl, enforcer)
+
+    def load():
+        return cls(io.BytesIO(data)).load()
+
+    rss_before = peak_rss_kb()
+    for _ in range(args.warmup):
+        load()
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        load()
+        times.append(time.perf_counter() - start)
+    rss_after = peak_rss_kb()
+
+    result = {
+        "best_seconds": min(times),
+        "mean_seconds": sum(times) / len(times),
+        "peak_rss_kb": rss_after,
+        "load_rss_kb": rss_after - rss_before,
+    }
+    if enforcer is not None:
+        # A stub means the benchmark policy is out of date, which would make
+        # the numbers meaningless.
+        last = enforcer.last_load()
+        result["stubs"] = sorted(last["stubs"]) if last else []
+
+    if args.opcode_times and args.impl in OPCODE_TIMED_IMPLS:
+        timed_cls, totals = opcode_timed_class(cls)
+        timed_cls(io.BytesIO(data)).load()
+        result["opcode_times"] = {
+            name: {"count": count, "seconds": ns / 1e9}
+            for name, (count, ns) in sorted(
+                totals.items(), key=lambda item: -item[1][1]
+            )
+        }
+    return result
+
+
+# --- driver ----------------------------------------------------------------
+
+
+def run_worker(impl, meta, args, policy_dir, workdir):
+    cmd = [
+        sys.executable,
+        __file__,
+        "--worker",
+        "--impl", impl,
+        "--pickle", meta["path"],
+        "--policy-dir", str(policy_dir),
+        "--enforcer", str(args.enforcer),
+        "--repeat", str(args.repeat),
+        "--warmup", str(args.warmup),
+    ]
+    if args.opcode_times:
+        cmd.append("--opcode-times")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [str(workdir), os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout)
+
+
+def summarize(results):
+    """Add throughput and the time relative to _pickle to every result."""
+
+    reference = {
+        (r["case"], r["protocol"]): r["best_seconds"]
+        for r in results
+        if r["impl"] == "pickle" and "best_seconds" in r
+    }
+    for r in results:
+        if "best_seconds" not in r:
+            continue
+        seconds = r["best_seconds"]
+        r["opcodes_per_s"] = r["opcodes"] / seconds
+        r["mb_per_s"] = r["bytes"] / seconds / 1e6
+        ref = reference.get((r["case"], r["protocol"]))
+        if ref:
+            r["relative_to_pickle"] = seconds / ref
+
+
+def find_regressions(results, baseline, tolerance, compare):
+    def key(r):
+        return r["impl"], r["case"], r["protocol"]
+
+    previous = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get(key(r))
+        if old is None:
+            continue
+        if "error" in r:
+            regressions.append(f"{key(r)}: {r['error']}")
+        elif compare == "relative":
+            if "relative_to_pickle" not in r or "relative_to_pickle" not in old:
+                continue
+            if r["relative_to_pickle"] > old["relative_to_pickle"] * (1 + tolerance):
+                regressions.append(
+                    f"{key(r)}: {r['relative_to_pickle']:.2f}x _pickle, "
+                    f"baseline {old['relative_to_pickle']:.2f}x"
+                )
+        elif r["opcodes_per_s"] < old["opcodes_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{key(r)}: {r['opcodes_per_s']:,.0f} opcodes/s, "
+                f"baseline {old['opcodes_per_s']:,.0f}"
+            )
+    return regressions
+
+
+def print_table(results, stream):
+    header = (f"{'impl':<13}{'case':<9}{'proto':>5}{'MB':>8}{'opcodes/s':>14}"
+              f"{'MB/s':>9}{'rss MB':>8}{'vs _pickle':>11}")
+    print(header, file=stream)
+    for r in results:
+        prefix = f"{r['impl']:<13}{r['case']:<9}{r['protocol']:>5}"
+        if "error" in r:
+            print(f"{prefix}  error: {r['error']}", file=stream)
+            continue
+        relative = r.get("relative_to_pickle")
+        print(
+            f"{prefix}{r['bytes'] / 1e6:>8.2f}{r['opcodes_per_s']:>14,.0f}"
+            f"{r['mb_per_s']:>9.1f}{r['peak_rss_kb'] / 1024:>8.0f}"
+            f"{(f'{relative:.2f}x' if relative else '-'):>11}",
+            file=stream,
+        )
+
+
+def parse_list(value, choices, convert=str):
+    items = [convert(item) for item in value.split(",") if item]
+    unknown = [item for item in items if item not in choices]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown values {unknown}")
+    return items
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--cases", default=",".join(CASES),
+                        type=lambda v: parse_list(v, CASES))
+    parser.add_argument("--protocols", default=",".join(map(str, PROTOCOLS)),
+                        type=lambda v: parse_list(v, PROTOCOLS, int))
+    parser.add_argument("--impls", default=",".join(IMPLS),
+                        type=lambda v: parse_list(v, IMPLS))
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplier for the size of every payload")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    parser.add_argument("--opcode-times", action="store_true",
+                        help="also time every opcode type (Python unpicklers)")
+    parser.add_argument("--output", type=Path,
+                        help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", type=Path,
+                        help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--compare", choices=["relative", "absolute"],
+                        default="relative",
+                        help="compare time relative to _pickle (portable "
+                             "across machines) or absolute opcodes/s")
+    # Internal options used by the per-configuration worker processes.
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--impl", help=argparse.SUPPRESS)
+    parser.add_argument("--pickle", help=argparse.SUPPRESS)
+    parser.add_argument("--policy-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(worker(args), sys.stdout)
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="pickleball-bench-") as tmp:
+        workdir = Path(tmp)
+        pickles = generate(workdir, args.cases, args.protocols, args.scale)
+        results = []
+        for (case, protocol), meta in pickles.items():
+            for impl in args.impls:
+                result = {
+                    "impl": impl,
+                    "case": case,
+                    "protocol": protocol,
+                    "bytes": meta["bytes"],
+                    "opcodes": meta["opcodes"],
+                }
+                result.update(run_worker(impl, meta, args, workdir / "policy",
+                                         workdir))
+                results.append(result)
+
+    summarize(results)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "enforcer": str(args.enforcer),
+            "scale": args.scale,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    print_table(results, sys.stderr)
+
+    failed = [r for r in results if "error" in r or r.get("stubs")]
+    for r in failed:
+        print(f"failed: {r['impl']} {r['case']} protocol {r['protocol']}: "
+              f"{r.get('error') or r.get('stubs')}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = find_regressions(results, baseline, args.tolerance,
+                                       args.compare)
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
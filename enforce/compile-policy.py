@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""Compile PickleBall JSON policies into the enforcer's binary format.
+
+The binary form (".pbp") is memory-mapped by the enforcer instead of being
+parsed on every start. Put it next to the JSON policy (for example
+/root/policies/policy.pbp) or in a PolicyStore directory and the enforcer
+prefers it over the JSON file.
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+ENFORCER_PATH = Path(__file__).resolve().parent / "enforce.py"
+
+
+def import_enforcer(path: Path):
+    """Import enforce.py under its own name, without replacing pickle."""
+    spec = importlib.util.spec_from_file_location("pickleball_policy_compiler", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def describe(enforcer, path: Path) -> None:
+    image = enforcer._BinaryPolicyImage(memoryview(path.read_bytes()))
+    if image.source_digest is not None:
+        print(f"{path}: compiled from JSON with SHA-256 {image.source_digest.hex()}")
+    for model_name, globals, reduces, digest, limits in image.models():
+        print(f"{path}: {model_name}")
+        print(f"  globals: {globals}, reduces: {reduces}")
+        if limits is not None:
+            print(f"  limits:  {limits.as_dict()}")
+        print(f"  digest:  {digest.hex()}")
+
+
+def check(enforcer, source: Path, compiled: Path) -> bool:
+    """Return whether *compiled* holds exactly the policies of *source*."""
+    with open(source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    policies = enforcer._load_binary_policies(str(compiled))
+    if [p.model_name for p in policies] != list(data):
+        return False
+    for policy in policies:
+        spec = data[policy.model_name]
+        limits = policy.limits.as_dict() if policy.limits is not None else {}
+        if (
+            set(policy.globals) != set(spec.get("globals", []))
+            or set(policy.reduces) != set(spec.get("reduces", []))
+            or limits != spec.get("limits", {})
+        ):
+            return False
+    return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("policies", nargs="+", type=Path,
+                        help="JSON policy files (or .pbp files with --info)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("-o", "--output", type=Path,
+                        help="output file (only with a single input)")
+    target.add_argument("--output-dir", type=Path,
+                        help="write <name>.pbp files to this directory")
+    parser.add_argument("--info", action="store_true",
+                        help="describe existing .pbp files instead")
+    parser.add_argument("--check", action="store_true",
+                        help="verify that each written file matches its source")
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH,
+                        help="enforce.py providing the binary format")
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+
+    if args.info:
+        for path in args.policies:
+            describe(enforcer, path)
+        return 0
+
+    if args.output and len(args.policies) > 1:
+        parser.error("--output requires a single input policy")
+
+    if args.output_dir:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    status = 0
+    for source in args.policies:
+        if args.output:
+            destination = args.output
+        elif args.output_dir:
+            destination = args.output_dir / (source.stem + ".pbp")
+        else:
+            destination = source.with_suffix(".pbp")
+        try:
+            enforcer.compile_policy_file(source, destination)
+        except (OSError, ValueError) as exc:
+            print(f"{source}: {exc}", file=sys.stderr)
+            status = 1
+            continue
+        print(f"{source} -> {destination} "
+              f"({source.stat().st_size} -> {destination.stat().st_size} bytes)")
+        if args.check and not check(enforcer, source, destination):
+            print(f"{destination}: does not match {source}", file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,13 +23,14 @@ Misc variables:
 
 """
 
+import _thread
 import codecs
 import functools as _functools
 import io
-import json
 import os
-import re
+import stat
 import sys
+from _contextvars import ContextVar as _ContextVar
 from copyreg import (
     _extension_cache,
     _extension_registry,
@@ -39,15 +40,21 @@ from copyreg import (
 from functools import partial
 
 # from hashlib import sha256
-from itertools import islice
-from pathlib import Path
-from struct import pack, unpack
+from itertools import islice, repeat
+from _collections import defaultdict as _defaultdict
+from _collections_abc import MutableMapping as _MutableMapping
+import struct as _struct
+from struct import calcsize, pack, unpack
+from struct import error as _StructError
 from sys import maxsize
 from types import FunctionType
-from typing import List
 
 import _compat_pickle
 
+# Every process imports this module when it replaces pickle.py, so modules
+# that only policy handling and telemetry need (json, hashlib, mmap, ...)
+# are imported where they are used.
+
 __all__ = [
     "PickleError",
     "PicklingError",
@@ -71,25 +78,210 @@ except ImportError:
 # Path containing the PickleBall policies (configurable)
 POLICY_PATH = "/root/policies"
 
-PLACEHOLDER_FILE_PATH = Path("/root/.loader_used")
+PLACEHOLDER_FILE_PATH = "/root/.loader_used"
 
-stub_objects_created = set()
+# Compatibility mode for tools that look for PLACEHOLDER_FILE_PATH: when
+# set, every load touches the file as well as updating the load registry.
+USE_PLACEHOLDER_FILE = os.environ.get("PICKLEBALL_PLACEHOLDER_FILE") == "1"
 
 
-class StubObject:
+def _touch_placeholder_file():
+    # Path.touch() without importing pathlib; PLACEHOLDER_FILE_PATH may be
+    # set to a str or a Path
+    path = os.fspath(PLACEHOLDER_FILE_PATH)
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o666))
+    os.utime(path)
 
-    def __new__(cls, *args, **kwargs):
-        # If we already instantiated a StubObject for this, just return it,
-        # else create a new one
-        if not isinstance(cls, type):
-            return cls
-        else:
-            return super().__new__(cls)
+
+# Enforcement telemetry. Log levels use the numbering of the logging module
+# and can be set with PICKLEBALL_LOG_LEVEL; structured events are written as
+# JSON lines to the file named by PICKLEBALL_TELEMETRY, if any.
+_LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
+_DEBUG = _LOG_LEVELS["debug"]
+_INFO = _LOG_LEVELS["info"]
+_WARNING = _LOG_LEVELS["warning"]
+
+
+class _Telemetry:
+    """Log level, optional JSON-lines sink and counters for the enforcer.
+
+    Callers test ``level`` and ``sink`` before formatting anything, and
+    counters are only kept while a sink is configured, so a quiet enforcer
+    pays for neither. Counters are updated with count() and events are
+    written under a lock, so concurrent loads neither lose increments nor
+    interleave event lines.
+    """
+
+    __slots__ = ("level", "sink", "counters", "_lock")
+
+    COUNTERS = (
+        "loads",
+        "stubs_created",
+        "denied_globals",
+        "denied_reduces",
+        "verdict_cache_hits",
+        "verdict_cache_misses",
+        "limits_exceeded",
+        "fast_fallbacks",
+    )
+
+    def __init__(self):
+        self.level = _WARNING
+        self.sink = None
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._lock = _thread.allocate_lock()
+
+    def count(self, name):
+        if self.sink is None:
+            return
+        with self._lock:
+            self.counters[name] += 1
+
+    def log(self, msg):
+        print(msg, file=sys.stderr)
+
+    def event(self, kind, **fields):
+        import json
+
+        line = json.dumps({"event": kind, **fields}) + "\n"
+        with self._lock:
+            sink = self.sink
+            if sink is not None:
+                sink.write(line)
+
+
+_telemetry = _Telemetry()
+
+
+def _parse_log_level(level):
+    if isinstance(level, int):
+        return level
+    try:
+        return _LOG_LEVELS[level.lower()]
+    except KeyError:
+        raise ValueError(f"unknown PickleBall log level: {level!r}") from None
+
+
+def configure_telemetry(level=None, sink=None):
+    """Configure enforcement logging and the structured event sink.
+
+    *level* is a level name ("debug", "info", "warning", "error", "off") or
+    a logging-style integer. *sink* is a path or a writable text file that
+    receives one JSON object per event; pass False to remove the sink.
+    """
+    if level is not None:
+        _telemetry.level = _parse_log_level(level)
+    if sink is False:
+        # Writers check the sink under the lock, so none uses it once it
+        # has been detached here
+        with _telemetry._lock:
+            sink = _telemetry.sink
+            _telemetry.sink = None
+        if sink is not None and getattr(sink, "_pickleball_owned", False):
+            sink.close()
+    elif sink is not None:
+        if isinstance(sink, (str, os.PathLike)):
+            sink = open(sink, "a", encoding="utf-8", buffering=1)
+            sink._pickleball_owned = True
+        _telemetry.sink = sink
+
+
+def telemetry_counters():
+    """Return a snapshot of the aggregated enforcement counters.
+
+    Events are only counted while a telemetry sink is configured.
+    """
+    with _telemetry._lock:
+        return dict(_telemetry.counters)
+
+
+def reset_telemetry_counters():
+    with _telemetry._lock:
+        for name in _telemetry.counters:
+            _telemetry.counters[name] = 0
+
+
+# A bad setting must not make importing the enforcer (and so pickle) fail
+if "PICKLEBALL_LOG_LEVEL" in os.environ:
+    try:
+        configure_telemetry(level=os.environ["PICKLEBALL_LOG_LEVEL"])
+    except ValueError as exc:
+        _telemetry.log(f"Ignoring PICKLEBALL_LOG_LEVEL: {exc}")
+if os.environ.get("PICKLEBALL_TELEMETRY"):
+    try:
+        configure_telemetry(sink=os.environ["PICKLEBALL_TELEMETRY"])
+    except OSError as exc:
+        if _telemetry.level <= _WARNING:
+            _telemetry.log(f"Ignoring PICKLEBALL_TELEMETRY: {exc}")
+
+
+# Thread safety
+#
+# Separate unpicklers may load concurrently from any number of threads.
+# Everything a load accumulates (memo, stacks, stubs, REDUCE verdicts,
+# resource budgets and the names recorded for the verdict cache) is held by
+# the unpickler instance, and the outcome of each load is reported to its
+# own thread or asyncio task through last_load(). State shared between
+# loads is either immutable (compiled policies, dispatch tables), written
+# only with values that racing threads agree on (the name memos of binary
+# policies), or guarded by a lock: the find_class cache, the compiled
+# policy cache, telemetry counters and events, the load registry, the
+# verdict cache, PolicyStore.refresh() and install(). As with the standard
+# library, a single unpickler must not be used by two threads at once.
+# using_policy() applies to the current thread or task only, whereas
+# install() changes the whole process.
+
+# Registry of enforced loads. The counter covers the whole process; the
+# outcome of the most recent load is recorded per thread (and per asyncio
+# task) so concurrent loaders do not observe each other's results.
+_load_registry_lock = _thread.allocate_lock()
+_load_count = 0
+_last_load = _ContextVar("pickleball_last_load", default=None)
+
+
+def _record_load(policy, stubs, error=None):
+    global _load_count
+    with _load_registry_lock:
+        _load_count += 1
+        load_id = _load_count
+    _last_load.set(
+        {
+            "id": load_id,
+            "ok": error is None,
+            "policy": policy.path,
+            "stubs": sorted(stubs),
+            "error": None if error is None else repr(error),
+        }
+    )
+
+
+def load_count():
+    """Return the number of enforced loads made by this process."""
+    return _load_count
+
+
+def last_load():
+    """Return the record of the last enforced load in the current context.
+
+    The record is a dict with the load's process-wide ``id``, whether it
+    succeeded (``ok``), the policy path, the stubbed names and the error, if
+    any. None is returned when no load has happened in this context.
+    """
+    return _last_load.get()
+
+
+class StubObject:
+    # Stubs are interned per load (see _get_stub), so a name that is denied
+    # many times shares one instance.
+    __slots__ = ("orig_name",)
 
     def __init__(self, orig_name):
-        print(f"Creating fake callable for {orig_name}")
+        if _telemetry.level <= _DEBUG:
+            _telemetry.log(f"Creating fake callable for {orig_name}")
+        if _telemetry.sink is not None:
+            _telemetry.event("stub", name=orig_name)
+        _telemetry.count("stubs_created")
         self.orig_name = orig_name
-        stub_objects_created.add(orig_name)
 
     # Called unconditionally to implement attribute accesses for instances of
     # the class.
@@ -107,7 +299,1000 @@ class StubObject:
     #     return f"StubObject for {self.orig_name}"
 
 
+def _get_stub(stubs, name):
+    # Return the stub for name from a load's {name: StubObject} table,
+    # creating it on first use.
+    stub = stubs.get(name)
+    if stub is None:
+        stub = stubs[name] = StubObject(name)
+    return stub
+
+
 disallowed_attrs = ["__name__", "__module__"]
+_DISALLOWED_ATTRS = frozenset(disallowed_attrs)
+
+
+def _check_build_state(inst, state):
+    # Refuse BUILD states that would overwrite the attributes REDUCE uses to
+    # name callables. Any state with keys() carries attribute names.
+    if type(state) is dict:
+        if _DISALLOWED_ATTRS.isdisjoint(state):
+            return
+        keys = state
+    elif hasattr(state, "keys"):
+        keys = state.keys()
+    else:
+        return
+    found = _DISALLOWED_ATTRS.intersection(keys)
+    if found:
+        raise Exception(f"BUILD attempted to set attribute {min(found)} of {inst}")
+
+
+def _build_items(inst, state):
+    # The (checked) items a BUILD state assigns as a dict, so that the keys
+    # screened are the keys assigned, whatever mapping the pickle supplied
+    if type(state) is not dict:
+        state = dict(state.items())
+    _check_build_state(inst, state)
+    return state
+
+
+class LoadLimits:
+    """Resource budgets for one load.
+
+    Each budget is a positive int, or None for no limit:
+
+    max_opcodes      opcodes executed
+    max_bytes        bytes read from the pickle stream
+    max_memo         memo entries
+    max_stack_depth  nesting depth of MARKs (lists, tuples, dicts, ...)
+    max_payload      declared size of a single length-prefixed string,
+                     bytes, long or frame
+
+    Fixed-width opcode arguments and the newline-terminated arguments of
+    protocol 0 are bounded by max_bytes only. A load that exceeds a budget
+    is aborted with an UnpicklingError before the offending payload is
+    allocated. Limits come from the policy (its
+    "limits" key) and from the limits= argument of the unpickler; when both
+    are given the smaller value of each budget applies.
+    """
+
+    __slots__ = ("max_opcodes", "max_bytes", "max_memo", "max_stack_depth", "max_payload")
+
+    def __init__(
+        self,
+        *,
+        max_opcodes=None,
+        max_bytes=None,
+        max_memo=None,
+        max_stack_depth=None,
+        max_payload=None,
+    ):
+        for name, value in (
+            ("max_opcodes", max_opcodes),
+            ("max_bytes", max_bytes),
+            ("max_memo", max_memo),
+            ("max_stack_depth", max_stack_depth),
+            ("max_payload", max_payload),
+        ):
+            if value is not None and (type(value) is not int or value <= 0):
+                raise ValueError(f"{name} must be a positive int or None, not {value!r}")
+            setattr(self, name, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build limits from the "limits" mapping of a JSON policy."""
+        if not isinstance(data, dict):
+            raise ValueError(f"limits must be an object, not {data!r}")
+        unknown = set(data).difference(cls.__slots__)
+        if unknown:
+            raise ValueError(f"unknown limits: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    def as_dict(self):
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        }
+
+    def tighten(self, other):
+        """Return the limits that satisfy both self and *other*."""
+        if other is None:
+            return self
+        values = {}
+        for name in self.__slots__:
+            mine, theirs = getattr(self, name), getattr(other, name)
+            values[name] = (
+                theirs if mine is None else mine if theirs is None else min(mine, theirs)
+            )
+        return LoadLimits(**values)
+
+    def __repr__(self):
+        args = ", ".join(f"{k}={v}" for k, v in self.as_dict().items())
+        return f"{self.__class__.__name__}({args})"
+
+
+def _merge_limits(policy_limits, limits):
+    # Budgets of a load: the stricter of the policy's and the caller's
+    if limits is None:
+        return policy_limits
+    if not isinstance(limits, LoadLimits):
+        limits = LoadLimits(**limits)
+    return limits.tighten(policy_limits)
+
+
+def _limit_exceeded(budget, limit, value):
+    _telemetry.count("limits_exceeded")
+    if _telemetry.sink is not None:
+        _telemetry.event("limit_exceeded", budget=budget, limit=limit, value=value)
+    if budget == "max_payload":
+        detail = f"declares a payload of {value} bytes"
+    elif budget == "max_bytes":
+        detail = f"is longer than {limit} bytes"
+    elif budget == "max_opcodes":
+        detail = f"executes more than {limit} opcodes"
+    elif budget == "max_memo":
+        detail = f"stores more than {limit} memo entries"
+    else:
+        detail = f"nests MARKs deeper than {limit}"
+    return UnpicklingError(f"pickle {detail} ({budget}={limit})")
+
+
+# Binary policies
+#
+# compile_policy_file() turns a JSON policy file into a compact binary image
+# that is loaded with mmap and never parsed as a whole. All integers are
+# little-endian. The image is laid out as:
+#
+#   header   _BINARY_POLICY_HEADER: magic, format version, the number of
+#            32-bit flag words per entry, the counts and offsets of the
+#            sections below, then the SHA-256 of the JSON file the image was
+#            compiled from (zero if unknown)
+#   models   _BINARY_POLICY_MODEL per model key: its name in the string
+#            area, its numbers of globals and reduces, its content digest
+#            and its LoadLimits (0 for no limit)
+#   nodes    _BINARY_POLICY_NODE per distinct dotted prefix or name: parent
+#            node (or _NO_NODE) and last component in the string area, so
+#            "torch.nn.modules.conv" is stored once for all of its names
+#   entries  per allowed name, its node followed by its flag words, read as
+#            one little-endian bit set; model m allows the name as a global
+#            if bit 2*m is set and as a reduce if bit 2*m+1 is
+#   buckets  open-addressing hash index of entry numbers (_EMPTY_BUCKET for
+#            free slots), indexed by the CRC-32 of the name and probed
+#            linearly
+#   strings  UTF-8 model names and distinct name components
+#
+# A model's digest is the SHA-256 of its content (see _policy_digest), so a
+# policy has the same digest in either format. Images of any other format
+# version are rejected and must be recompiled.
+
+_BINARY_POLICY_SUFFIX = ".pbp"
+_BINARY_POLICY_MAGIC = b"PBPOLICY"
+_BINARY_POLICY_VERSION = 4
+_BINARY_POLICY_HEADER = _struct.Struct("<8sHH11I32s")
+_BINARY_POLICY_MODEL = _struct.Struct("<IIII32s5Q")
+_BINARY_POLICY_NODE = _struct.Struct("<IIH")
+# Node of an entry; its flag words follow it
+_BINARY_POLICY_ENTRY = _struct.Struct("<I")
+_NO_NODE = 0xFFFFFFFF
+_EMPTY_BUCKET = 0xFFFFFFFF
+# Names remembered per _MappedNameSet after their first lookup
+_MAPPED_NAME_MEMO_SIZE = 8192
+
+
+def _policy_digest(model_name, globals, reduces, limits=None):
+    import json
+    from hashlib import sha256
+
+    content = [model_name, sorted(globals), sorted(reduces)]
+    if limits is not None:
+        content.append(limits.as_dict())
+    content = json.dumps(
+        content,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return sha256(content.encode("utf-8")).digest()
+
+
+def _build_binary_policy(models, source_digest=None):
+    """Return the binary image (bytes) of {model_name: (globals, reduces, limits)}.
+
+    *limits* is a LoadLimits or None. *source_digest* is the SHA-256 of the
+    JSON policy file the models were read from, if there is one.
+    """
+    from binascii import crc32
+
+    # Two flag bits per model
+    flag_words = max(1, (2 * len(models) + 31) // 32)
+    entry_size = _BINARY_POLICY_ENTRY.size + 4 * flag_words
+    strings = bytearray()
+    string_refs = {}
+
+    def add_string(text):
+        ref = string_refs.get(text)
+        if ref is None:
+            data = text.encode("utf-8")
+            if len(data) > 0xFFFF:
+                raise ValueError(f"policy name component too long: {text[:80]!r}")
+            ref = string_refs[text] = (len(strings), len(data))
+            strings.extend(data)
+        return ref
+
+    model_records = []
+    flags = {}
+    for m, (model_name, (globals, reduces, limits)) in enumerate(models.items()):
+        globals = set(globals)
+        reduces = set(reduces)
+        for name in globals:
+            flags[name] = flags.get(name, 0) | 1 << (2 * m)
+        for name in reduces:
+            flags[name] = flags.get(name, 0) | 1 << (2 * m + 1)
+        data = model_name.encode("utf-8")
+        model_records.append(
+            (
+                len(strings),
+                len(data),
+                len(globals),
+                len(reduces),
+                _policy_digest(model_name, globals, reduces, limits),
+                *(
+                    (getattr(limits, name) or 0) if limits is not None else 0
+                    for name in LoadLimits.__slots__
+                ),
+            )
+        )
+        strings.extend(data)
+
+    node_ids = {}
+    nodes = []
+
+    def add_node(path):
+        node = node_ids.get(path)
+        if node is None:
+            parent, dot, component = path.rpartition(".")
+            parent_id = add_node(parent) if dot else _NO_NODE
+            node = node_ids[path] = len(nodes)
+            nodes.append((parent_id,) + add_string(component))
+        return node
+
+    entries = []
+    hashes = []
+    for name in sorted(flags):
+        entries.append((add_node(name), flags[name]))
+        hashes.append(crc32(name.encode("utf-8")))
+
+    # Keep the hash index at most 3/4 full
+    bucket_count = 1
+    while bucket_count * 3 < len(entries) * 4:
+        bucket_count *= 2
+    buckets = [_EMPTY_BUCKET] * bucket_count
+    mask = bucket_count - 1
+    for index, h in enumerate(hashes):
+        slot = h & mask
+        while buckets[slot] != _EMPTY_BUCKET:
+            slot = (slot + 1) & mask
+        buckets[slot] = index
+
+    model_off = _BINARY_POLICY_HEADER.size
+    node_off = model_off + _BINARY_POLICY_MODEL.size * len(model_records)
+    entry_off = node_off + _BINARY_POLICY_NODE.size * len(nodes)
+    bucket_off = entry_off + entry_size * len(entries)
+    strings_off = bucket_off + 4 * bucket_count
+
+    out = bytearray(
+        _BINARY_POLICY_HEADER.pack(
+            _BINARY_POLICY_MAGIC,
+            _BINARY_POLICY_VERSION,
+            flag_words,
+            len(model_records),
+            model_off,
+            len(nodes),
+            node_off,
+            len(entries),
+            entry_off,
+            bucket_count,
+            bucket_off,
+            strings_off,
+            len(strings),
+            0,
+            source_digest or bytes(32),
+        )
+    )
+    for record in model_records:
+        out += _BINARY_POLICY_MODEL.pack(*record)
+    for node in nodes:
+        out += _BINARY_POLICY_NODE.pack(*node)
+    for node, entry_flags in entries:
+        out += _BINARY_POLICY_ENTRY.pack(node)
+        out += entry_flags.to_bytes(4 * flag_words, "little")
+    out += pack(f"<{bucket_count}I", *buckets)
+    out += strings
+    return bytes(out)
+
+
+def compile_policy_file(source, destination=None):
+    """Compile the JSON policy file *source* into a binary ".pbp" policy.
+
+    Every model key of the file is kept. *destination* defaults to *source*
+    with its suffix replaced by ".pbp". Returns the destination path.
+    """
+    source = os.fspath(source)
+    if destination is None:
+        destination = os.path.splitext(source)[0] + _BINARY_POLICY_SUFFIX
+    destination = os.fspath(destination)
+    import json
+    from hashlib import sha256
+
+    with open(source, "rb") as f:
+        content = f.read()
+    data = json.loads(content.decode("utf-8"))
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f"{source}: not a PickleBall policy")
+    image = _build_binary_policy(
+        {
+            model_name: (
+                spec.get("globals", []),
+                spec.get("reduces", []),
+                _policy_limits(spec),
+            )
+            for model_name, spec in data.items()
+        },
+        sha256(content).digest(),
+    )
+    # Write next to the destination and rename, so that processes that have
+    # the previous version mapped keep a consistent image.
+    tmp = f"{destination}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(image)
+    os.replace(tmp, destination)
+    return destination
+
+
+class _BinaryPolicyImage:
+    # Read-only view of a mapped binary policy
+
+    def __init__(self, buf):
+        from binascii import crc32
+
+        self._crc32 = crc32
+        self.buf = buf
+        (
+            magic,
+            version,
+            flag_words,
+            self.model_count,
+            self.model_off,
+            self.node_count,
+            self.node_off,
+            self.entry_count,
+            self.entry_off,
+            self.bucket_count,
+            self.bucket_off,
+            self.strings_off,
+            strings_len,
+            _,
+            digest,
+        ) = _BINARY_POLICY_HEADER.unpack_from(buf, 0)
+        if magic != _BINARY_POLICY_MAGIC:
+            raise ValueError("not a PickleBall binary policy")
+        if version != _BINARY_POLICY_VERSION:
+            raise ValueError(
+                f"unsupported binary policy version {version}; recompile it"
+            )
+        # SHA-256 of the JSON source, or None if the image does not record it
+        self.source_digest = digest if any(digest) else None
+        self.entry_size = _BINARY_POLICY_ENTRY.size + 4 * flag_words
+        if (
+            2 * self.model_count > 32 * flag_words
+            or self.model_off + _BINARY_POLICY_MODEL.size * self.model_count
+            > self.node_off
+            or self.node_off + _BINARY_POLICY_NODE.size * self.node_count
+            > self.entry_off
+            or self.entry_off + self.entry_size * self.entry_count
+            > self.bucket_off
+            or self.bucket_off + 4 * self.bucket_count > self.strings_off
+            or self.strings_off + strings_len > len(buf)
+            or self.bucket_count & (self.bucket_count - 1)
+            or self.bucket_count < self.entry_count
+        ):
+            raise ValueError("truncated or corrupt binary policy")
+
+    def models(self):
+        # (name, global count, reduce count, digest, limits) of every model
+        model_struct = _BINARY_POLICY_MODEL
+        for m in range(self.model_count):
+            name_off, name_len, globals, reduces, digest, *budgets = (
+                model_struct.unpack_from(self.buf, self.model_off + model_struct.size * m)
+            )
+            start = self.strings_off + name_off
+            name = str(self.buf[start : start + name_len], "utf-8")
+            limits = None
+            if any(budgets):
+                limits = LoadLimits(
+                    **{k: v for k, v in zip(LoadLimits.__slots__, budgets) if v}
+                )
+            yield name, globals, reduces, digest, limits
+
+    def _node_name(self, node):
+        buf = self.buf
+        node_unpack = _BINARY_POLICY_NODE.unpack_from
+        parts = []
+        # A well-formed image has no cycles; bound the walk in case it does
+        for _ in range(self.node_count):
+            if node >= self.node_count:
+                raise ValueError("corrupt binary policy node")
+            node, off, length = node_unpack(
+                buf, self.node_off + _BINARY_POLICY_NODE.size * node
+            )
+            start = self.strings_off + off
+            parts.append(buf[start : start + length])
+            if node == _NO_NODE:
+                break
+        return b".".join(reversed(parts))
+
+    def flags(self, name):
+        """Return the flags of *name*, or 0 if no model lists it."""
+        data = name.encode("utf-8", "surrogatepass")
+        mask = self.bucket_count - 1
+        slot = self._crc32(data) & mask
+        unpack_from = _struct.unpack_from
+        for _ in range(self.bucket_count):
+            (index,) = unpack_from("<I", self.buf, self.bucket_off + 4 * slot)
+            if index >= self.entry_count:
+                return 0
+            node, flags = self._entry(index)
+            if self._node_name(node) == data:
+                return flags
+            slot = (slot + 1) & mask
+        return 0
+
+    def _entry(self, index):
+        # (node, flags) of entry *index*
+        off = self.entry_off + self.entry_size * index
+        (node,) = _BINARY_POLICY_ENTRY.unpack_from(self.buf, off)
+        off += _BINARY_POLICY_ENTRY.size
+        return node, int.from_bytes(
+            self.buf[off : off + self.entry_size - _BINARY_POLICY_ENTRY.size], "little"
+        )
+
+    def names(self, flag):
+        for index in range(self.entry_count):
+            node, flags = self._entry(index)
+            if flags & flag:
+                yield str(self._node_name(node), "utf-8")
+
+
+class _MappedNameSet:
+    """Set of allowed names backed by a mapped binary policy.
+
+    Membership is looked up in the image's hash index and remembered, so a
+    name costs one dict lookup after its first check.
+    """
+
+    __slots__ = ("_image", "_flag", "_size", "_memo")
+
+    def __init__(self, image, flag, size):
+        self._image = image
+        self._flag = flag
+        self._size = size
+        self._memo = {}
+
+    def __contains__(self, name):
+        try:
+            return self._memo[name]
+        except KeyError:
+            pass
+        except TypeError:
+            return False
+        if type(name) is not str:
+            return False
+        found = bool(self._image.flags(name) & self._flag)
+        if len(self._memo) < _MAPPED_NAME_MEMO_SIZE:
+            self._memo[name] = found
+        return found
+
+    def __iter__(self):
+        return self._image.names(self._flag)
+
+    def __len__(self):
+        return self._size
+
+
+def _load_binary_policies(policy_path):
+    """Return the compiled policies of every model in a binary policy."""
+    import mmap
+
+    with open(policy_path, "rb") as f:
+        buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    image = _BinaryPolicyImage(buf)
+    return [
+        _CompiledPolicy(
+            policy_path,
+            model_name,
+            _MappedNameSet(image, 1 << (2 * m), globals),
+            _MappedNameSet(image, 1 << (2 * m + 1), reduces),
+            digest,
+            limits,
+        )
+        for m, (model_name, globals, reduces, digest, limits) in enumerate(
+            image.models()
+        )
+    ]
+
+
+class _CompiledPolicy:
+    """Immutable, pre-hashed form of a PickleBall policy.
+
+    The allowed globals and reduces are held as frozensets so that every
+    check made while loading is a single hashed lookup. Compiled policies
+    are shared by all unpicklers that load the same policy file. *limits*
+    holds the policy's LoadLimits, if it sets any.
+    """
+
+    __slots__ = ("path", "model_name", "globals", "reduces", "limits", "_digest")
+
+    def __init__(self, path, model_name, globals, reduces, digest=None, limits=None):
+        self.path = path
+        self.model_name = model_name
+        # Binary policies bring their own name sets (see _MappedNameSet)
+        if not isinstance(globals, _MappedNameSet):
+            globals = frozenset(globals)
+        if not isinstance(reduces, _MappedNameSet):
+            reduces = frozenset(reduces)
+        self.globals = globals
+        self.reduces = reduces
+        self.limits = limits
+        self._digest = digest
+
+    @property
+    def digest(self):
+        """SHA-256 of the policy's content, independent of its file format."""
+        if self._digest is None:
+            self._digest = _policy_digest(
+                self.model_name, self.globals, self.reduces, self.limits
+            )
+        return self._digest
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} {self.model_name!r} from {self.path!r}: "
+            f"{len(self.globals)} globals, {len(self.reduces)} reduces>"
+        )
+
+
+_EMPTY_POLICY = _CompiledPolicy(None, None, (), ())
+
+# Compiled policies, keyed by policy file path. Each value is a
+# (mtime_ns, _CompiledPolicy) pair so that an edited policy file is
+# re-parsed the next time an unpickler is created.
+_compiled_policies = {}
+_compiled_policies_lock = _thread.allocate_lock()
+
+
+def _compile_policy(policy_path):
+    """Return the compiled policy stored at *policy_path*.
+
+    The file is parsed at most once per modification time; a missing
+    policy file yields an empty policy that allows nothing. Files ending in
+    ".pbp" hold binary policies written by compile_policy_file() and are
+    memory-mapped rather than parsed.
+    """
+    try:
+        st = os.stat(policy_path)
+    except OSError:
+        return _EMPTY_POLICY
+    if not stat.S_ISREG(st.st_mode):
+        return _EMPTY_POLICY
+
+    cached = _compiled_policies.get(policy_path)
+    if cached is not None and cached[0] == st.st_mtime_ns:
+        return cached[1]
+
+    # Compile each file once even when several threads start loading at the
+    # same time
+    with _compiled_policies_lock:
+        cached = _compiled_policies.get(policy_path)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached[1]
+
+        if policy_path.endswith(_BINARY_POLICY_SUFFIX):
+            try:
+                policies = _load_binary_policies(policy_path)
+            except (OSError, ValueError, _StructError) as exc:
+                if _telemetry.level <= _WARNING:
+                    _telemetry.log(f"Error loading binary policy {policy_path}: {exc}")
+                policies = [_CompiledPolicy(policy_path, None, (), ())]
+            assert len(policies) == 1
+            _compiled_policies[policy_path] = (st.st_mtime_ns, policies[0])
+            return policies[0]
+
+        model_name = None
+        globals_list = []
+        reduces_list = []
+        limits = None
+        try:
+            data = _read_policy_file(policy_path)
+        except FileNotFoundError:
+            if _telemetry.level <= _WARNING:
+                _telemetry.log(f"Policy file {policy_path} not found")
+            return _EMPTY_POLICY
+        if data is not None:
+            model_keys = list(data.keys())
+            assert len(model_keys) == 1
+            model_name = model_keys[0]
+            try:
+                limits = _policy_limits(data.get(model_name, {}))
+            except ValueError as exc:
+                # Like an unreadable policy, invalid limits allow nothing
+                if _telemetry.level <= _WARNING:
+                    _telemetry.log(f"Invalid limits in policy file {policy_path}: {exc}")
+                data = {}
+            globals_list = data.get(model_name, {}).get("globals", [])
+            reduces_list = data.get(model_name, {}).get("reduces", [])
+
+        policy = _CompiledPolicy(
+            policy_path, model_name, globals_list, reduces_list, limits=limits
+        )
+        _compiled_policies[policy_path] = (st.st_mtime_ns, policy)
+        return policy
+
+
+def _policy_limits(spec):
+    # LoadLimits of one model entry of a JSON policy, or None
+    limits = spec.get("limits")
+    return None if limits is None else LoadLimits.from_dict(limits)
+
+
+def _read_policy_file(policy_path):
+    # Parsed JSON of a policy file, or None if it is not valid JSON
+    import json
+
+    if _telemetry.level <= _INFO:
+        _telemetry.log(f"Loading policy file: {policy_path}")
+    with open(policy_path, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            if _telemetry.level <= _WARNING:
+                _telemetry.log(f"Error decoding JSON in file {policy_path}")
+            return None
+
+
+# Policy selected by using_policy() for the current context
+_active_policy = _ContextVar("pickleball_active_policy", default=None)
+
+
+def _resolve_policy(policy):
+    # Accept a compiled policy, a policy file path, or None for the policy
+    # of the current context: using_policy(), then install(), then the
+    # policy.json in POLICY_PATH.
+    if policy is None:
+        policy = _active_policy.get()
+        if policy is None:
+            policy = _installed_policy
+        if policy is None:
+            return _compile_policy(_default_policy_path())
+    if isinstance(policy, _CompiledPolicy):
+        return policy
+    return _compile_policy(os.fspath(policy))
+
+
+def _default_policy_path():
+    # The compiled form of the policy in POLICY_PATH, when there is one and
+    # it was compiled from the current policy.json
+    source = os.path.join(POLICY_PATH, "policy.json")
+    binary = os.path.join(POLICY_PATH, "policy" + _BINARY_POLICY_SUFFIX)
+    if os.path.exists(binary) and _binary_policy_current(binary, source):
+        return binary
+    return source
+
+
+# (binary, source) -> (stat of both, whether binary is current)
+_binary_policy_checks = {}
+
+
+def _binary_policy_current(binary, source):
+    """Return whether the binary policy *binary* was compiled from *source*.
+
+    Images that record the SHA-256 of their JSON source are compared with
+    the current source; images that do not must not be older than it, and
+    images of another format version are never current. A binary policy
+    without its source next to it is current. A stale binary policy
+    is reported once for each version of the two files.
+    """
+    from hashlib import sha256
+
+    try:
+        bst = os.stat(binary)
+    except OSError:
+        return False
+    try:
+        sst = os.stat(source)
+    except OSError:
+        return True
+    stats = (bst.st_mtime_ns, bst.st_size, sst.st_mtime_ns, sst.st_size)
+    cached = _binary_policy_checks.get((binary, source))
+    if cached is not None and cached[0] == stats:
+        return cached[1]
+    try:
+        with open(binary, "rb") as f:
+            header = f.read(_BINARY_POLICY_HEADER.size)
+        magic, version, *_, recorded = _BINARY_POLICY_HEADER.unpack(header)
+        if magic != _BINARY_POLICY_MAGIC or version != _BINARY_POLICY_VERSION:
+            # Not an image this enforcer can read
+            current = False
+        elif any(recorded):
+            with open(source, "rb") as f:
+                current = sha256(f.read()).digest() == recorded
+        else:
+            current = bst.st_mtime_ns >= sst.st_mtime_ns
+    except (OSError, _StructError):
+        current = False
+    if not current and _telemetry.level <= _WARNING:
+        _telemetry.log(
+            f"Binary policy {binary} was not compiled from the current "
+            f"{source}; using {source}"
+        )
+    _binary_policy_checks[binary, source] = (stats, current)
+    return current
+
+
+class _UsingPolicy:
+
+    def __init__(self, policy):
+        self.policy = policy
+        self._token = None
+
+    def __enter__(self):
+        self._token = _active_policy.set(self.policy)
+        return _resolve_policy(self.policy)
+
+    def __exit__(self, *exc_info):
+        _active_policy.reset(self._token)
+
+
+def using_policy(policy):
+    """Return a context manager that selects the policy of enforced loads.
+
+    *policy* is a compiled policy (for instance from a PolicyStore) or the
+    path of a policy file. Loads in the body that are not given a policy
+    explicitly use it, including loads made through install()ed hooks. The
+    selection is local to the current thread or asyncio task.
+    """
+    if policy is None:
+        raise TypeError("using_policy() requires a policy")
+    return _UsingPolicy(policy)
+
+
+def _policy_class_location(model_name):
+    # Split a policy key such as "flair/models/model.py:<module>.Tagger"
+    # into the dotted module path ("flair.models.model") and the class
+    # qualname ("Tagger"); None if the key has another shape.
+    path, sep, qualname = model_name.rpartition(":")
+    if not sep or not qualname.startswith("<module>."):
+        return None
+    qualname = qualname[len("<module>."):]
+    if path.endswith(".py"):
+        path = path[:-3]
+    if path.endswith("/__init__"):
+        path = path[: -len("/__init__")]
+    return path.replace("/", "."), qualname
+
+
+class PolicyStore:
+    """Compiled index of every policy file in a directory.
+
+    Each top-level key of each ``*.json`` file in *directory* becomes one
+    compiled policy; binary ``*.pbp`` files (see compile_policy_file) are
+    mapped instead, and replace the JSON file with the same name when they
+    were compiled from it. A policy can be looked up by its model class
+    key, by the name of the file that holds it (without ``.json``), by the
+    unqualified class name when that is unambiguous, or by the model class
+    object itself (see policy_for_class). refresh() re-reads files that
+    changed since the store was built; it may run while other threads look
+    up policies, which see either the old or the new set of files.
+
+    >>> store = PolicyStore("evaluation/policies/baseline")  # doctest: +SKIP
+    >>> with store.using("flair"):  # doctest: +SKIP
+    ...     model = torch.load("pytorch_model.bin")
+    """
+
+    def __init__(self, directory):
+        self.directory = os.fspath(directory)
+        # Parsed files, keyed by path, as (mtime_ns, [policies]) pairs
+        self._files = {}
+        self._policies = {}
+        self._aliases = {}
+        self._classes = {}
+        self._lock = _thread.allocate_lock()
+        self.refresh()
+
+    def refresh(self):
+        """Re-scan the directory, re-compiling new and modified files."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        files = {}
+        with os.scandir(self.directory) as entries:
+            paths = sorted(
+                entry.path
+                for entry in entries
+                if entry.name.endswith((".json", _BINARY_POLICY_SUFFIX))
+                and entry.is_file()
+            )
+        binary = {path for path in paths if path.endswith(_BINARY_POLICY_SUFFIX)}
+        # Compiled copies of an older version of their JSON file
+        stale = {
+            path
+            for path in binary
+            if not _binary_policy_current(
+                path, path[: -len(_BINARY_POLICY_SUFFIX)] + ".json"
+            )
+        }
+        for path in paths:
+            if path in stale:
+                continue
+            if path.endswith(".json"):
+                # A compiled copy of the same policy takes its place
+                compiled = path[: -len(".json")] + _BINARY_POLICY_SUFFIX
+                if compiled in binary and compiled not in stale:
+                    continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                cached = self._files.get(path)
+                if cached is not None and cached[0] == mtime:
+                    files[path] = cached
+                else:
+                    files[path] = (mtime, self._compile_file(path))
+            except OSError:
+                continue
+        self._files = files
+        self._build_index()
+
+    def _compile_file(self, path):
+        if path.endswith(_BINARY_POLICY_SUFFIX):
+            try:
+                return _load_binary_policies(path)
+            except (ValueError, _StructError) as exc:
+                if _telemetry.level <= _WARNING:
+                    _telemetry.log(f"Error loading binary policy {path}: {exc}")
+                return []
+        data = _read_policy_file(path)
+        if not isinstance(data, dict):
+            return []
+        policies = []
+        for model_name, spec in data.items():
+            try:
+                limits = _policy_limits(spec)
+            except ValueError as exc:
+                if _telemetry.level <= _WARNING:
+                    _telemetry.log(
+                        f"Invalid limits for {model_name} in {path}: {exc}"
+                    )
+                spec, limits = {}, None
+            policies.append(
+                _CompiledPolicy(
+                    path,
+                    model_name,
+                    spec.get("globals", []),
+                    spec.get("reduces", []),
+                    limits=limits,
+                )
+            )
+        return policies
+
+    def _build_index(self):
+        policies = {}
+        aliases = {}
+        classes = {}
+        for path, (_, compiled) in self._files.items():
+            for policy in compiled:
+                if policy.model_name in policies and _telemetry.level <= _WARNING:
+                    _telemetry.log(
+                        f"Policy for {policy.model_name} in {path} overrides "
+                        f"{policies[policy.model_name].path}"
+                    )
+                policies[policy.model_name] = policy
+                location = _policy_class_location(policy.model_name)
+                if location is not None:
+                    module, qualname = location
+                    classes.setdefault(qualname, []).append((module, policy))
+                    short = qualname.rpartition(".")[2]
+                    aliases.setdefault(short, []).append(policy)
+            if len(compiled) == 1:
+                stem = os.path.splitext(os.path.basename(path))[0]
+                aliases[stem] = [compiled[0]]
+        self._policies = policies
+        self._aliases = aliases
+        self._classes = classes
+
+    def policy_for_class(self, cls):
+        """Return the policy for model class *cls* or its nearest base class.
+
+        A policy matches a class when the class's qualname equals the one in
+        the policy key and the key's module path is a suffix of the class's
+        module (policy keys are relative to the library's source root).
+        """
+        for klass in cls.__mro__:
+            module = klass.__module__
+            for key_module, policy in self._classes.get(klass.__qualname__, ()):
+                if module == key_module or module.endswith("." + key_module):
+                    return policy
+        raise KeyError(f"no policy for class {cls.__module__}.{cls.__qualname__}")
+
+    def __getitem__(self, key):
+        if isinstance(key, type):
+            return self.policy_for_class(key)
+        try:
+            return self._policies[key]
+        except KeyError:
+            pass
+        candidates = self._aliases.get(key, ())
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates:
+            names = ", ".join(sorted(p.model_name for p in candidates))
+            raise KeyError(f"ambiguous policy name {key!r}: {names}")
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        return iter(self._policies)
+
+    def __len__(self):
+        return len(self._policies)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.directory!r}: {len(self)} policies>"
+
+    def using(self, key):
+        """Return using_policy() for the policy that self[key] selects."""
+        return using_policy(self[key])
+
+
+# Objects resolved by _Unpickler.find_class for allowed names. Keys include
+# the compiled policy, so replacing a policy never serves a stale allowance.
+# They do not include the unpickler class: subclasses that remap names (e.g.
+# torch's unpickler, a new class on every torch.load) resolve the remapped
+# name through super().find_class and share the entries.
+# Lookups read the dict without locking; insertions, evictions and the
+# counters are serialized by _find_class_cache_lock.
+_FIND_CLASS_CACHE_SIZE = 4096
+_find_class_cache = {}
+_find_class_cache_lock = _thread.allocate_lock()
+_find_class_cache_hits = 0
+_find_class_cache_misses = 0
+
+
+def find_class_cache_info():
+    """Return hit/miss counters and the current size of the find_class cache."""
+    with _find_class_cache_lock:
+        return {
+            "hits": _find_class_cache_hits,
+            "misses": _find_class_cache_misses,
+            "size": len(_find_class_cache),
+            "maxsize": _FIND_CLASS_CACHE_SIZE,
+        }
+
+
+def clear_find_class_cache():
+    """Drop every cached find_class resolution and reset the counters."""
+    global _find_class_cache_hits, _find_class_cache_misses
+    with _find_class_cache_lock:
+        _find_class_cache.clear()
+        _find_class_cache_hits = 0
+        _find_class_cache_misses = 0
 
 # Shortcut for use in isinstance testing
 bytes_types = (bytes, bytearray)
@@ -265,7 +1450,16 @@ BYTEARRAY8 = b"\x96"  # push bytearray
 NEXT_BUFFER = b"\x97"  # push next out-of-band buffer
 READONLY_BUFFER = b"\x98"  # make top of stack readonly
 
-__all__.extend([x for x in dir() if re.match("[A-Z][A-Z0-9_]+$", x)])
+# The opcode names, as matched by re.match("[A-Z][A-Z0-9_]+$", x) without
+# importing re
+_OPCODE_NAME_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+__all__.extend(
+    [
+        x
+        for x in dir()
+        if len(x) > 1 and "A" <= x[0] <= "Z" and _OPCODE_NAME_CHARS.issuperset(x)
+    ]
+)
 
 
 class _Framer:
@@ -333,57 +1527,226 @@ class _Framer:
 
 class _Unframer:
 
-    def __init__(self, file_read, file_readline, file_tell=None):
+    def __init__(self, file_read, file_readline):
         self.file_read = file_read
         self.file_readline = file_readline
-        self.current_frame = None
+        # The current frame; buf[pos:limit] is the part not read yet. The
+        # load loop reads opcodes from it directly.
+        self.buf = b""
+        self.pos = 0
+        self.limit = 0
 
     def readinto(self, buf):
-        if self.current_frame:
-            n = self.current_frame.readinto(buf)
-            if n == 0 and len(buf) != 0:
-                self.current_frame = None
-                n = len(buf)
-                buf[:] = self.file_read(n)
-                return n
-            if n < len(buf):
+        n = len(buf)
+        pos = self.pos
+        if pos < self.limit:
+            end = pos + n
+            if end > self.limit:
                 raise UnpicklingError("pickle exhausted before end of frame")
+            buf[:] = memoryview(self.buf)[pos:end]
+            self.pos = end
             return n
         else:
-            n = len(buf)
-            buf[:] = self.file_read(n)
-            return n
+            data = self.file_read(n)
+            k = len(data)
+            buf[:k] = data
+            return k
 
     def read(self, n):
-        if self.current_frame:
-            data = self.current_frame.read(n)
-            if not data and n != 0:
-                self.current_frame = None
-                return self.file_read(n)
-            if len(data) < n:
+        pos = self.pos
+        if pos < self.limit:
+            end = pos + n
+            if end > self.limit:
                 raise UnpicklingError("pickle exhausted before end of frame")
-            return data
+            self.pos = end
+            return self.buf[pos:end]
         else:
             return self.file_read(n)
 
-    def readline(self):
-        if self.current_frame:
-            data = self.current_frame.readline()
-            if not data:
-                self.current_frame = None
-                return self.file_readline()
-            if data[-1] != b"\n"[0]:
-                raise UnpicklingError("pickle exhausted before end of frame")
-            return data
-        else:
+    def readline(self, size=-1):
+        # At most *size* bytes when size is not negative, like io readline()
+        pos = self.pos
+        if pos < self.limit:
+            end = self.limit
+            if 0 <= size < end - pos:
+                end = pos + size
+            i = self.buf.find(b"\n", pos, end)
+            if i < 0:
+                if end == self.limit:
+                    raise UnpicklingError("pickle exhausted before end of frame")
+                i = end - 1
+            self.pos = i + 1
+            return self.buf[pos : i + 1]
+        elif size < 0:
             return self.file_readline()
+        else:
+            return self.file_readline(size)
+
+    def load_frame(self, frame_size):
+        if self.pos < self.limit:
+            raise UnpicklingError(
+                "beginning of a new frame before end of current frame"
+            )
+        self.buf = self.file_read(frame_size)
+        self.pos = 0
+        self.limit = len(self.buf)
+
+    def at_eof(self):
+        """Return whether the pickle data is exhausted."""
+        if self.pos < self.limit:
+            return False
+        key = self.file_read(1)
+        if not key:
+            return True
+        # Keep the byte as a one-byte frame; the load loop takes the next
+        # opcode from it as from any frame
+        self.buf = key
+        self.pos = 0
+        self.limit = 1
+        return False
+
+    def close(self):
+        # Nothing to release; see _MmapUnframer.close
+        pass
+
+
+# File objects whose fileno() is the pickle data itself, and therefore safe
+# to map. Wrappers such as gzip.GzipFile also have a fileno(), but it refers
+# to the compressed stream.
+_MMAP_FILE_TYPES = (io.BufferedReader, io.FileIO)
+
+# Smaller inputs are read through _Unframer
+_MMAP_MIN_SIZE = 64 * 1024
+
+# Consumed parts of a mapping are dropped from memory in steps of this size
+_MMAP_RELEASE_SIZE = 8 * 1024 * 1024
+
+
+class _MmapUnframer:
+    """Reader over a memory-mapped pickle file, in place of _Unframer.
+
+    Frames are tracked as positions in the mapping, so neither frames nor
+    opcode arguments are copied: read() returns memoryview slices and
+    callers convert them only when the value must outlive the load.
+    close() moves the file position to the end of the pickle, as reading
+    through the file would have.
+
+    Pages that the load has read past are released every _MMAP_RELEASE_SIZE
+    bytes, so that a load which copies what it reads does not keep both the
+    mapped file and the copies resident. The mapping is read-only, so a
+    released page that is read again (through a zero-copy memoryview, for
+    instance) is faulted back in from the file.
+    """
+
+    def __init__(self, file, mm, start, pagesize):
+        self._file = file
+        self._mmap = mm
+        self.buf = memoryview(mm)
+        self.pos = start
+        self.size = len(mm)
+        # End of the current frame, or of the file outside of frames
+        self.limit = self.size
+        self.in_frame = False
+        self._pagesize = pagesize
+        # Pages before _released are released; the next release is due
+        # once a read reaches _release_at
+        self._released = start - start % pagesize
+        self._release_at = start + _MMAP_RELEASE_SIZE
+
+    @classmethod
+    def open(cls, file):
+        """Map *file* from its current position, or return None if it can't be."""
+        try:
+            fileno = file.fileno()
+            start = file.tell()
+            st = os.fstat(fileno)
+        except (OSError, ValueError):
+            return None
+        if not stat.S_ISREG(st.st_mode) or st.st_size - start < _MMAP_MIN_SIZE:
+            return None
+        import mmap
+
+        try:
+            mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        return cls(file, mm, start, mmap.PAGESIZE)
+
+    def _release(self):
+        # Release the pages before the current position
+        end = self.pos - self.pos % self._pagesize
+        if end > self._released:
+            import mmap
+
+            try:
+                self._mmap.madvise(
+                    mmap.MADV_DONTNEED, self._released, end - self._released
+                )
+            except (AttributeError, OSError, ValueError):
+                # No madvise() on this platform; the pages stay resident
+                pass
+            self._released = end
+        self._release_at = self.pos + _MMAP_RELEASE_SIZE
+
+    def _end_frame(self):
+        self.in_frame = False
+        self.limit = self.size
+
+    def read(self, n):
+        pos = self.pos
+        if pos >= self._release_at:
+            self._release()
+        if self.in_frame and pos >= self.limit:
+            self._end_frame()
+        end = pos + n
+        if end > self.limit:
+            if self.in_frame:
+                raise UnpicklingError("pickle exhausted before end of frame")
+            end = self.limit
+        self.pos = end
+        return self.buf[pos:end]
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        k = len(data)
+        buf[:k] = data
+        return k
+
+    def readline(self, size=-1):
+        pos = self.pos
+        if self.in_frame and pos >= self.limit:
+            self._end_frame()
+        end = self.limit
+        if 0 <= size < end - pos:
+            end = pos + size
+        i = self._mmap.find(b"\n", pos, end)
+        if i >= 0:
+            end = i + 1
+        elif self.in_frame and end == self.limit:
+            raise UnpicklingError("pickle exhausted before end of frame")
+        self.pos = end
+        return self._mmap[pos:end]
 
     def load_frame(self, frame_size):
-        if self.current_frame and self.current_frame.read() != b"":
+        if self.in_frame and self.pos < self.limit:
             raise UnpicklingError(
                 "beginning of a new frame before end of current frame"
             )
-        self.current_frame = io.BytesIO(self.file_read(frame_size))
+        self.in_frame = True
+        self.limit = min(self.pos + frame_size, self.size)
+
+    def at_eof(self):
+        return self.pos >= self.size
+
+    def close(self):
+        self._file.seek(self.pos)
+        self.buf.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Zero-copy payloads still reference the mapping; it is
+            # unmapped when the last of them is released.
+            pass
 
 
 # Tools used for pickling.
@@ -1255,10 +2618,102 @@ class _Pickler:
 # Unpickling machinery
 
 
+# Exact types whose SETITEMS can be applied with dict.update; subclasses may
+# override __setitem__ (OrderedDict, Counter) and take the per-item path.
+_BULK_DICT_TYPES = frozenset({dict, _defaultdict})
+
+# Marks unused slots of the list-backed unpickler memo. A list memo may have
+# at most _MEMO_MAX_GAP unused slots more than it has entries.
+_MEMO_MISSING = object()
+_MEMO_MAX_GAP = 1024
+
+
+class _MemoView(_MutableMapping):
+    """Live {index: object} view of an _Unpickler's memo.
+
+    Reads and writes go to the memo the unpickler loads with, in either of
+    its forms, so that an assignment is seen by the GET opcodes of later
+    loads.
+    """
+
+    __slots__ = ("_unpickler",)
+
+    def __init__(self, unpickler):
+        self._unpickler = unpickler
+
+    def __getitem__(self, i):
+        memo = self._unpickler._memo
+        if type(memo) is list and (type(i) is not int or i < 0):
+            raise KeyError(i)
+        try:
+            value = memo[i]
+        except (KeyError, IndexError):
+            raise KeyError(i) from None
+        if value is _MEMO_MISSING:
+            raise KeyError(i)
+        return value
+
+    def __setitem__(self, i, value):
+        if type(i) is not int:
+            raise TypeError("memo key must be integers")
+        if i < 0:
+            raise ValueError(f"negative memo index {i}")
+        self._unpickler._memo_put(i, value)
+
+    def __delitem__(self, i):
+        if i not in self:
+            raise KeyError(i)
+        unpickler = self._unpickler
+        memo = unpickler._memo
+        if type(memo) is dict:
+            del memo[i]
+            return
+        memo[i] = _MEMO_MISSING
+        unpickler._memo_holes += 1
+        # Keep the list free of trailing unused slots
+        while memo and memo[-1] is _MEMO_MISSING:
+            memo.pop()
+            unpickler._memo_holes -= 1
+        unpickler._memo_compact = not unpickler._memo_holes
+
+    def __iter__(self):
+        memo = self._unpickler._memo
+        if type(memo) is dict:
+            return iter(list(memo))
+        return iter([i for i, v in enumerate(memo) if v is not _MEMO_MISSING])
+
+    def __len__(self):
+        unpickler = self._unpickler
+        memo = unpickler._memo
+        if type(memo) is dict:
+            return len(memo)
+        return len(memo) - unpickler._memo_holes
+
+    def clear(self):
+        self._unpickler.memo = {}
+
+    def copy(self):
+        """Return a {index: object} dict of the memo."""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.copy()!r})"
+
+
 class _Unpickler:
 
     def __init__(
-        self, file, *, fix_imports=True, encoding="ASCII", errors="strict", buffers=None
+        self,
+        file,
+        *,
+        fix_imports=True,
+        encoding="ASCII",
+        errors="strict",
+        buffers=None,
+        use_mmap=True,
+        zero_copy=False,
+        policy=None,
+        limits=None,
     ):
         """This takes a binary file for reading a pickle data stream.
 
@@ -1296,40 +2751,46 @@ class _Unpickler:
         to decode 8-bit string instances pickled by Python 2; these
         default to 'ASCII' and 'strict', respectively. *encoding* can be
         'bytes' to read these 8-bit string instances as bytes objects.
-        """
 
-        policy_path = os.path.join(POLICY_PATH, "policy.json")
+        When *file* is a regular file opened with open() and *use_mmap* is
+        true (the default), the pickle is read through a memory mapping
+        instead of read() calls. With *zero_copy*, BINBYTES and BINBYTES8
+        payloads of a mapped file are returned as read-only memoryviews of
+        the mapping rather than copied into bytes objects.
 
-        self.allowed_globals = []
-        self.allowed_reduces = []
+        *policy* selects the policy to enforce: a compiled policy (for
+        instance from a PolicyStore) or the path of a policy file. When it
+        is None, the policy chosen by using_policy() or install() is used,
+        and otherwise the policy.json in POLICY_PATH.
 
-        globals_list = []
-        reduces_list = []
-        if os.path.isfile(policy_path):
-            try:
-                print(f"Loading policy file: {policy_path}")
-                with open(policy_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    model_keys = list(data.keys())
-                    assert len(model_keys) == 1
-                    model_name = model_keys[0]
-                    globals_list = data.get(model_name, {}).get("globals", [])
-                    reduces_list = data.get(model_name, {}).get("reduces", [])
-            except FileNotFoundError:
-                print(f"Policy file {policy_path} not found")
-            except json.JSONDecodeError:
-                print(f"Error decoding JSON in file {policy_path}")
-            finally:
-                self.allowed_globals = globals_list
-                self.allowed_reduces = reduces_list
+        *limits* is a LoadLimits (or a dict of its arguments) bounding the
+        resources of each load; it is combined with the limits of the
+        policy, if any.
+        """
 
-        print(self.allowed_globals)
-        print(self.allowed_reduces)
+        self.policy = _resolve_policy(policy)
+        self.limits = _merge_limits(self.policy.limits, limits)
+        self.allowed_globals = self.policy.globals
+        self.allowed_reduces = self.policy.reduces
+
+        if _telemetry.level <= _DEBUG:
+            _telemetry.log(f"Allowed globals: {sorted(self.allowed_globals)}")
+            _telemetry.log(f"Allowed reduces: {sorted(self.allowed_reduces)}")
 
         self._buffers = iter(buffers) if buffers is not None else None
+        self._file = file
         self._file_readline = file.readline
         self._file_read = file.read
+        self.use_mmap = use_mmap
+        self.zero_copy = zero_copy
         self.memo = {}
+        self._stubs = {}
+        self._reduce_verdicts = {}
+        # Budget check of the current load's reads (see _charge_reads)
+        self._check_read = None
+        # Allowed globals resolved by the current load, while the verdict
+        # cache records them
+        self._used_globals = None
         self.encoding = encoding
         self.errors = errors
         self.proto = 0
@@ -1340,9 +2801,22 @@ class _Unpickler:
 
         Return the reconstituted object hierarchy specified in the file.
         """
+        self._prepare_load()
+
+        cache = _verdict_cache
+        if (
+            cache is not None
+            and not self.zero_copy
+            and self.limits is None
+            and self.dispatch is _Unpickler.dispatch
+        ):
+            return self._load_cached(cache)
+        return self._load_opcodes()
 
-        # Placeholder file to make sure the PickleBall loader was used
-        PLACEHOLDER_FILE_PATH.touch()
+    def _prepare_load(self):
+        if USE_PLACEHOLDER_FILE:
+            # Placeholder file to make sure the PickleBall loader was used
+            _touch_placeholder_file()
 
         # Check whether Unpickler was initialized correctly. This is
         # only needed to mimic the behavior of _pickle.Unpickler.dump().
@@ -1352,28 +2826,271 @@ class _Unpickler:
                 "%s.__init__()" % (self.__class__.__name__,)
             )
 
-        self._unframer = _Unframer(self._file_read, self._file_readline)
-        self.read = self._unframer.read
-        self.readinto = self._unframer.readinto
-        self.readline = self._unframer.readline
+    def _load_opcodes(self):
+        self._unframer = unframer = self._make_unframer()
+        try:
+            return self._load_pickle(unframer)
+        finally:
+            unframer.close()
+
+    def _load_stacked(self):
+        # Generator of the objects of every pickle in the file, read back
+        # to back by one unframer. Each pickle starts with an empty memo,
+        # like the output of separate dump() calls.
+        self._prepare_load()
+        self._unframer = unframer = self._make_unframer()
+        try:
+            while not unframer.at_eof():
+                self.memo = {}
+                yield self._load_pickle(unframer)
+        finally:
+            unframer.close()
+
+    def _load_pickle(self, unframer):
+        # Run one pickle from unframer, up to and including its STOP
+        self.read = unframer.read
+        self.readinto = unframer.readinto
+        self.readline = unframer.readline
         self.metastack = []
         self.stack = []
         self.append = self.stack.append
         self.proto = 0
+        self._stubs = stubs = {}
+        self._reduce_verdicts = {}
+        self._check_read = None
+        dispatch = self._bind_dispatch()
         read = self.read
-        dispatch = self.dispatch
         try:
+            if self.limits is not None:
+                self._load_limited(dispatch, self.limits)
             while True:
-                key = read(1)
-                if not key:
-                    raise EOFError
-                assert isinstance(key, bytes_types)
-                dispatch[key[0]](self)
+                # Take the opcode straight from the current frame when there
+                # is one, and fall back to read() at frame boundaries and in
+                # unframed pickles.
+                pos = unframer.pos
+                if pos < unframer.limit:
+                    unframer.pos = pos + 1
+                    dispatch[unframer.buf[pos]]()
+                else:
+                    key = read(1)
+                    if not key:
+                        raise EOFError
+                    dispatch[key[0]]()
         except _Stop as stopinst:
-            print(f"Total stub object created: {len(stub_objects_created)}")
-            if len(stub_objects_created) > 0:
-                print("\n".join(stub_objects_created))
+            _telemetry.count("loads")
+            if _telemetry.level <= _INFO:
+                _telemetry.log(f"Total stub object created: {len(stubs)}")
+                if len(stubs) > 0:
+                    _telemetry.log("\n".join(stubs))
+            if _telemetry.sink is not None:
+                _telemetry.event(
+                    "load",
+                    policy=self.policy.path,
+                    stubs=sorted(stubs),
+                )
+            _record_load(self.policy, stubs)
             return stopinst.value
+        except BaseException as exc:
+            _record_load(self.policy, stubs, exc)
+            raise
+
+    def _charge_reads(self, limits):
+        # Route this load's reads through checks of the byte budget, made
+        # before anything is read or allocated. The payload budget is
+        # checked by the handlers of length-prefixed opcodes (through
+        # _check_read) and by load_frame, not on every read: fixed-width
+        # arguments such as a BINFLOAT or a FRAME length are not payloads.
+        unframer = self._unframer
+        read, readinto, readline = self.read, self.readinto, self.readline
+        # The unframer's own method, also when a previous load of a stacked
+        # file replaced it
+        load_frame = partial(type(unframer).load_frame, unframer)
+        max_bytes = limits.max_bytes
+        max_payload = limits.max_payload
+        max_frame = maxsize
+        if max_payload is not None:
+            max_frame = max(max_payload, 2 * _Framer._FRAME_SIZE_TARGET)
+        consumed = 0
+
+        def check(n):
+            if max_bytes is not None and consumed + n > max_bytes:
+                raise _limit_exceeded("max_bytes", max_bytes, consumed + n)
+
+        def check_payload(n):
+            if max_payload is not None and n > max_payload:
+                raise _limit_exceeded("max_payload", max_payload, n)
+            check(n)
+
+        def charge(n):
+            nonlocal consumed
+            check(n)
+            consumed += n
+
+        def checked_read(n):
+            charge(n)
+            return read(n)
+
+        def checked_readinto(buf):
+            charge(len(buf))
+            return readinto(buf)
+
+        def checked_readline():
+            # Read at most one byte more than the budget allows, so that an
+            # over-long line is refused without reading all of it
+            size = -1
+            if max_bytes is not None:
+                size = max_bytes - consumed + 1
+            line = readline(size)
+            charge(len(line))
+            return line
+
+        def checked_load_frame(frame_size):
+            # The pickler cuts frames at about _FRAME_SIZE_TARGET, so a small
+            # max_payload does not reject ordinary framed pickles
+            if frame_size > max_frame:
+                raise _limit_exceeded("max_payload", max_payload, frame_size)
+            if max_bytes is not None and consumed + frame_size > max_bytes:
+                raise _limit_exceeded("max_bytes", max_bytes, consumed + frame_size)
+            load_frame(frame_size)
+
+        self.read = checked_read
+        self.readinto = checked_readinto
+        self.readline = checked_readline
+        # For handlers of length-prefixed payloads, before they read or
+        # allocate them
+        self._check_read = check_payload
+        # Frame bytes are charged as the opcodes inside consume them
+        unframer.load_frame = checked_load_frame
+
+    def _load_limited(self, dispatch, limits):
+        # The dispatch loop of loads with limits; returns only by _Stop.
+        # Every opcode is fetched with read() so that it is charged, and
+        # the remaining budgets are checked after it ran.
+        self._charge_reads(limits)
+        read = self.read
+        max_opcodes = limits.max_opcodes or maxsize
+        max_memo = limits.max_memo or maxsize
+        max_depth = limits.max_stack_depth or maxsize
+        metastack = self.metastack
+        opcodes = 0
+        while True:
+            key = read(1)
+            if not key:
+                raise EOFError
+            dispatch[key[0]]()
+            opcodes += 1
+            if opcodes > max_opcodes:
+                raise _limit_exceeded("max_opcodes", max_opcodes, opcodes)
+            if len(self._memo) > max_memo:
+                raise _limit_exceeded("max_memo", max_memo, len(self._memo))
+            if len(metastack) > max_depth:
+                raise _limit_exceeded("max_stack_depth", max_depth, len(metastack))
+
+    def _load_cached(self, cache):
+        # Load through the verdict cache: a stream that was already loaded
+        # cleanly under this policy is replayed by the C unpickler, limited
+        # to the names that load used; anything else is enforced as usual
+        # and recorded.
+        stream = _stream_key(self._file, cache.max_stream_bytes)
+        if stream is None:
+            return self._load_opcodes()
+        identity, proto, start, regular = stream
+        key = cache.key(identity, self.policy)
+        entry = cache.get(key)
+        if entry is not None:
+            entry, span = entry
+            if not self._within_policy(entry):
+                # Never let a (possibly tampered) cache entry widen the policy
+                cache.discard(key)
+                entry = None
+            elif regular and (
+                span is None or _span_digest(self._file, start, span[0]) != span[1]
+            ):
+                # The file was rewritten in place with the same stat
+                cache.discard(key)
+                entry = None
+        if entry is not None:
+            cache.count(True)
+            _telemetry.count("verdict_cache_hits")
+            if _telemetry.sink is not None:
+                _telemetry.event("verdict_cache", result="hit", key=key)
+            value = self._load_verified(entry, proto)
+            if value is not _VERDICT_MISMATCH:
+                return value
+            # The replay strayed outside the recorded names or failed
+            cache.discard(key)
+            self._file.seek(start)
+        cache.count(False)
+        _telemetry.count("verdict_cache_misses")
+        if _telemetry.sink is not None:
+            _telemetry.event("verdict_cache", result="miss", key=key)
+        # {name: whether it resolved to a callable} of the globals used
+        self._used_globals = used = {}
+        try:
+            value = self._load_opcodes()
+        finally:
+            self._used_globals = None
+        allowed_reduces = self.policy.reduces
+        if not self._stubs and not any(
+            # A replay stops at callables that are not allowed reduces
+            is_callable and name not in allowed_reduces
+            for name, is_callable in used.items()
+        ):
+            reduces = {
+                name for _, allowed, name in self._reduce_verdicts.values() if allowed
+            }
+            span = None
+            if regular:
+                length = self._file.tell() - start
+                if length > cache.max_stream_bytes:
+                    return value
+                span = (length, _span_digest(self._file, start, length))
+                if span[1] is None:
+                    return value
+            cache.put(key, self.policy, used, reduces, span)
+        return value
+
+    def _within_policy(self, entry):
+        globals = self.policy.globals
+        reduces = self.policy.reduces
+        return all(name in globals for name in entry.globals) and all(
+            name in reduces for name in entry.reduces
+        )
+
+    def _load_verified(self, entry, proto):
+        # find_class overrides of subclasses look at self.proto
+        self.proto = proto
+        return _VerifiedUnpickler(self, entry).load()
+
+    def _bind_dispatch(self):
+        # Opcode handlers bound to this unpickler, indexed by opcode. A
+        # subclass that replaces the dispatch dict gets a table built from it.
+        if self.dispatch is _Unpickler.dispatch:
+            table = self._dispatch_table
+        else:
+            table = _build_dispatch_table(self.dispatch)
+        return [handler.__get__(self) for handler in table]
+
+    def _make_unframer(self):
+        if self.use_mmap and type(self._file) in _MMAP_FILE_TYPES:
+            unframer = _MmapUnframer.open(self._file)
+            if unframer is not None:
+                return unframer
+        return _Unframer(self._file_read, self._file_readline)
+
+    def _read_sized(self, n):
+        # Length-prefixed payload of an opcode, checked against the budgets
+        # of a limited load before it is read
+        if self._check_read is not None:
+            self._check_read(n)
+        return self.read(n)
+
+    def _read_bytes(self, n):
+        # Payload of a BINBYTES opcode; read() may return a memoryview
+        data = self._read_sized(n)
+        if type(data) is memoryview and not self.zero_copy:
+            return bytes(data)
+        return data
 
     # Return a list of items pushed in the stack after last MARK instruction.
     def pop_mark(self):
@@ -1471,7 +3188,7 @@ class _Unpickler:
 
     def load_long1(self):
         n = self.read(1)[0]
-        data = self.read(n)
+        data = self._read_sized(n)
         self.append(decode_long(data))
 
     dispatch[LONG1[0]] = load_long1
@@ -1481,7 +3198,7 @@ class _Unpickler:
         if n < 0:
             # Corrupt or hostile pickle -- we never write one like this
             raise UnpicklingError("LONG pickle has negative byte count")
-        data = self.read(n)
+        data = self._read_sized(n)
         self.append(decode_long(data))
 
     dispatch[LONG4[0]] = load_long4
@@ -1501,9 +3218,9 @@ class _Unpickler:
         # bytes or Unicode strings.  This should be used only with the
         # STRING, BINSTRING and SHORT_BINSTRING opcodes.
         if self.encoding == "bytes":
-            return value
+            return bytes(value)
         else:
-            return value.decode(self.encoding, self.errors)
+            return str(value, self.encoding, self.errors)
 
     def load_string(self):
         data = self.readline()[:-1]
@@ -1521,7 +3238,7 @@ class _Unpickler:
         (len,) = unpack("<i", self.read(4))
         if len < 0:
             raise UnpicklingError("BINSTRING pickle has negative byte count")
-        data = self.read(len)
+        data = self._read_sized(len)
         self.append(self._decode_string(data))
 
     dispatch[BINSTRING[0]] = load_binstring
@@ -1532,7 +3249,7 @@ class _Unpickler:
             raise UnpicklingError(
                 "BINBYTES exceeds system's maximum size " "of %d bytes" % maxsize
             )
-        self.append(self.read(len))
+        self.append(self._read_bytes(len))
 
     dispatch[BINBYTES[0]] = load_binbytes
 
@@ -1547,7 +3264,7 @@ class _Unpickler:
             raise UnpicklingError(
                 "BINUNICODE exceeds system's maximum size " "of %d bytes" % maxsize
             )
-        self.append(str(self.read(len), "utf-8", "surrogatepass"))
+        self.append(str(self._read_sized(len), "utf-8", "surrogatepass"))
 
     dispatch[BINUNICODE[0]] = load_binunicode
 
@@ -1557,7 +3274,7 @@ class _Unpickler:
             raise UnpicklingError(
                 "BINUNICODE8 exceeds system's maximum size " "of %d bytes" % maxsize
             )
-        self.append(str(self.read(len), "utf-8", "surrogatepass"))
+        self.append(str(self._read_sized(len), "utf-8", "surrogatepass"))
 
     dispatch[BINUNICODE8[0]] = load_binunicode8
 
@@ -1567,7 +3284,7 @@ class _Unpickler:
             raise UnpicklingError(
                 "BINBYTES8 exceeds system's maximum size " "of %d bytes" % maxsize
             )
-        self.append(self.read(len))
+        self.append(self._read_bytes(len))
 
     dispatch[BINBYTES8[0]] = load_binbytes8
 
@@ -1577,8 +3294,11 @@ class _Unpickler:
             raise UnpicklingError(
                 "BYTEARRAY8 exceeds system's maximum size " "of %d bytes" % maxsize
             )
+        if self._check_read is not None:
+            self._check_read(len)
         b = bytearray(len)
-        self.readinto(b)
+        if self.readinto(b) != len:
+            raise UnpicklingError("pickle data was truncated")
         self.append(b)
 
     dispatch[BYTEARRAY8[0]] = load_bytearray8
@@ -1607,20 +3327,20 @@ class _Unpickler:
 
     def load_short_binstring(self):
         len = self.read(1)[0]
-        data = self.read(len)
+        data = self._read_sized(len)
         self.append(self._decode_string(data))
 
     dispatch[SHORT_BINSTRING[0]] = load_short_binstring
 
     def load_short_binbytes(self):
         len = self.read(1)[0]
-        self.append(self.read(len))
+        self.append(bytes(self._read_sized(len)))
 
     dispatch[SHORT_BINBYTES[0]] = load_short_binbytes
 
     def load_short_binunicode(self):
         len = self.read(1)[0]
-        self.append(str(self.read(len), "utf-8", "surrogatepass"))
+        self.append(str(self._read_sized(len), "utf-8", "surrogatepass"))
 
     dispatch[SHORT_BINUNICODE[0]] = load_short_binunicode
 
@@ -1739,11 +3459,15 @@ class _Unpickler:
     dispatch[OBJ[0]] = load_obj
 
     # XXX: No need to do anything for NEWOBJ/NEWOBJ_EX since the globals (classes)
-    # will be checked when they are put on the stack
+    # will be checked when they are put on the stack. A denied class is a
+    # StubObject, which stands in for the new object as well.
     def load_newobj(self):
         args = self.stack.pop()
         cls = self.stack.pop()
-        obj = cls.__new__(cls, *args)
+        if isinstance(cls, StubObject):
+            obj = cls
+        else:
+            obj = cls.__new__(cls, *args)
         self.append(obj)
 
     dispatch[NEWOBJ[0]] = load_newobj
@@ -1752,7 +3476,10 @@ class _Unpickler:
         kwargs = self.stack.pop()
         args = self.stack.pop()
         cls = self.stack.pop()
-        obj = cls.__new__(cls, *args, **kwargs)
+        if isinstance(cls, StubObject):
+            obj = cls
+        else:
+            obj = cls.__new__(cls, *args, **kwargs)
         self.append(obj)
 
     dispatch[NEWOBJ_EX[0]] = load_newobj_ex
@@ -1771,9 +3498,9 @@ class _Unpickler:
         full_path = f"{module}.{name}"
 
         if full_path in self.allowed_globals:
-            self.append(self.find_class(module, name))
+            self.append(self._find_allowed_class(module, name))
         else:
-            self.append(StubObject(full_path))
+            self._deny_global(full_path)
 
     dispatch[GLOBAL[0]] = load_global
 
@@ -1792,9 +3519,9 @@ class _Unpickler:
 
         full_path = f"{module}.{name}"
         if full_path in self.allowed_globals:
-            self.append(self.find_class(module, name))
+            self.append(self._find_allowed_class(module, name))
         else:
-            self.append(StubObject(full_path))
+            self._deny_global(full_path)
 
     dispatch[STACK_GLOBAL[0]] = load_stack_global
 
@@ -1847,8 +3574,33 @@ class _Unpickler:
         return getattr(sys.modules[module], name)
 
     def find_class(self, module, name):
-        # Subclasses may override this.
+        # Subclasses may override this. Overrides that remap names and call
+        # super().find_class (e.g. torch's unpickler) still share the cached
+        # resolutions, which only depend on the name that reaches here.
+        global _find_class_cache_hits, _find_class_cache_misses
         sys.audit("pickle.find_class", module, name)
+        key = (self.policy, self.proto, self.fix_imports, module, name)
+        try:
+            obj = _find_class_cache[key]
+        except KeyError:
+            # Resolving may import modules, so it runs outside the lock;
+            # threads racing on the same name store equal objects
+            obj = self._resolve_class(module, name)
+            with _find_class_cache_lock:
+                _find_class_cache_misses += 1
+                if (
+                    key not in _find_class_cache
+                    and len(_find_class_cache) >= _FIND_CLASS_CACHE_SIZE
+                ):
+                    # Evict the oldest entry
+                    del _find_class_cache[next(iter(_find_class_cache))]
+                _find_class_cache[key] = obj
+            return obj
+        with _find_class_cache_lock:
+            _find_class_cache_hits += 1
+        return obj
+
+    def _resolve_class(self, module, name):
         if self.proto < 3 and self.fix_imports:
             if (module, name) in _compat_pickle.NAME_MAPPING:
                 module, name = _compat_pickle.NAME_MAPPING[(module, name)]
@@ -1860,13 +3612,56 @@ class _Unpickler:
         else:
             return getattr(sys.modules[module], name)
 
+    def _deny_global(self, full_path):
+        _telemetry.count("denied_globals")
+        if _telemetry.sink is not None:
+            _telemetry.event("denied_global", name=full_path)
+        self.append(_get_stub(self._stubs, full_path))
+
+    def _find_allowed_class(self, module, name):
+        # Resolve a name that the policy allows. find_class caches what it
+        # resolves (see _find_class_cache).
+        obj = self.find_class(module, name)
+        if self._used_globals is not None:
+            self._used_globals[f"{module}.{name}"] = callable(obj)
+        return obj
+
+    def _check_reduce(self, func):
+        # Decide whether func may be called by REDUCE and remember the
+        # verdict for the rest of the load. The entry holds a reference to
+        # func so its id() cannot be reused while the load runs.
+        if isinstance(func, StubObject):
+            fullname = func.orig_name
+            allowed = False
+        else:
+            try:
+                module = func.__module__
+                name = func.__name__
+            except Exception:
+                module = name = None
+            if type(module) is str and type(name) is str:
+                fullname = module + "." + name
+                allowed = fullname in self.allowed_reduces
+            else:
+                # Nothing to match against the policy
+                fullname = f"<unnamed {type(func).__module__}.{type(func).__qualname__}>"
+                allowed = False
+        verdict = self._reduce_verdicts[id(func)] = (func, allowed, fullname)
+        return verdict
+
     def load_reduce(self):
         stack = self.stack
         args = stack.pop()
         func = stack[-1]
-        func_fullname = func.__module__ + "." + func.__name__
-        if func_fullname not in self.allowed_reduces:
-            func = StubObject(func_fullname)
+        verdict = self._reduce_verdicts.get(id(func))
+        if verdict is None:
+            verdict = self._check_reduce(func)
+        if not verdict[1]:
+            func_fullname = verdict[2]
+            _telemetry.count("denied_reduces")
+            if _telemetry.sink is not None:
+                _telemetry.event("denied_reduce", name=func_fullname)
+            func = _get_stub(self._stubs, func_fullname)
         stack[-1] = func(*args)
 
     dispatch[REDUCE[0]] = load_reduce
@@ -1889,33 +3684,93 @@ class _Unpickler:
 
     dispatch[DUP[0]] = load_dup
 
+    # The memo is a list indexed by memo key while keys stay dense, with
+    # _MEMO_MISSING marking the few keys that were skipped. Streams that
+    # skip too many keys are switched to a dict (see _memo_put). Both forms
+    # support memo[i], so the GET opcodes do not care which one is in use.
+
+    @property
+    def memo(self):
+        """The memo as a live {index: object} mapping (see _MemoView)."""
+        return _MemoView(self)
+
+    @memo.setter
+    def memo(self, memo):
+        memo = dict(memo)
+        if all(i in memo for i in range(len(memo))):
+            self._memo = [memo[i] for i in range(len(memo))]
+        else:
+            self._memo = memo
+        self._memo_holes = 0
+        self._memo_compact = type(self._memo) is list
+
+    def _memo_get(self, i):
+        try:
+            value = self._memo[i]
+        except (KeyError, IndexError):
+            value = _MEMO_MISSING
+        if value is _MEMO_MISSING:
+            raise UnpicklingError(f"Memo value not found at index {i}")
+        self.append(value)
+
+    def _memo_put(self, i, value):
+        # General memo store; the opcode handlers only append to a compact
+        # (hole-free) list memo themselves.
+        memo = self._memo
+        if type(memo) is dict:
+            memo[i] = value
+            return
+        size = len(memo)
+        gap = i - size
+        if gap < 0:
+            if memo[i] is _MEMO_MISSING:
+                self._memo_holes -= 1
+            memo[i] = value
+        elif (
+            gap <= _MEMO_MAX_GAP
+            and self._memo_holes + gap <= size - self._memo_holes + _MEMO_MAX_GAP
+        ):
+            if gap:
+                memo.extend(repeat(_MEMO_MISSING, gap))
+                self._memo_holes += gap
+            memo.append(value)
+        else:
+            # Sparse or hostile indices: stop growing the list
+            memo = {k: v for k, v in enumerate(memo) if v is not _MEMO_MISSING}
+            memo[i] = value
+            self._memo = memo
+            self._memo_holes = 0
+        self._memo_compact = type(self._memo) is list and not self._memo_holes
+
     def load_get(self):
         i = int(self.readline()[:-1])
-        try:
-            self.append(self.memo[i])
-        except KeyError:
-            msg = f"Memo value not found at index {i}"
-            raise UnpicklingError(msg) from None
+        if i < 0:
+            raise UnpicklingError(f"Memo value not found at index {i}")
+        self._memo_get(i)
 
     dispatch[GET[0]] = load_get
 
     def load_binget(self):
         i = self.read(1)[0]
         try:
-            self.append(self.memo[i])
-        except KeyError as exc:
-            msg = f"Memo value not found at index {i}"
-            raise UnpicklingError(msg) from None
+            value = self._memo[i]
+        except (KeyError, IndexError):
+            value = _MEMO_MISSING
+        if value is _MEMO_MISSING:
+            raise UnpicklingError(f"Memo value not found at index {i}")
+        self.append(value)
 
     dispatch[BINGET[0]] = load_binget
 
     def load_long_binget(self):
         (i,) = unpack("<I", self.read(4))
         try:
-            self.append(self.memo[i])
-        except KeyError as exc:
-            msg = f"Memo value not found at index {i}"
-            raise UnpicklingError(msg) from None
+            value = self._memo[i]
+        except (KeyError, IndexError):
+            value = _MEMO_MISSING
+        if value is _MEMO_MISSING:
+            raise UnpicklingError(f"Memo value not found at index {i}")
+        self.append(value)
 
     dispatch[LONG_BINGET[0]] = load_long_binget
 
@@ -1923,15 +3778,16 @@ class _Unpickler:
         i = int(self.readline()[:-1])
         if i < 0:
             raise ValueError("negative PUT argument")
-        self.memo[i] = self.stack[-1]
+        self._memo_put(i, self.stack[-1])
 
     dispatch[PUT[0]] = load_put
 
     def load_binput(self):
         i = self.read(1)[0]
-        if i < 0:
-            raise ValueError("negative BINPUT argument")
-        self.memo[i] = self.stack[-1]
+        if self._memo_compact and i == len(self._memo):
+            self._memo.append(self.stack[-1])
+        else:
+            self._memo_put(i, self.stack[-1])
 
     dispatch[BINPUT[0]] = load_binput
 
@@ -1939,13 +3795,21 @@ class _Unpickler:
         (i,) = unpack("<I", self.read(4))
         if i > maxsize:
             raise ValueError("negative LONG_BINPUT argument")
-        self.memo[i] = self.stack[-1]
+        if self._memo_compact and i == len(self._memo):
+            self._memo.append(self.stack[-1])
+        else:
+            self._memo_put(i, self.stack[-1])
 
     dispatch[LONG_BINPUT[0]] = load_long_binput
 
     def load_memoize(self):
-        memo = self.memo
-        memo[len(memo)] = self.stack[-1]
+        if self._memo_compact:
+            self._memo.append(self.stack[-1])
+        else:
+            # The next index is the number of stored entries
+            memo = self._memo
+            size = len(memo) - self._memo_holes if type(memo) is list else len(memo)
+            self._memo_put(size, self.stack[-1])
 
     dispatch[MEMOIZE[0]] = load_memoize
 
@@ -1960,6 +3824,9 @@ class _Unpickler:
     def load_appends(self):
         items = self.pop_mark()
         list_obj = self.stack[-1]
+        if type(list_obj) is list:
+            list_obj.extend(items)
+            return
         try:
             extend = list_obj.extend
         except AttributeError:
@@ -1988,6 +3855,13 @@ class _Unpickler:
     def load_setitems(self):
         items = self.pop_mark()
         dict = self.stack[-1]
+        if len(items) & 1:
+            raise UnpicklingError("odd number of items for SETITEMS")
+        if type(dict) in _BULK_DICT_TYPES:
+            # Pair up keys and values without indexing in Python
+            it = iter(items)
+            dict.update(zip(it, it))
+            return
         for i in range(0, len(items), 2):
             dict[items[i]] = items[i + 1]
 
@@ -1996,7 +3870,7 @@ class _Unpickler:
     def load_additems(self):
         items = self.pop_mark()
         set_obj = self.stack[-1]
-        if isinstance(set_obj, set):
+        if type(set_obj) is set:
             set_obj.update(items)
         else:
             add = set_obj.add
@@ -2011,11 +3885,11 @@ class _Unpickler:
         inst = stack[-1]
         setstate = getattr(inst, "__setstate__", None)
         if setstate is not None:
-            for attr in disallowed_attrs:
-                if attr in state.keys():
-                    raise Exception(
-                        f"BUILD attempted to set attribute {attr} of {inst}"
-                    )
+            if isinstance(state, tuple) and len(state) == 2:
+                _check_build_state(inst, state[0])
+                _check_build_state(inst, state[1])
+            else:
+                _check_build_state(inst, state)
             setstate(state)
             return
         slotstate = None
@@ -2024,19 +3898,13 @@ class _Unpickler:
         if state:
             inst_dict = inst.__dict__
             intern = sys.intern
-            for k, v in state.items():
-                if k in disallowed_attrs:
-                    raise Exception(
-                        f"BUILD attempted to set attribute {k} of {inst}")
+            for k, v in _build_items(inst, state).items():
                 if type(k) is str:
                     inst_dict[intern(k)] = v
                 else:
                     inst_dict[k] = v
         if slotstate:
-            for k, v in slotstate.items():
-                if k in disallowed_attrs:
-                    raise Exception(
-                        f"BUILD attempted to set attribute {k} of {inst}")
+            for k, v in _build_items(inst, slotstate).items():
                 setattr(inst, k, v)
 
     dispatch[BUILD[0]] = load_build
@@ -2055,6 +3923,473 @@ class _Unpickler:
     dispatch[STOP[0]] = load_stop
 
 
+def _invalid_load_key(code):
+    def load_invalid(self):
+        raise UnpicklingError("invalid load key, %r." % bytes((code,)))
+
+    return load_invalid
+
+
+def _build_dispatch_table(dispatch):
+    # List form of a dispatch dict with an entry for every byte value
+    return [dispatch.get(code) or _invalid_load_key(code) for code in range(256)]
+
+
+_Unpickler._dispatch_table = _build_dispatch_table(_Unpickler.dispatch)
+
+
+# Pre-scanning
+#
+# _Scanner walks the opcodes of a pickle and checks every name it would
+# import or call against a policy, without building any objects. Values on
+# the stack are tracked only as far as needed to name STACK_GLOBAL operands
+# and REDUCE callables: strings, _ScanGlobal for imported names and None for
+# everything else.
+
+# Payloads larger than this are skipped rather than read when possible
+_SCAN_SKIP_THRESHOLD = 1 << 20
+
+
+class _ScanGlobal:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class ScanVerdict:
+    """Result of scan(): whether a pickle loads without violating a policy.
+
+    ``globals`` and ``reduces`` hold every name imported and called by the
+    pickle. ``denied_globals`` and ``denied_reduces`` are the names the
+    policy does not allow, and ``unsupported`` describes opcodes that the
+    enforcer refuses outright. REDUCE sites whose callable is not a named
+    global cannot be checked statically and are counted in
+    ``unresolved_reduces``; the enforcer still checks them during loading.
+    """
+
+    __slots__ = (
+        "allowed",
+        "globals",
+        "reduces",
+        "denied_globals",
+        "denied_reduces",
+        "unsupported",
+        "unresolved_reduces",
+        "opcodes",
+    )
+
+    def __init__(self, scanner):
+        self.globals = scanner.globals
+        self.reduces = scanner.reduces
+        self.denied_globals = scanner.denied_globals
+        self.denied_reduces = scanner.denied_reduces
+        self.unsupported = scanner.unsupported
+        self.unresolved_reduces = scanner.unresolved_reduces
+        self.opcodes = scanner.opcodes
+        self.allowed = not (
+            self.denied_globals or self.denied_reduces or self.unsupported
+        )
+
+    def __bool__(self):
+        return self.allowed
+
+    def __repr__(self):
+        return (
+            f"<ScanVerdict allowed={self.allowed} "
+            f"denied_globals={sorted(self.denied_globals)} "
+            f"denied_reduces={sorted(self.denied_reduces)} "
+            f"unsupported={self.unsupported}>"
+        )
+
+
+class _Scanner:
+
+    def __init__(self, file, policy, encoding="ASCII"):
+        self._file = file
+        self._unframer = _Unframer(file.read, file.readline)
+        self.read = self._unframer.read
+        self.readline = self._unframer.readline
+        self.policy = policy
+        self.encoding = encoding
+        self.stack = []
+        self.metastack = []
+        self.memo = {}
+        self.globals = set()
+        self.reduces = set()
+        self.denied_globals = set()
+        self.denied_reduces = set()
+        self.unsupported = []
+        self.unresolved_reduces = 0
+        self.opcodes = 0
+
+    def scan(self):
+        read = self.read
+        dispatch = self.dispatch
+        try:
+            while True:
+                key = read(1)
+                if not key:
+                    raise EOFError
+                self.opcodes += 1
+                try:
+                    handler = dispatch[key[0]]
+                except KeyError:
+                    raise UnpicklingError(f"invalid load key, {key!r}.") from None
+                if handler(self):
+                    break
+        except EOFError:
+            raise UnpicklingError("pickle data was truncated") from None
+        # ValueError covers bad literals and undecodable strings
+        except (IndexError, ValueError, OverflowError, _StructError) as exc:
+            raise UnpicklingError(f"malformed pickle: {exc}") from None
+        return ScanVerdict(self)
+
+    def pop_mark(self):
+        items = self.stack
+        self.stack = self.metastack.pop()
+        return items
+
+    def _read_payload(self, n, keep):
+        # Read an n-byte payload, or skip it when it is large and not needed
+        if keep and n <= _SCAN_SKIP_THRESHOLD:
+            data = self.read(n)
+            if len(data) < n:
+                raise UnpicklingError("pickle exhausted before end of payload")
+            return data
+        unframer = self._unframer
+        # load() accepts streams with only read() and readline()
+        seekable = getattr(self._file, "seekable", None)
+        if unframer.pos >= unframer.limit and seekable is not None and seekable():
+            self._file.seek(n, io.SEEK_CUR)
+            return None
+        while n > 0:
+            chunk = self.read(min(n, _SCAN_SKIP_THRESHOLD))
+            if not chunk:
+                raise UnpicklingError("pickle exhausted before end of payload")
+            n -= len(chunk)
+        return None
+
+    def _decode_string(self, data):
+        if data is None or self.encoding == "bytes":
+            return None
+        try:
+            return data.decode(self.encoding)
+        except (UnicodeDecodeError, LookupError):
+            return None
+
+    def _add_global(self, full_path):
+        self.globals.add(full_path)
+        if full_path not in self.policy.globals:
+            self.denied_globals.add(full_path)
+        self.stack.append(_ScanGlobal(full_path))
+
+    dispatch = {}
+
+    def scan_proto(self):
+        proto = self.read(1)[0]
+        if not 0 <= proto <= HIGHEST_PROTOCOL:
+            raise ValueError("unsupported pickle protocol: %d" % proto)
+
+    dispatch[PROTO[0]] = scan_proto
+
+    def scan_frame(self):
+        (frame_size,) = unpack("<Q", self.read(8))
+        if frame_size > sys.maxsize:
+            raise ValueError("frame size > sys.maxsize: %d" % frame_size)
+        self._unframer.load_frame(frame_size)
+
+    dispatch[FRAME[0]] = scan_frame
+
+    def scan_stop(self):
+        self.stack.pop()
+        return True
+
+    dispatch[STOP[0]] = scan_stop
+
+    # Opcodes that push a value built from a fixed-size argument
+    def _scan_fixed(size):
+        def scan_fixed(self):
+            if size:
+                self.read(size)
+            self.stack.append(None)
+
+        return scan_fixed
+
+    for _op, _size in (
+        (NONE, 0),
+        (NEWFALSE, 0),
+        (NEWTRUE, 0),
+        (EMPTY_TUPLE, 0),
+        (EMPTY_LIST, 0),
+        (EMPTY_DICT, 0),
+        (EMPTY_SET, 0),
+        (NEXT_BUFFER, 0),
+        (BININT, 4),
+        (BININT1, 1),
+        (BININT2, 2),
+        (BINFLOAT, 8),
+    ):
+        dispatch[_op[0]] = _scan_fixed(_size)
+
+    # Opcodes that push a value built from a newline-terminated argument
+    def scan_line(self):
+        self.readline()
+        self.stack.append(None)
+
+    for _op in (INT, LONG, FLOAT, PERSID):
+        dispatch[_op[0]] = scan_line
+
+    # Opcodes that push a value built from a counted argument. Strings are
+    # kept since they may name a STACK_GLOBAL.
+    def _scan_counted(fmt, decode):
+        def scan_counted(self):
+            if fmt is None:
+                n = self.read(1)[0]
+            else:
+                (n,) = unpack(fmt, self.read(calcsize(fmt)))
+                if n < 0:
+                    raise UnpicklingError("negative byte count")
+            data = self._read_payload(n, decode is not None)
+            self.stack.append(None if data is None else decode(self, data))
+
+        return scan_counted
+
+    def _utf8(self, data):
+        return str(data, "utf-8", "surrogatepass")
+
+    for _op, _fmt, _decode in (
+        (LONG1, None, None),
+        (LONG4, "<i", None),
+        (SHORT_BINBYTES, None, None),
+        (BINBYTES, "<I", None),
+        (BINBYTES8, "<Q", None),
+        (BYTEARRAY8, "<Q", None),
+        (SHORT_BINSTRING, None, _decode_string),
+        (BINSTRING, "<i", _decode_string),
+        (SHORT_BINUNICODE, None, _utf8),
+        (BINUNICODE, "<I", _utf8),
+        (BINUNICODE8, "<Q", _utf8),
+    ):
+        dispatch[_op[0]] = _scan_counted(_fmt, _decode)
+
+    def scan_string(self):
+        data = self.readline()[:-1]
+        if len(data) >= 2 and data[0] == data[-1] and data[0] in b"\"'":
+            data = codecs.escape_decode(data[1:-1])[0]
+            self.stack.append(self._decode_string(data))
+        else:
+            raise UnpicklingError("the STRING opcode argument must be quoted")
+
+    dispatch[STRING[0]] = scan_string
+
+    def scan_unicode(self):
+        self.stack.append(str(self.readline()[:-1], "raw-unicode-escape"))
+
+    dispatch[UNICODE[0]] = scan_unicode
+
+    def scan_binpersid(self):
+        self.stack[-1] = None
+
+    dispatch[BINPERSID[0]] = scan_binpersid
+
+    def scan_readonly_buffer(self):
+        self.stack[-1]
+
+    dispatch[READONLY_BUFFER[0]] = scan_readonly_buffer
+
+    def scan_build_from_mark(self):
+        self.pop_mark()
+        self.stack.append(None)
+
+    for _op in (TUPLE, LIST, DICT, FROZENSET):
+        dispatch[_op[0]] = scan_build_from_mark
+
+    def scan_tuple1(self):
+        self.stack[-1] = None
+
+    dispatch[TUPLE1[0]] = scan_tuple1
+
+    def scan_tuple2(self):
+        self.stack.pop()
+        self.stack[-1] = None
+
+    dispatch[TUPLE2[0]] = scan_tuple2
+
+    def scan_tuple3(self):
+        self.stack.pop()
+        self.stack.pop()
+        self.stack[-1] = None
+
+    dispatch[TUPLE3[0]] = scan_tuple3
+
+    def scan_inst(self):
+        module = self.readline()[:-1].decode("ascii")
+        name = self.readline()[:-1].decode("ascii")
+        self.unsupported.append(f"INST {module}.{name}")
+        self.pop_mark()
+        self.stack.append(None)
+
+    dispatch[INST[0]] = scan_inst
+
+    def scan_obj(self):
+        args = self.pop_mark()
+        cls = args.pop(0)
+        name = cls.name if isinstance(cls, _ScanGlobal) else "<unknown>"
+        self.unsupported.append(f"OBJ {name}")
+        self.stack.append(None)
+
+    dispatch[OBJ[0]] = scan_obj
+
+    def scan_newobj(self):
+        self.stack.pop()
+        self.stack[-1] = None
+
+    dispatch[NEWOBJ[0]] = scan_newobj
+
+    def scan_newobj_ex(self):
+        self.stack.pop()
+        self.stack.pop()
+        self.stack[-1] = None
+
+    dispatch[NEWOBJ_EX[0]] = scan_newobj_ex
+
+    def scan_global(self):
+        module = self.readline()[:-1].decode("utf-8")
+        name = self.readline()[:-1].decode("utf-8")
+        self._add_global(f"{module}.{name}")
+
+    dispatch[GLOBAL[0]] = scan_global
+
+    def scan_stack_global(self):
+        name = self.stack.pop()
+        module = self.stack.pop()
+        if type(name) is not str or type(module) is not str:
+            self.unsupported.append("STACK_GLOBAL with unresolved name")
+            self.stack.append(None)
+        else:
+            self._add_global(f"{module}.{name}")
+
+    dispatch[STACK_GLOBAL[0]] = scan_stack_global
+
+    def _scan_ext(fmt):
+        def scan_ext(self):
+            (code,) = unpack(fmt, self.read(calcsize(fmt)))
+            self.unsupported.append(f"EXT code {code}")
+            self.stack.append(None)
+
+        return scan_ext
+
+    dispatch[EXT1[0]] = _scan_ext("<B")
+    dispatch[EXT2[0]] = _scan_ext("<H")
+    dispatch[EXT4[0]] = _scan_ext("<i")
+
+    def scan_reduce(self):
+        stack = self.stack
+        stack.pop()
+        func = stack[-1]
+        stack[-1] = None
+        if isinstance(func, _ScanGlobal):
+            self.reduces.add(func.name)
+            if func.name not in self.policy.reduces:
+                self.denied_reduces.add(func.name)
+        else:
+            self.unresolved_reduces += 1
+
+    dispatch[REDUCE[0]] = scan_reduce
+
+    def scan_pop(self):
+        if self.stack:
+            del self.stack[-1]
+        else:
+            self.pop_mark()
+
+    dispatch[POP[0]] = scan_pop
+
+    def scan_pop_mark(self):
+        self.pop_mark()
+
+    dispatch[POP_MARK[0]] = scan_pop_mark
+
+    def scan_dup(self):
+        self.stack.append(self.stack[-1])
+
+    dispatch[DUP[0]] = scan_dup
+
+    def _memo_get(self, i):
+        try:
+            self.stack.append(self.memo[i])
+        except KeyError:
+            raise UnpicklingError(f"Memo value not found at index {i}") from None
+
+    def scan_get(self):
+        self._memo_get(int(self.readline()[:-1]))
+
+    dispatch[GET[0]] = scan_get
+
+    def scan_binget(self):
+        self._memo_get(self.read(1)[0])
+
+    dispatch[BINGET[0]] = scan_binget
+
+    def scan_long_binget(self):
+        self._memo_get(unpack("<I", self.read(4))[0])
+
+    dispatch[LONG_BINGET[0]] = scan_long_binget
+
+    def scan_put(self):
+        i = int(self.readline()[:-1])
+        if i < 0:
+            raise ValueError("negative PUT argument")
+        self.memo[i] = self.stack[-1]
+
+    dispatch[PUT[0]] = scan_put
+
+    def scan_binput(self):
+        self.memo[self.read(1)[0]] = self.stack[-1]
+
+    dispatch[BINPUT[0]] = scan_binput
+
+    def scan_long_binput(self):
+        self.memo[unpack("<I", self.read(4))[0]] = self.stack[-1]
+
+    dispatch[LONG_BINPUT[0]] = scan_long_binput
+
+    def scan_memoize(self):
+        self.memo[len(self.memo)] = self.stack[-1]
+
+    dispatch[MEMOIZE[0]] = scan_memoize
+
+    def scan_pop_one(self):
+        self.stack.pop()
+        self.stack[-1]
+
+    for _op in (APPEND, BUILD):
+        dispatch[_op[0]] = scan_pop_one
+
+    def scan_setitem(self):
+        self.stack.pop()
+        self.stack.pop()
+        self.stack[-1]
+
+    dispatch[SETITEM[0]] = scan_setitem
+
+    def scan_extend_from_mark(self):
+        self.pop_mark()
+        self.stack[-1]
+
+    for _op in (APPENDS, SETITEMS, ADDITEMS):
+        dispatch[_op[0]] = scan_extend_from_mark
+
+    def scan_mark(self):
+        self.metastack.append(self.stack)
+        self.stack = []
+
+    dispatch[MARK[0]] = scan_mark
+
+    del _op, _size, _fmt, _decode, _scan_fixed, _scan_counted, _scan_ext
+
+
 # Shorthands
 
 
@@ -2083,6 +4418,8 @@ def _load(
     encoding="ASCII",
     errors="strict",
     buffers=None,
+    policy=None,
+    limits=None,
 ):
     return _Unpickler(
         file,
@@ -2090,19 +4427,94 @@ def _load(
         buffers=buffers,
         encoding=encoding,
         errors=errors,
+        policy=policy,
+        limits=limits,
     ).load()
     # ).load(globals, reduces)
 
 
-def _loads(s, /, *, fix_imports=True, encoding="ASCII", errors="strict", buffers=None):
+def _loads(
+    s,
+    /,
+    *,
+    fix_imports=True,
+    encoding="ASCII",
+    errors="strict",
+    buffers=None,
+    policy=None,
+    limits=None,
+):
     if isinstance(s, str):
         raise TypeError("Can't load pickle from unicode string")
     file = io.BytesIO(s)
     return _Unpickler(
-        file, fix_imports=fix_imports, buffers=buffers, encoding=encoding, errors=errors
+        file,
+        fix_imports=fix_imports,
+        buffers=buffers,
+        encoding=encoding,
+        errors=errors,
+        policy=policy,
+        limits=limits,
     ).load()
 
 
+def load_stacked(
+    file,
+    *,
+    fix_imports=True,
+    encoding="ASCII",
+    errors="strict",
+    buffers=None,
+    policy=None,
+    limits=None,
+):
+    """Yield the object of every pickle stored back to back in *file*.
+
+    Files written by several dump() calls hold one pickle after another;
+    load() returns after the first. The pickles are read in one pass by a
+    single unpickler, which enforces the same policy (and, per pickle, the
+    same limits) for each of them and starts every pickle with an empty
+    memo, so objects that have been consumed are not kept alive. Iteration
+    stops at the end of the data; a truncated pickle raises what load()
+    raises for it.
+    """
+    return _Unpickler(
+        file,
+        fix_imports=fix_imports,
+        buffers=buffers,
+        encoding=encoding,
+        errors=errors,
+        policy=policy,
+        limits=limits,
+    )._load_stacked()
+
+
+def scan(file, *, policy=None, encoding="ASCII"):
+    """Check the pickle read from *file* against a policy without loading it.
+
+    *policy* is a compiled policy, the path of a policy file, or None for
+    the policy the enforcer would use. Returns a ScanVerdict that is true
+    when loading would neither create stubs nor hit an unsupported opcode.
+    Malformed pickles raise UnpicklingError.
+    """
+    verdict = _Scanner(file, _resolve_policy(policy), encoding).scan()
+    if _telemetry.sink is not None:
+        _telemetry.event(
+            "scan",
+            allowed=verdict.allowed,
+            denied_globals=sorted(verdict.denied_globals),
+            denied_reduces=sorted(verdict.denied_reduces),
+            unsupported=verdict.unsupported,
+        )
+    return verdict
+
+
+def scans(data, /, *, policy=None, encoding="ASCII"):
+    if isinstance(data, str):
+        raise TypeError("Can't scan pickle from unicode string")
+    return scan(io.BytesIO(data), policy=policy, encoding=encoding)
+
+
 # Use the faster _pickle if possible
 try:
     from _pickle import (
@@ -2121,6 +4533,1313 @@ except ImportError:
     dump, dumps, load, loads = _dump, _dumps, _load, _loads
 
 
+# C-accelerated enforcement
+#
+# FastUnpickler runs the C _pickle.Unpickler and enforces the policy from
+# find_class, which the C implementation calls for GLOBAL, STACK_GLOBAL and
+# INST. The C unpickler has no hook for REDUCE or NEWOBJ, and a name that
+# is denied, or that is allowed but callable without being an allowed
+# reduce, may be used by either (or only referenced). find_class therefore
+# stops the C unpickler at the first such name, and the load is made again
+# from the start by _Unpickler, whose load_reduce vets REDUCE targets and
+# which turns denied names into stubs. Pickles that only use allowed
+# reduces and non-callable globals, such as state dicts, stay in C; the
+# fallback is counted as fast_fallbacks in telemetry_counters(). The C
+# unpickler cannot be reset after it was stopped inside a frame, so later
+# loads of stacked pickles by the same FastUnpickler run on _Unpickler too.
+#
+# The guarantees differ from the pure-Python _Unpickler in these places:
+#
+# - REDUCE is vetted only for callables obtained through find_class.
+#   Callables produced by other opcodes (e.g. returned by an allowed reduce)
+#   are called without a policy check.
+# - INST and OBJ are executed instead of rejected (INST still goes through
+#   find_class), and EXT1/EXT2/EXT4 codes already in copyreg's extension
+#   cache are served without calling find_class.
+# - BUILD does not screen states for __name__ and __module__.
+# - The LoadLimits of a policy are not enforced; loads that need resource
+#   budgets must use _Unpickler.
+# - Allowed reduces called before the C unpickler stopped are called again
+#   by the fallback load, as are persistent_load hooks.
+
+
+class _FastPathExit(Exception):
+    """Raised by FastUnpickler.find_class to hand the load to _Unpickler."""
+
+
+class _RecordingReader:
+    # Reader for streams that cannot seek: keeps what the C unpickler read
+    # so that a fallback load can read it again
+
+    def __init__(self, file):
+        self._file = file
+        self._chunks = []
+
+    def read(self, n=-1):
+        data = self._file.read(n)
+        self._chunks.append(data)
+        return data
+
+    def clear(self):
+        # Forget what earlier loads read
+        self._chunks.clear()
+
+    def readline(self):
+        line = self._file.readline()
+        self._chunks.append(line)
+        return line
+
+    def replay(self):
+        return _ReplayReader(b"".join(self._chunks), self._file)
+
+
+class _ReplayReader:
+    # The recorded bytes followed by the rest of the stream
+
+    def __init__(self, recorded, file):
+        self._head = io.BytesIO(recorded)
+        self._file = file
+
+    def read(self, n=-1):
+        data = self._head.read(n)
+        if n is None or n < 0:
+            return data + self._file.read()
+        if len(data) < n:
+            data += self._file.read(n - len(data))
+        return data
+
+    def readline(self):
+        line = self._head.readline()
+        if not line.endswith(b"\n"):
+            line += self._file.readline()
+        return line
+
+
+try:
+    from _pickle import Unpickler as _CUnpickler
+except ImportError:
+    _CUnpickler = None
+
+if _CUnpickler is not None:
+
+    class FastUnpickler(_CUnpickler):
+        """Enforcing unpickler built on the C _pickle.Unpickler.
+
+        Loads run at the speed of the C implementation; see the comment
+        above for when it hands a load to _Unpickler and where its
+        guarantees differ.
+        """
+
+        def __init__(
+            self,
+            file,
+            *,
+            fix_imports=True,
+            encoding="ASCII",
+            errors="strict",
+            buffers=None,
+            policy=None,
+        ):
+            try:
+                start = file.tell() if file.seekable() else None
+            except (AttributeError, OSError, ValueError):
+                start = None
+            if start is None:
+                file = _RecordingReader(file)
+            if buffers is not None:
+                # A fallback load needs them from the first one
+                buffers = list(buffers)
+            super().__init__(
+                file,
+                fix_imports=fix_imports,
+                encoding=encoding,
+                errors=errors,
+                buffers=buffers,
+            )
+            self.policy = _resolve_policy(policy)
+            self.allowed_globals = self.policy.globals
+            self.allowed_reduces = self.policy.reduces
+            self._file = file
+            self._start = start
+            self._fix_imports = fix_imports
+            self._encoding = encoding
+            self._errors = errors
+            self._buffers = buffers
+            # True while _FastFallbackUnpickler resolves names through
+            # this unpickler's find_class
+            self._fallback = False
+            # True once a load fell back; see _load_fallback
+            self._detached = False
+
+        def find_class(self, module, name):
+            if self._fallback:
+                # Checked by the fallback unpickler
+                return self._resolve_class(module, name)
+            full_path = f"{module}.{name}"
+            if full_path not in self.allowed_globals:
+                raise _FastPathExit(full_path)
+            obj = self._resolve_class(module, name)
+            if (
+                self._vet_callables
+                and full_path not in self.allowed_reduces
+                and callable(obj)
+            ):
+                raise _FastPathExit(full_path)
+            return obj
+
+        # Whether allowed callables outside the allowed reduces stop the
+        # C unpickler
+        _vet_callables = True
+
+        # Resolves allowed names; _VerifiedUnpickler may route this to the
+        # find_class of the _Unpickler it loads for
+        _resolve_class = _CUnpickler.find_class
+
+        def load(self):
+            if USE_PLACEHOLDER_FILE:
+                _touch_placeholder_file()
+            if self._detached:
+                return self._load_enforced()
+            # A fallback restarts from where this load starts, which moves
+            # on with every load from a stream of stacked pickles
+            if self._start is None:
+                self._file.clear()
+            else:
+                self._start = self._file.tell()
+            try:
+                value = super().load()
+            except _FastPathExit as stop:
+                return self._load_fallback(stop.args[0])
+            except BaseException as exc:
+                _record_load(self.policy, (), exc)
+                raise
+            _telemetry.count("loads")
+            _record_load(self.policy, ())
+            return value
+
+        def _load_fallback(self, name):
+            _telemetry.count("fast_fallbacks")
+            if _telemetry.sink is not None:
+                _telemetry.event("fast_fallback", name=name)
+            if self._start is None:
+                file = self._file.replay()
+            else:
+                file = self._file
+                file.seek(self._start)
+            # The C unpickler keeps the rest of the frame it stopped in and
+            # cannot be reset, so this and every later load from the stream
+            # run on _Unpickler
+            self._file = file
+            self._detached = True
+            return self._load_enforced()
+
+        def _resolves_names(self):
+            # Whether a subclass resolves names itself (e.g. torch's
+            # remapping), which a fallback load must keep
+            cls = type(self)
+            return (
+                cls.find_class is not FastUnpickler.find_class
+                or cls._resolve_class is not FastUnpickler._resolve_class
+            )
+
+        def _load_enforced(self):
+            fallback = _FastFallbackUnpickler(self, self._file)
+            # Only a fallback load may skip the policy check in find_class,
+            # which the fallback unpickler makes itself
+            self._fallback = self._resolves_names()
+            try:
+                return fallback.load()
+            finally:
+                self._fallback = False
+
+    class _FastFallbackUnpickler(_Unpickler):
+        """_Unpickler that takes over a load from a FastUnpickler."""
+
+        def __init__(self, owner, file):
+            super().__init__(
+                file,
+                fix_imports=owner._fix_imports,
+                encoding=owner._encoding,
+                errors=owner._errors,
+                buffers=owner._buffers,
+                policy=owner.policy,
+            )
+            # Keep the subclass hooks of the owner, e.g. torch's
+            # find_class and persistent_load overrides
+            if owner._resolves_names():
+                self.find_class = owner.find_class
+            try:
+                self.persistent_load = owner.persistent_load
+            except AttributeError:
+                pass
+
+    def fast_load(
+        file,
+        *,
+        fix_imports=True,
+        encoding="ASCII",
+        errors="strict",
+        buffers=None,
+        policy=None,
+    ):
+        return FastUnpickler(
+            file,
+            fix_imports=fix_imports,
+            encoding=encoding,
+            errors=errors,
+            buffers=buffers,
+            policy=policy,
+        ).load()
+
+    def fast_loads(
+        s,
+        /,
+        *,
+        fix_imports=True,
+        encoding="ASCII",
+        errors="strict",
+        buffers=None,
+        policy=None,
+    ):
+        if isinstance(s, str):
+            raise TypeError("Can't load pickle from unicode string")
+        return fast_load(
+            io.BytesIO(s),
+            fix_imports=fix_imports,
+            encoding=encoding,
+            errors=errors,
+            buffers=buffers,
+            policy=policy,
+        )
+
+
+# Verdict cache
+#
+# Loading the same checkpoint again under the same policy gives the same
+# verdict. When the cache is enabled (configure_verdict_cache() or the
+# PICKLEBALL_VERDICT_CACHE environment variable), _Unpickler records, for
+# every clean load (no stubs), the identity of the stream together with the
+# policy digest and the exact globals and reduces the load used. A later load
+# of an identical stream under the same policy is replayed by
+# _VerifiedUnpickler: the C unpickler with FastUnpickler's checks, allowed
+# only the recorded names, and any callable among them only if the policy
+# allows it as a reduce. A replay that needs any other name, or that fails,
+# is abandoned and the stream is loaded by the pure-Python enforcer instead.
+# Loads that use callable globals outside the reduces (classes made by
+# NEWOBJ, for instance) are therefore not cached.
+#
+# Only streams that can be identified without consuming them are cached. An
+# io.BytesIO (torch hands data.pkl over this way) is identified by the
+# SHA-256 of its unread bytes. A regular file is identified by its stat and
+# position; the verdict also records the SHA-256 of the bytes the pickle
+# consumed, and a hit hashes just those bytes again. Hashing the rest of the
+# file instead would read every tensor that follows the pickle in torch's
+# legacy format, once for each of the pickles it loads from the file.
+
+_VERDICT_CACHE_VERSION = 2
+_VERDICT_MISMATCH = object()
+
+# Cache in use, or None when disabled
+_verdict_cache = None
+
+
+def _stream_key(file, max_bytes):
+    """Return (identity, protocol, position, regular) for the unread part of file.
+
+    An io.BytesIO is identified by the SHA-256 of its unread bytes. A regular
+    file is identified by its device, inode, size, modification time and the
+    position, without reading it; its verdicts also record the digest of the
+    bytes the pickle consumed, which a hit checks. None is returned for
+    streams that cannot be identified without consuming them, and for
+    in-memory streams larger than *max_bytes*.
+    """
+    from hashlib import sha256
+
+    if type(file) is io.BytesIO:
+        start = file.tell()
+        with file.getbuffer() as buf:
+            with buf[start:] as data:
+                if len(data) > max_bytes:
+                    return None
+                proto = data[1] if len(data) > 1 and data[0] == PROTO[0] else 0
+                return sha256(data).digest(), proto, start, False
+    if type(file) not in _MMAP_FILE_TYPES:
+        return None
+    try:
+        start = file.tell()
+        fileno = file.fileno()
+        st = os.fstat(fileno)
+        head = os.pread(fileno, 2, start)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return None
+    if len(head) < 2:
+        return None
+    proto = head[1] if head[0] == PROTO[0] else 0
+    identity = b"file:%d:%d:%d:%d:%d" % (
+        st.st_dev,
+        st.st_ino,
+        st.st_size,
+        st.st_mtime_ns,
+        start,
+    )
+    return identity, proto, start, True
+
+
+def _span_digest(file, start, length):
+    """Return the SHA-256 of *length* bytes of file from *start*, or None."""
+    from hashlib import sha256
+
+    digest = sha256()
+    try:
+        fileno = file.fileno()
+        while length > 0:
+            chunk = os.pread(fileno, min(length, 1 << 20), start)
+            if not chunk:
+                return None
+            digest.update(chunk)
+            start += len(chunk)
+            length -= len(chunk)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return None
+    return digest.digest()
+
+
+class _VerdictCache:
+    """In-memory LRU of recorded verdicts, optionally backed by a directory.
+
+    Both the memory and the directory are bounded by *max_bytes*; the least
+    recently used verdicts are evicted first.
+    """
+
+    def __init__(self, directory, max_bytes, max_stream_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_stream_bytes = max_stream_bytes
+        # key -> ((recorded policy, span), approximate size), least
+        # recently used first. span is (length, digest) of the bytes a load
+        # from a regular file consumed, or None.
+        self._entries = {}
+        self._size = 0
+        self._lock = _thread.allocate_lock()
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(identity, policy):
+        from hashlib import sha256
+
+        return sha256(
+            b"%d:" % _VERDICT_CACHE_VERSION + identity + policy.digest
+        ).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _remember(self, key, entry, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (entry, size)
+            self._size += size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._size -= self._entries.pop(oldest)[1]
+                self.evictions += 1
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        with self._lock:
+            cached = self._entries.pop(key, None)
+            if cached is not None:
+                # Most recently used
+                self._entries[key] = cached
+                return cached[0]
+        if self.directory is None:
+            return None
+        import json
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            entry = _CompiledPolicy(
+                record["policy"],
+                record["model"],
+                record["globals"],
+                record["reduces"],
+                bytes.fromhex(record["policy_digest"]),
+            )
+            span = record["span"]
+            if span is not None:
+                span = (int(span[0]), bytes.fromhex(span[1]))
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+        self._remember(key, (entry, span), os.path.getsize(path))
+        return entry, span
+
+    def put(self, key, policy, globals, reduces, span=None):
+        entry = _CompiledPolicy(
+            policy.path, policy.model_name, globals, reduces, policy.digest
+        )
+        import json
+
+        record = json.dumps(
+            {
+                "version": _VERDICT_CACHE_VERSION,
+                "policy": policy.path,
+                "model": policy.model_name,
+                "policy_digest": policy.digest.hex(),
+                "globals": sorted(globals),
+                "reduces": sorted(reduces),
+                "span": None if span is None else [span[0], span[1].hex()],
+            }
+        )
+        self._remember(key, (entry, span), len(record))
+        if self.directory is None:
+            return
+        tmp = f"{self._path(key)}.{os.getpid()}.{_thread.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(record)
+            os.replace(tmp, self._path(key))
+            self._evict_directory()
+        except OSError as exc:
+            if _telemetry.level <= _WARNING:
+                _telemetry.log(f"Cannot write verdict cache entry: {exc}")
+
+    def _evict_directory(self):
+        files = []
+        total = 0
+        with os.scandir(self.directory) as entries:
+            for e in entries:
+                if e.name.endswith(".json"):
+                    st = e.stat()
+                    files.append((st.st_mtime_ns, st.st_size, e.path))
+                    total += st.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files[:-1]:
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def discard(self, key):
+        with self._lock:
+            cached = self._entries.pop(key, None)
+            if cached is not None:
+                self._size -= cached[1]
+        if self.directory is not None:
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.directory is not None:
+            with os.scandir(self.directory) as entries:
+                for e in entries:
+                    if e.name.endswith(".json"):
+                        try:
+                            os.unlink(e.path)
+                        except OSError:
+                            pass
+
+    def info(self):
+        return {
+            "directory": self.directory,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+if _CUnpickler is not None:
+
+    class _VerifiedUnpickler(FastUnpickler):
+        """FastUnpickler that replays a cached load for an _Unpickler."""
+
+        def __init__(self, owner, entry):
+            super().__init__(
+                owner._file,
+                fix_imports=owner.fix_imports,
+                encoding=owner.encoding,
+                errors=owner.errors,
+                buffers=owner._buffers,
+                policy=entry,
+            )
+            # Keep the subclass hooks of the owner, e.g. torch's
+            # find_class and persistent_load overrides
+            if type(owner).find_class is not _Unpickler.find_class:
+                self._resolve_class = owner.find_class
+            self.persistent_load = owner.persistent_load
+            # Callables are vetted against the policy, not the entry, so
+            # that a forged entry cannot make a global callable
+            self.allowed_reduces = owner.policy.reduces
+
+        def load(self):
+            try:
+                value = _CUnpickler.load(self)
+            except Exception:
+                # A name outside those the recorded load used, or an error
+                # the owner reports itself when it loads the stream again
+                return _VERDICT_MISMATCH
+            _telemetry.count("loads")
+            _record_load(self.policy, ())
+            return value
+
+
+def configure_verdict_cache(
+    directory=None,
+    *,
+    enabled=True,
+    max_bytes=64 * 1024 * 1024,
+    max_stream_bytes=1 << 30,
+):
+    """Enable or disable the cache of verdicts for previously loaded pickles.
+
+    With *directory*, verdicts are also stored there and shared between
+    processes; otherwise they are kept in memory only. *max_bytes* bounds
+    the memory and the directory used, evicting the least recently used
+    verdicts. Pickles larger than *max_stream_bytes* are not cached, since
+    every load hashes the pickle bytes. enabled=False turns the cache off.
+    """
+    global _verdict_cache
+    if not enabled:
+        _verdict_cache = None
+        return
+    if _CUnpickler is None:
+        raise RuntimeError("the verdict cache requires the _pickle module")
+    _verdict_cache = _VerdictCache(
+        None if directory is None else os.fspath(directory),
+        max_bytes,
+        max_stream_bytes,
+    )
+
+
+def verdict_cache_info():
+    """Return statistics of the verdict cache, or None if it is disabled."""
+    cache = _verdict_cache
+    return None if cache is None else cache.info()
+
+
+def clear_verdict_cache():
+    """Forget every cached verdict, including those stored on disk."""
+    cache = _verdict_cache
+    if cache is not None:
+        cache.clear()
+
+
+if os.environ.get("PICKLEBALL_VERDICT_CACHE") and _CUnpickler is not None:
+    # "memory" keeps verdicts in this process; anything else is a directory
+    _cache_dir = os.environ["PICKLEBALL_VERDICT_CACHE"]
+    configure_verdict_cache(None if _cache_dir == "memory" else _cache_dir)
+    del _cache_dir
+
+
+# Asynchronous loads
+#
+# load_async() runs the enforcing unpickler in an executor thread so that a
+# long load does not block the event loop. The unpickler reads through an
+# _AsyncLoadReader, which awaits asynchronous sources on the loop, and
+# through which a cancelled load is stopped.
+
+# Bytes requested from an asynchronous source per refill, and read from
+# other sources between two yields to the event loop thread
+_ASYNC_READ_SIZE = 64 * 1024
+
+
+class _AsyncLoadReader:
+    """Binary file interface for an unpickler running in an executor thread.
+
+    The source is a bytes-like object, a binary file object, or an object
+    whose read() is a coroutine (asyncio.StreamReader, aiofiles, ...), which
+    is awaited on *loop* in chunks of _ASYNC_READ_SIZE. Framed pickles are
+    read a frame at a time, so every frame is a point where the load thread
+    gives the event loop a chance to run, and where cancel() takes effect.
+    """
+
+    def __init__(self, source, loop):
+        import asyncio
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        read = getattr(source, "read", None)
+        if read is None:
+            raise TypeError("load_async() requires bytes or an object with read()")
+        self._source = source
+        self._loop = loop
+        self._async = asyncio.iscoroutinefunction(read)
+        # Bytes awaited from an asynchronous source; buf[pos:] is unread
+        self._buf = b""
+        self._pos = 0
+        # Bytes read from other sources since the last yield
+        self._unyielded = 0
+        self._cancelled = False
+        self._pending = None
+
+    def cancel(self):
+        """Make the pending or next read abort the load."""
+        self._cancelled = True
+        pending = self._pending
+        if pending is not None:
+            pending.cancel()
+
+    def _await(self, coro):
+        from asyncio import run_coroutine_threadsafe
+        from concurrent.futures import CancelledError
+
+        future = run_coroutine_threadsafe(coro, self._loop)
+        self._pending = future
+        if self._cancelled:
+            future.cancel()
+        try:
+            return future.result()
+        except CancelledError:
+            raise UnpicklingError("load cancelled") from None
+        finally:
+            self._pending = None
+
+    def _refill(self, n):
+        # Buffer at least n unread bytes, or all that the source has left
+        chunks = [self._buf[self._pos :]]
+        have = len(chunks[0])
+        while have < n:
+            chunk = self._await(self._source.read(max(n - have, _ASYNC_READ_SIZE)))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            have += len(chunk)
+        self._buf = b"".join(chunks)
+        self._pos = 0
+
+    def _yield(self, n):
+        self._unyielded += n
+        if self._unyielded >= _ASYNC_READ_SIZE:
+            self._unyielded = 0
+            # Release the GIL so that the event loop thread runs promptly
+            import time
+
+            time.sleep(0)
+
+    def read(self, n):
+        if self._cancelled:
+            raise UnpicklingError("load cancelled")
+        if not self._async:
+            self._yield(n)
+            return self._source.read(n)
+        if self._pos + n > len(self._buf):
+            self._refill(n)
+        data = self._buf[self._pos : self._pos + n]
+        self._pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        if self._cancelled:
+            raise UnpicklingError("load cancelled")
+        if not self._async:
+            if size < 0:
+                line = self._source.readline()
+            else:
+                line = self._source.readline(size)
+            self._yield(len(line))
+            return line
+        while True:
+            end = self._buf.find(b"\n", self._pos)
+            if end >= 0:
+                break
+            unread = len(self._buf) - self._pos
+            if 0 <= size <= unread:
+                end = len(self._buf) - 1
+                break
+            self._refill(unread + _ASYNC_READ_SIZE)
+            if len(self._buf) - self._pos == unread:
+                # Exhausted without a newline
+                end = len(self._buf) - 1
+                break
+        if 0 <= size < end + 1 - self._pos:
+            end = self._pos + size - 1
+        line = self._buf[self._pos : end + 1]
+        self._pos = end + 1
+        return line
+
+
+async def load_async(
+    source,
+    *,
+    executor=None,
+    fix_imports=True,
+    encoding="ASCII",
+    errors="strict",
+    buffers=None,
+    policy=None,
+    limits=None,
+):
+    """Load a pickle with the enforcing unpickler without blocking the loop.
+
+    *source* is a bytes-like object, a binary file object, or an
+    asynchronous reader whose read(n) is a coroutine, such as an
+    asyncio.StreamReader; it is streamed, not read in full first. Opcodes
+    are dispatched in *executor* (the loop's default executor when None).
+    The policy is resolved in the calling task, so using_policy() applies,
+    and last_load() reports the load there afterwards. Other arguments are
+    those of Unpickler.
+
+    Cancelling the awaiting task stops the load at its next read from the
+    source, which is at the latest the next frame of a framed pickle; a
+    pending read from an asynchronous source is cancelled as well.
+    """
+    import asyncio
+    from _contextvars import copy_context
+
+    loop = asyncio.get_running_loop()
+    reader = _AsyncLoadReader(source, loop)
+    unpickler = _Unpickler(
+        reader,
+        fix_imports=fix_imports,
+        encoding=encoding,
+        errors=errors,
+        buffers=buffers,
+        policy=policy,
+        limits=limits,
+    )
+    # The load records last_load() in a copy of this context
+    context = copy_context()
+    try:
+        result = await loop.run_in_executor(executor, context.run, unpickler.load)
+    except asyncio.CancelledError:
+        reader.cancel()
+        raise
+    except BaseException:
+        _last_load.set(context.get(_last_load))
+        raise
+    _last_load.set(context.get(_last_load))
+    return result
+
+
+# Enforced torch checkpoints
+#
+# load_torch() reads the zip checkpoints written by torch.save() (a data.pkl
+# record plus one record per storage under data/) with the enforcing
+# unpickler instead of torch's. Every name in data.pkl, including
+# torch._utils._rebuild_tensor_v2 and the storage types, is checked against
+# the policy as in any other load. Storage records are not read: like
+# torch.load(mmap=True), the checkpoint file is mapped privately once and
+# each BINPERSID storage becomes a view of its record, so only the pages of
+# tensors that are touched are ever read from disk.
+
+# Local file header of a zip entry: signature, then the lengths of the name
+# and the extra field at offsets 26 and 28
+_ZIP_LOCAL_HEADER = _struct.Struct("<4s22xHH")
+_ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+
+# Bytes read from a storage record at a time when it is not mapped
+_TORCH_READ_SIZE = 1 << 20
+
+
+def _zip_record_offsets(zf, fileobj, prefix):
+    # {name: (offset, size)} of the uncompressed records under prefix
+    offsets = {}
+    for info in zf.infolist():
+        if not info.filename.startswith(prefix) or info.compress_type != 0:
+            continue
+        fileobj.seek(info.header_offset)
+        header = fileobj.read(_ZIP_LOCAL_HEADER.size)
+        if len(header) != _ZIP_LOCAL_HEADER.size:
+            continue
+        signature, name_len, extra_len = _ZIP_LOCAL_HEADER.unpack(header)
+        if signature != _ZIP_LOCAL_SIGNATURE:
+            continue
+        offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len
+        offsets[info.filename] = (offset, info.file_size)
+    return offsets
+
+
+def _torch_find_class(find_class, module, name):
+    # The name remapping of torch.load; other names are resolved by
+    # find_class. Only reached for names the policy allows.
+    from torch.serialization import StorageType
+
+    if type(name) is str and "Storage" in name:
+        try:
+            return StorageType(name)
+        except KeyError:
+            pass
+    if module == "torch.tensor":
+        module = "torch._tensor"
+    return find_class(module, name)
+
+
+class _TorchUnpickler(_Unpickler):
+    # The enforcing unpickler with the name remapping of torch.load and its
+    # storages resolved by load_storage(persistent id)
+
+    def __init__(self, file, load_storage, **kwargs):
+        super().__init__(file, **kwargs)
+        self._load_storage = load_storage
+
+    def find_class(self, module, name):
+        return _torch_find_class(super().find_class, module, name)
+
+    def persistent_load(self, pid):
+        return self._load_storage(pid)
+
+
+if _CUnpickler is not None:
+
+    class _TorchFastUnpickler(FastUnpickler):
+        # _TorchUnpickler on the C unpickler. The names are checked by
+        # FastUnpickler.find_class before they are remapped here, and a
+        # fallback load keeps the remapping and the storages.
+
+        def __init__(self, file, load_storage, **kwargs):
+            super().__init__(file, **kwargs)
+            self._load_storage = load_storage
+
+        def _resolve_class(self, module, name):
+            return _torch_find_class(super()._resolve_class, module, name)
+
+        def persistent_load(self, pid):
+            return self._load_storage(pid)
+
+
+def load_torch(
+    f, map_location=None, *, policy=None, limits=None, mmap=True, fast=False
+):
+    """Load a torch.save() checkpoint with the enforcing unpickler.
+
+    *f* is the path of a zip checkpoint (the default format of torch.save()
+    since torch 1.6) or a binary file object holding one. *map_location*
+    has the meaning it has for torch.load(); *policy* and *limits* those of
+    Unpickler. With *mmap* (the default) and a checkpoint on disk, tensor
+    storages are views of a private mapping of the file and are only read
+    when touched; otherwise each storage is read when data.pkl refers to it.
+    With fast=True data.pkl is loaded by FastUnpickler, with its weaker
+    guarantees and without limits. Legacy (non-zip) checkpoints and
+    checkpoints written with another byte order are rejected with an
+    UnpicklingError.
+    """
+    import zipfile
+
+    if fast:
+        if _CUnpickler is None:
+            raise RuntimeError("fast enforcement requires the _pickle module")
+        if limits is not None:
+            raise ValueError("limits are not enforced by FastUnpickler")
+
+    import torch
+    import torch.serialization
+    from torch._utils import _element_size
+
+    restore_location = torch.serialization._get_restore_location(map_location)
+    path = f if isinstance(f, (str, os.PathLike)) else getattr(f, "name", None)
+    try:
+        zf = zipfile.ZipFile(f)
+    except zipfile.BadZipFile:
+        raise UnpicklingError("load_torch() requires a zip checkpoint") from None
+
+    with zf:
+        names = zf.namelist()
+        data_pkl = next((n for n in names if n.endswith("/data.pkl")), None)
+        if data_pkl is None:
+            raise UnpicklingError("not a torch checkpoint: no data.pkl record")
+        prefix = data_pkl[: -len("data.pkl")]
+        if prefix + "byteorder" in names:
+            byteorder = zf.read(prefix + "byteorder").decode("ascii")
+            if byteorder != sys.byteorder:
+                raise UnpicklingError(
+                    f"checkpoint was written on a {byteorder}-endian machine"
+                )
+
+        mapped = None
+        offsets = {}
+        if mmap and isinstance(path, (str, os.PathLike)) and os.path.isfile(path):
+            with open(path, "rb") as fileobj:
+                offsets = _zip_record_offsets(zf, fileobj, prefix + "data/")
+            mapped = torch.UntypedStorage.from_file(
+                os.fspath(path), False, os.path.getsize(path)
+            )
+
+        storages = {}
+
+        def read_storage(name, key, nbytes):
+            # Read the record straight into the buffer the storage wraps,
+            # in bounded chunks, rather than copying it from zf.read()
+            try:
+                size = zf.getinfo(name).file_size
+            except KeyError:
+                raise UnpicklingError(f"no record for storage {key}") from None
+            if nbytes > size:
+                raise UnpicklingError(f"storage {key} is larger than its record")
+            if not nbytes:
+                return torch.UntypedStorage(0)
+            buf = bytearray(nbytes)
+            with zf.open(name) as record, memoryview(buf) as view:
+                filled = 0
+                while filled < nbytes:
+                    n = record.readinto(view[filled : filled + _TORCH_READ_SIZE])
+                    if not n:
+                        raise UnpicklingError(f"record of storage {key} is truncated")
+                    filled += n
+            return torch.frombuffer(buf, dtype=torch.uint8).untyped_storage()
+
+        def load_storage(pid):
+            if type(pid) is not tuple or len(pid) != 5:
+                raise UnpicklingError(f"unsupported persistent id {pid!r}")
+            typename, storage_type, key, location, numel = (
+                str(item, "ascii") if type(item) is bytes else item for item in pid
+            )
+            if typename != "storage":
+                raise UnpicklingError(f"unsupported persistent id type {typename!r}")
+            if type(key) is not str or type(numel) is not int or numel < 0:
+                raise UnpicklingError(f"invalid storage record {pid!r}")
+            typed = storages.get(key)
+            if typed is not None:
+                return typed
+            if storage_type is torch.UntypedStorage:
+                dtype = torch.uint8
+            else:
+                dtype = storage_type.dtype
+            nbytes = numel * _element_size(dtype)
+            name = f"{prefix}data/{key}"
+            record = offsets.get(name)
+            if record is not None:
+                offset, size = record
+                if nbytes > size:
+                    raise UnpicklingError(f"storage {key} is larger than its record")
+                untyped = mapped[offset : offset + nbytes]
+            else:
+                untyped = read_storage(name, key, nbytes)
+            typed = storages[key] = torch.storage.TypedStorage(
+                wrap_storage=restore_location(untyped, location),
+                dtype=dtype,
+                _internal=True,
+            )
+            return typed
+
+        data = io.BytesIO(zf.read(data_pkl))
+        if fast:
+            unpickler = _TorchFastUnpickler(
+                data, load_storage, encoding="utf-8", policy=policy
+            )
+        else:
+            unpickler = _TorchUnpickler(
+                data, load_storage, encoding="utf-8", policy=policy, limits=limits
+            )
+        result = unpickler.load()
+
+    torch._utils._validate_loaded_sparse_tensors()
+    return result
+
+
+def load_sharded(
+    index_path,
+    map_location=None,
+    *,
+    policy=None,
+    limits=None,
+    mmap=True,
+    max_workers=None,
+    fast=False,
+):
+    """Load a sharded checkpoint from its index with the enforcing unpickler.
+
+    *index_path* is a Hugging Face style index such as
+    pytorch_model.bin.index.json, whose "weight_map" maps parameter names to
+    shard files in the same directory. The shards are loaded with
+    load_torch() by a pool of at most *max_workers* threads (by default one
+    per shard, bounded by the number of CPUs), all enforcing the same
+    compiled policy, and their state dicts are merged into one dict without
+    copying any tensor. The first failing shard cancels the shards that
+    have not started and its exception is raised.
+
+    The threads only overlap reading the shards: enforcement holds the GIL,
+    so the pure-Python unpickler loads one data.pkl at a time. With
+    fast=True each shard is loaded by FastUnpickler (see load_torch), which
+    spends far less time holding it.
+
+    last_load() then reports the sharded load as one load: it failed if any
+    shard failed, and its stubs are those of all shards.
+    """
+    import json
+    from _contextvars import copy_context
+    from concurrent.futures import ThreadPoolExecutor
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    weight_map = index.get("weight_map") if isinstance(index, dict) else None
+    if not isinstance(weight_map, dict) or not weight_map:
+        raise ValueError(f"{index_path}: no weight_map in shard index")
+    shards = list(dict.fromkeys(weight_map.values()))
+    for shard in shards:
+        # Shards live next to the index; refuse paths that leave it
+        if type(shard) is not str or os.path.basename(shard) != shard:
+            raise ValueError(f"{index_path}: invalid shard name {shard!r}")
+    directory = os.path.dirname(os.fspath(index_path))
+
+    # Resolve the policy here: the pool threads do not see using_policy()
+    policy = _resolve_policy(policy)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    workers = max(1, min(max_workers, len(shards)))
+
+    def load_shard(shard):
+        state_dict = load_torch(
+            os.path.join(directory, shard),
+            map_location,
+            policy=policy,
+            limits=limits,
+            mmap=mmap,
+            fast=fast,
+        )
+        if not isinstance(state_dict, dict):
+            raise UnpicklingError(f"shard {shard} does not hold a state dict")
+        return state_dict
+
+    # Each shard records its load in its own copy of this context
+    contexts = [copy_context() for _ in shards]
+    previous = _last_load.get()
+    merged = {}
+    error = None
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="pickleball-shard") as pool:
+            futures = [
+                pool.submit(context.run, load_shard, shard)
+                for context, shard in zip(contexts, shards)
+            ]
+            try:
+                for future in futures:
+                    merged.update(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _record_merged_load(
+            policy,
+            [context.get(_last_load) for context in contexts],
+            previous,
+            error,
+        )
+    return merged
+
+
+def _record_merged_load(policy, records, previous, error):
+    # Combine the load records of the shards of one checkpoint into the
+    # record last_load() returns in the calling context. Shards that never
+    # ran inherit the caller's previous record, which is not theirs; a shard
+    # that failed before unpickling (a missing file, say) has none.
+    records = [r for r in records if r is not None and r is not previous]
+    if not records:
+        if error is not None:
+            _record_load(policy, (), error)
+        return
+    failed = [r["error"] for r in records if not r["ok"]]
+    if error is not None and not failed:
+        failed.append(repr(error))
+    _last_load.set(
+        {
+            "id": max(r["id"] for r in records),
+            "ok": not failed,
+            "policy": records[0]["policy"],
+            "stubs": sorted({name for r in records for name in r["stubs"]}),
+            "error": failed[0] if failed else None,
+        }
+    )
+
+
+# Installing the enforcer as a hook
+#
+# Instead of replacing pickle.py, this module can be installed under its own
+# name (see enforce/Dockerfile.hook) and attached to selected entry points.
+# Everything else keeps using the C _pickle implementation.
+
+# Policy (file path or compiled policy) used while installed as a hook;
+# None means POLICY_PATH
+_installed_policy = None
+
+# Patched entry points, as (owner, attribute, original) triples
+_installed_hooks = []
+
+_HOOK_SCOPES = ("torch", "pickle")
+
+
+def _patch(owner, attr, replacement):
+    _installed_hooks.append((owner, attr, getattr(owner, attr)))
+    setattr(owner, attr, replacement)
+
+
+def _fast_pickle_module():
+    # Module-like view of the C-accelerated enforcer for torch.load
+    module = type(sys)(__name__ + ".fast")
+    module.Unpickler = FastUnpickler
+    module.load = fast_load
+    module.loads = fast_loads
+    module.UnpicklingError = UnpicklingError
+    return module
+
+
+def _hook_torch_load(fast):
+    import torch
+    import torch.serialization
+
+    enforcer = _fast_pickle_module() if fast else sys.modules[__name__]
+    original = torch.serialization.load
+
+    @_functools.wraps(original)
+    def load(f, map_location=None, pickle_module=None, **kwargs):
+        # weights_only loads already use torch's restricted unpickler, and an
+        # explicit pickle_module is the caller's choice.
+        if pickle_module is None and not kwargs.get("weights_only"):
+            pickle_module = enforcer
+            kwargs["weights_only"] = False
+        return original(f, map_location, pickle_module, **kwargs)
+
+    _patch(torch.serialization, "load", load)
+    if torch.load is original:
+        _patch(torch, "load", load)
+
+
+def _hook_pickle(fast):
+    import pickle
+
+    if fast:
+        _patch(pickle, "load", fast_load)
+        _patch(pickle, "loads", fast_loads)
+        _patch(pickle, "Unpickler", FastUnpickler)
+    elif pickle is not sys.modules[__name__]:
+        # Unless the enforcer already replaces the pickle module
+        _patch(pickle, "load", _load)
+        _patch(pickle, "loads", _loads)
+        _patch(pickle, "Unpickler", _Unpickler)
+
+
+# Serializes install() and uninstall(); install() calls uninstall()
+_hook_lock = _thread.RLock()
+
+
+def install(policy=None, scope="torch", fast=False):
+    """Enforce PickleBall policies on selected pickle entry points.
+
+    *policy* is the path of the policy file to enforce, or a compiled policy
+    such as one taken from a PolicyStore; when omitted the policy in
+    POLICY_PATH is used. using_policy() and the policy argument of the
+    unpicklers take precedence over it. *scope* is one of the following names,
+    or an iterable of them:
+
+    - "torch": torch.load (and torch.serialization.load) unpickle through
+      the enforcer, unless called with weights_only=True or with an
+      explicit pickle_module.
+    - "pickle": pickle.load, pickle.loads and pickle.Unpickler of the
+      standard library are replaced by the enforcing versions.
+
+    With fast=True the hooked entry points use FastUnpickler, which runs
+    the C unpickler with weaker guarantees (see FastUnpickler).
+
+    Pickle users outside the chosen scope, such as multiprocessing,
+    concurrent.futures and copy, keep the C implementation. Calling
+    install() again replaces the previous installation. The hooks are
+    process-wide; to enforce different policies in concurrent threads, use
+    using_policy() or the policy argument instead of re-installing.
+    """
+    global _installed_policy
+    scopes = (scope,) if isinstance(scope, str) else tuple(scope)
+    for name in scopes:
+        if name not in _HOOK_SCOPES:
+            raise ValueError(f"unknown PickleBall hook scope: {name!r}")
+    if fast and _CUnpickler is None:
+        raise RuntimeError("fast enforcement requires the _pickle module")
+
+    with _hook_lock:
+        uninstall()
+        try:
+            if "torch" in scopes:
+                _hook_torch_load(fast)
+            if "pickle" in scopes:
+                _hook_pickle(fast)
+        except BaseException:
+            uninstall()
+            raise
+        if policy is not None and not isinstance(policy, _CompiledPolicy):
+            policy = os.fspath(policy)
+        _installed_policy = policy
+
+
+def uninstall():
+    """Restore every entry point patched by install()."""
+    global _installed_policy
+    with _hook_lock:
+        while _installed_hooks:
+            owner, attr, original = _installed_hooks.pop()
+            setattr(owner, attr, original)
+        _installed_policy = None
+
+
+class _Enforcing:
+
+    def __init__(self, policy, scope, fast):
+        self.policy = policy
+        self.scope = scope
+        self.fast = fast
+        # Installations replaced by the blocks entered, innermost last
+        self._previous = []
+
+    def __enter__(self):
+        with _hook_lock:
+            hooks = [
+                (owner, attr, getattr(owner, attr))
+                for owner, attr, _ in _installed_hooks
+            ]
+            previous = (hooks, _installed_policy)
+            install(self.policy, self.scope, self.fast)
+            self._previous.append(previous)
+        return self
+
+    def __exit__(self, *exc_info):
+        # Put back the installation of an enclosing block or install()
+        global _installed_policy
+        with _hook_lock:
+            hooks, policy = self._previous.pop()
+            uninstall()
+            for owner, attr, replacement in hooks:
+                _patch(owner, attr, replacement)
+            _installed_policy = policy
+
+
+def enforcing(policy=None, scope="torch", fast=False):
+    """Return a context manager that install()s the enforcer for its body.
+
+    On exit the installation that was in place before the body, if any, is
+    restored, so blocks may be nested and used under install().
+    """
+    return _Enforcing(policy, scope, fast)
+
+
 # Doctest
 def _test():
     import doctest
@@ -0,0 +1,31 @@
+"""Import enforce.py for the test and benchmark scripts.
+
+The scripts under tests/enforce/ and enforce/benchmarks/ load the enforcer
+from a file (enforce.py by default, or the one given with --enforcer) under
+a name of their own, so that it does not replace the pickle module they use
+to write their pickles. The module is registered in sys.modules under that
+name, as install() expects of the module it patches into.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+ENFORCER_PATH = Path(__file__).resolve().parent / "enforce.py"
+
+
+def import_enforcer(path: Path = ENFORCER_PATH, name: str = "pickleball_script"):
+    """Import enforce.py from *path* as a module called *name*."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def report(errors: list) -> int:
+    """Print *errors* and OK or FAILED, and return the exit status."""
+    for error in errors:
+        print(error, file=sys.stderr)
+    print("FAILED" if errors else "OK")
+    return 1 if errors else 0
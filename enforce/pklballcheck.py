@@ -1,19 +1,42 @@
+import contextvars
 import inspect
-from pathlib import Path
-from pickle import StubObject
+import os
 
-PLACEHOLDER_FILE_PATH = Path("/root/.loader_used")
+# The enforcer is either installed as a hook module (enforce/Dockerfile.hook)
+# or in place of the pickle module
+try:
+    import pickleball as _enforcer
+except ImportError:
+    import pickle as _enforcer
+
+StubObject = _enforcer.StubObject
 
 _pklball_accessed_attrs = set()
 
+# Last load record seen by verify_loader_was_used in this context
+_verified_load = contextvars.ContextVar("pklball_verified_load", default=None)
+
 
 def verify_loader_was_used() -> bool:
-    if PLACEHOLDER_FILE_PATH.is_file():
-        PLACEHOLDER_FILE_PATH.unlink()
-        return True
-    else:
+    """Return whether the PickleBall loader ran since the previous check.
+
+    Only loads made from the calling thread (or asyncio task) are taken
+    into account. When the enforcer runs with USE_PLACEHOLDER_FILE, the
+    placeholder file is checked and removed instead.
+    """
+    if _enforcer.USE_PLACEHOLDER_FILE:
+        # PLACEHOLDER_FILE_PATH is a str (or a Path if a caller set one)
+        if os.path.isfile(_enforcer.PLACEHOLDER_FILE_PATH):
+            os.unlink(_enforcer.PLACEHOLDER_FILE_PATH)
+            return True
+        return False
+
+    record = _enforcer.last_load()
+    if record is None or record is _verified_load.get():
         # raise Exception("PICKLEBALL loader was not used to load the model!")
         return False
+    _verified_load.set(record)
+    return True
 
 
 def collect_attr_stats(_pklball_instance):
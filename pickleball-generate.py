@@ -1,12 +1,23 @@
 #!/usr/bin/python3
 
 import argparse
+import hashlib
+import json
+import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import time
 from typing import Optional
 from pathlib import Path
 
 ANALYZE_PATH = Path('analyze/analyze.sc')
+JOERN_STAGE_PATH = Path('joern-cli/target/universal/stage')
+CPG_CACHE_PATH = Path.home() / '.cache' / 'pickleball' / 'cpg'
+CPG_CACHE_SIZE_GB = 20
+# Files read by the Python frontend; only these go into the source digest.
+SOURCE_SUFFIXES = ('.py', '.pyi')
 
 class JoernRuntimeError(Exception):
     """Error raised when Joern crashes"""
@@ -37,6 +48,206 @@ def gb_to_kb(mem_gb: int) -> int:
     """
     return mem_gb << 20
 
+def _ignored_paths(library_path: Path, ignore_paths: str) -> list:
+    """
+    Resolve a --ignore-paths value the way Joern does: a comma-separated list
+    of paths, relative ones interpreted relative to the library path.
+    """
+    ignored = []
+    for entry in ignore_paths.split(','):
+        entry = entry.strip()
+        if entry:
+            ignored.append(Path(os.path.abspath(library_path / entry)))
+    return ignored
+
+
+def source_digest(library_path: Path, ignore_paths: str = '') -> str:
+    """
+    Hash the names and contents of the library source files that Joern reads,
+    skipping ignored paths.
+    """
+    root = Path(os.path.abspath(library_path))
+    ignored = _ignored_paths(root, ignore_paths)
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        directory = Path(dirpath)
+        dirnames[:] = sorted(d for d in dirnames if directory / d not in ignored)
+        for name in sorted(filenames):
+            path = directory / name
+            if not name.endswith(SOURCE_SUFFIXES) or path in ignored:
+                continue
+            digest.update(path.relative_to(root).as_posix().encode() + b'\0')
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def joern_version(joern_path: Path) -> str:
+    """
+    Identify the Joern build: the names, sizes and modification times of the
+    staged jars, which change whenever Joern (or the PickleBall patch to it)
+    is rebuilt.
+    """
+    lib = joern_path / JOERN_STAGE_PATH / 'lib'
+    try:
+        jars = sorted(p for p in lib.iterdir() if p.suffix == '.jar')
+    except OSError:
+        jars = []
+    if not jars:
+        # Not a staged build; fall back to the utilities themselves
+        jars = [joern_path / 'joern-parse', joern_path / JOERN_STAGE_PATH / 'pysrc2cpg']
+    digest = hashlib.sha256()
+    release = 'unknown'
+    for jar in jars:
+        try:
+            st = jar.stat()
+        except OSError:
+            continue
+        digest.update(f'{jar.name}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode())
+        if jar.name.startswith('io.joern.joern-cli-'):
+            release = jar.name[len('io.joern.joern-cli-'):-len('.jar')]
+    return f'{release}+{digest.hexdigest()[:16]}'
+
+
+def cpg_cache_key(
+        library_path: Path,
+        joern_path: Path,
+        ignore_paths: str = '',
+        use_cpg: bool = False) -> tuple:
+    """Return the cache key of a CPG and the metadata recorded with it."""
+    meta = {
+        'library_path': os.path.abspath(library_path),
+        'ignore_paths': ignore_paths,
+        'mode': 'cpg' if use_cpg else 'ast',
+        'joern': joern_version(joern_path),
+        'source': source_digest(library_path, ignore_paths),
+    }
+    # The library location is recorded but not hashed: a moved or copied
+    # checkout with the same sources still hits.
+    keyed = {k: meta[k] for k in ('mode', 'joern', 'source')}
+    keyed['ignored'] = sorted(
+        p.relative_to(meta['library_path']).as_posix()
+        if p.is_relative_to(meta['library_path']) else str(p)
+        for p in _ignored_paths(library_path, ignore_paths))
+    key = hashlib.sha256(json.dumps(keyed, sort_keys=True).encode()).hexdigest()
+    return key, meta
+
+
+class CpgCache:
+    """
+    Content-addressed store of CPGs, <key>.cpg with a <key>.json metadata file
+    next to it. Entries are evicted least recently used first once the cache
+    grows beyond max_bytes.
+    """
+
+    STATS_FILE = 'stats.json'
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def entry(self, key: str) -> Path:
+        return self.path / f'{key}.cpg'
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Return the entry for key, marking it as recently used, or None."""
+        cpg = self.entry(key)
+        try:
+            # The modification time orders entries for eviction
+            os.utime(cpg)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return cpg
+
+    def staging_dir(self) -> Path:
+        """Create a directory for building an entry; the caller removes it."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        return Path(tempfile.mkdtemp(dir=self.path, prefix='.staging-'))
+
+    def store(self, key: str, cpg: Path, meta: dict) -> Path:
+        """Move a freshly built CPG into the cache and return its entry."""
+        entry = self.entry(key)
+        meta = dict(meta, created=time.time(), size=cpg.stat().st_size)
+        staged_meta = cpg.with_suffix('.json')
+        staged_meta.write_text(json.dumps(meta, indent=2) + '\n')
+        os.replace(staged_meta, entry.with_suffix('.json'))
+        os.replace(cpg, entry)
+        self.evict(keep=key)
+        return entry
+
+    def entries(self) -> list:
+        """Return (key, size, last used, metadata) of every entry, oldest first."""
+        entries = []
+        for cpg in self.path.glob('*.cpg'):
+            try:
+                st = cpg.stat()
+            except FileNotFoundError:
+                continue
+            try:
+                meta = json.loads(cpg.with_suffix('.json').read_text())
+            except (OSError, ValueError):
+                meta = {}
+            entries.append((cpg.stem, st.st_size, st.st_mtime, meta))
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _, _ in entries)
+        evicted = 0
+        for key, size, _, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in (self.entry(key), self.entry(key).with_suffix('.json')):
+                path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+        return evicted
+
+    def stats(self) -> dict:
+        try:
+            return json.loads((self.path / self.STATS_FILE).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        # Best effort: concurrent runs may lose an update, never the cache
+        self.path.mkdir(parents=True, exist_ok=True)
+        stats = self.stats()
+        stats[name] = stats.get(name, 0) + n
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.stats-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp, self.path / self.STATS_FILE)
+
+
+def print_cpg_cache_stats(cache: CpgCache) -> None:
+    """Print the entries, size and hit rate of the CPG cache."""
+    entries = cache.entries()
+    total = sum(size for _, size, _, _ in entries)
+    stats = cache.stats()
+    hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+    print(f'CPG cache: {cache.path}')
+    print(f'Entries: {len(entries)}, '
+          f'size: {total / (1 << 30):.2f} of {cache.max_bytes / (1 << 30):.2f} GiB')
+    print(f'Hits: {hits}, misses: {misses}, evictions: {stats.get("evictions", 0)}'
+          + (f', hit rate: {hits / (hits + misses):.0%}' if hits + misses else ''))
+    for key, size, used, meta in reversed(entries):
+        print(f'  {key[:12]}  {size / (1 << 20):9.1f} MiB  '
+              f'{time.strftime("%Y-%m-%d %H:%M", time.localtime(used))}  '
+              f'{meta.get("mode", "?"):3}  {meta.get("joern", "?")}  '
+              f'{meta.get("library_path", "?")}')
+
+
 def create_cpg(
         library_path: Path,
         joern_path: Path,
@@ -44,8 +255,32 @@ def create_cpg(
         out_path: Path = Path('/tmp/out.cpg'),
         ignore_paths: str = '',
         use_cpg: bool = False,
-        dry_run: bool = False):
-    """Generate a CPG (or AST) of the ML library code."""
+        dry_run: bool = False,
+        cache: Optional[CpgCache] = None) -> Path:
+    """
+    Generate a CPG (or AST) of the ML library code and return its path.
+
+    With a cache, a CPG previously built from the same library sources, mode
+    and Joern build is reused without running Joern; the returned path is then
+    the cache entry, and out_path is not written.
+    """
+
+    staging = None
+    if cache is not None:
+        key, meta = cpg_cache_key(library_path, joern_path, ignore_paths, use_cpg)
+        if dry_run:
+            out_path = cache.entry(key)
+            print(f'CPG cache {"hit" if out_path.exists() else "miss"}: {out_path}')
+            if out_path.exists():
+                return out_path
+        else:
+            cached = cache.lookup(key)
+            if cached is not None:
+                print(f'Using cached CPG: {cached}')
+                return cached
+            # Build inside the cache directory so that storing is a rename
+            staging = cache.staging_dir()
+            out_path = staging / 'out.cpg'
 
     if use_cpg:
         joern_utility = joern_path / Path('joern-parse')
@@ -53,7 +288,7 @@ def create_cpg(
         language_option = "PYTHONSRC"
         frontend_switch = "--frontend-args"
     else:
-        joern_utility = joern_path / Path('joern-cli/target/universal/stage/pysrc2cpg')
+        joern_utility = joern_path / JOERN_STAGE_PATH / Path('pysrc2cpg')
         language_switch = ""
         language_option = ""
         frontend_switch = ""
@@ -77,10 +312,17 @@ def create_cpg(
           f'{" ".join(cmd)}')
 
     if dry_run:
-        return
+        return out_path
 
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    print(result.stdout)
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        print(result.stdout)
+        if staging is not None:
+            out_path = cache.store(key, out_path, meta)
+    finally:
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+    return out_path
 
 
 def generate_policy(
@@ -131,17 +373,15 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
             description=("Generate a model loading policy for a ML library "
                          "model class"))
-    # Required arguments
+    # Required arguments (except with --cpg-cache-stats)
     parser.add_argument(
             '--library-path',
             type=Path,
-            required=True,
             help='Path to the ML library source code directory')
 
     parser.add_argument(
             '--model-class',
             type=str,
-            required=True,
             help='Model class name (use Joern fully-qualified name format)')
 
     parser.add_argument(
@@ -189,25 +429,62 @@ if __name__ == '__main__':
             '--only-cpg',
             action='store_true',
             help=('Only create CPG and return (without also generating policy)'))
+
+    parser.add_argument(
+            '--cpg-cache-path',
+            type=Path,
+            default=CPG_CACHE_PATH,
+            help=('Directory of CPGs reused across runs on the same library '
+                  'sources, mode and Joern build'))
+
+    parser.add_argument(
+            '--cpg-cache-size',
+            type=float,
+            default=CPG_CACHE_SIZE_GB,
+            help=('Maximum size of the CPG cache (in GB); least recently used '
+                  'CPGs are evicted beyond it'))
+
+    parser.add_argument(
+            '--no-cpg-cache',
+            action='store_true',
+            help=('Always create the CPG, at /tmp/out.cpg, without the cache'))
+
+    parser.add_argument(
+            '--cpg-cache-stats',
+            action='store_true',
+            help=('Print the CPG cache entries and hit rate and exit'))
     args = parser.parse_args()
 
+    cpg_cache = None
+    if not args.no_cpg_cache:
+        cpg_cache = CpgCache(args.cpg_cache_path, int(args.cpg_cache_size * (1 << 30)))
+
+    if args.cpg_cache_stats:
+        print_cpg_cache_stats(cpg_cache or CpgCache(args.cpg_cache_path, 0))
+        sys.exit(0)
+
+    if args.library_path is None:
+        parser.error('the following arguments are required: --library-path')
+    if args.model_class is None and not args.only_cpg:
+        parser.error('the following arguments are required: --model-class')
+
     if args.mem:
         available_mem = gb_to_kb(args.mem)
     else:
         available_mem = get_available_mem()
 
-    # TODO: Configure
-    intermediate_cpg = Path('/tmp/out.cpg')
-
-    create_cpg(
+    intermediate_cpg = create_cpg(
         args.library_path,
         args.joern_path,
         available_mem,
-        out_path=intermediate_cpg,
+        out_path=Path('/tmp/out.cpg'),
         ignore_paths=args.ignore_paths,
-        dry_run=args.dry_run)
+        use_cpg=args.use_cpg,
+        dry_run=args.dry_run,
+        cache=cpg_cache)
 
     if args.only_cpg:
+        print(f'CPG: {intermediate_cpg}')
         sys.exit(0)
 
     generate_policy(
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""Binary policies compiled with compile_policy_file().
+
+A JSON policy with more models than the flag bits of a single 32-bit word
+can tell apart is compiled, and every model of the image must list exactly
+the globals, reduces and limits of its JSON source. A PolicyStore over the
+directory serves the binary policies, until the JSON file changes or the
+image has another format version, when it serves the JSON policies. Exits
+with status 1 if any check fails.
+"""
+
+import argparse
+import collections
+import json
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+MODELS = 40
+
+
+def model_key(m: int) -> str:
+    return f"models/m{m}.py:<module>.Model{m}"
+
+
+def make_policy(allowed: int) -> dict:
+    # Only model *allowed* may load an OrderedDict
+    policy = {}
+    for m in range(MODELS):
+        names = [f"pbbinary.m{m}.Layer", f"pbbinary.shared.Layer{m % 3}"]
+        if m == allowed:
+            names.append("collections.OrderedDict")
+        policy[model_key(m)] = {"globals": names, "reduces": names[1:]}
+        if m % 7 == 0:
+            policy[model_key(m)]["limits"] = {"max_opcodes": 1000 + m}
+    return policy
+
+
+def check_image(enforcer, path: Path, policy: dict) -> list:
+    errors = []
+    compiled = enforcer._load_binary_policies(str(path))
+    if [p.model_name for p in compiled] != list(policy):
+        return [f"models {[p.model_name for p in compiled]}"]
+    for p in compiled:
+        spec = policy[p.model_name]
+        limits = p.limits.as_dict() if p.limits is not None else {}
+        if (
+            set(p.globals) != set(spec["globals"])
+            or set(p.reduces) != set(spec["reduces"])
+            or limits != spec.get("limits", {})
+        ):
+            errors.append(f"{p.model_name}: {sorted(p.globals)}, {sorted(p.reduces)}")
+        # Listed by other models only
+        for name in ("pbbinary.m0.Layer", "pbbinary.m39.Layer"):
+            if (name in p.globals) != (name in spec["globals"]):
+                errors.append(f"{p.model_name}: lookup of {name}")
+    return errors
+
+
+def check_store(enforcer, root: Path, allowed: int, binary: bool, label) -> list:
+    errors = []
+    data = pickle.dumps(collections.OrderedDict(a=1), protocol=4)
+    store = enforcer.PolicyStore(root)
+    for m in (0, allowed):
+        policy = store[model_key(m)]
+        if policy.path.endswith(".pbp") is not binary:
+            errors.append(f"{label}: serves {policy.path}")
+        try:
+            loaded = enforcer.loads(data, policy=policy)
+        except Exception:
+            loaded = None
+        if isinstance(loaded, collections.OrderedDict) is not (m == allowed):
+            errors.append(f"{label}: model {m} loaded {loaded!r}")
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        source = root / "policies.json"
+        policy = make_policy(MODELS - 1)
+        source.write_text(json.dumps(policy))
+        binary = Path(enforcer.compile_policy_file(source))
+        errors += check_image(enforcer, binary, policy)
+        errors += check_store(enforcer, root, MODELS - 1, True, "compiled")
+
+        # An edited source is served from JSON until it is recompiled
+        st = os.stat(binary)
+        source.write_text(json.dumps(make_policy(MODELS - 2)))
+        os.utime(binary, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        errors += check_store(enforcer, root, MODELS - 2, False, "edited")
+        enforcer.compile_policy_file(source)
+        errors += check_store(enforcer, root, MODELS - 2, True, "recompiled")
+
+        image = bytearray(binary.read_bytes())
+        image[8] += 1
+        binary.write_bytes(image)
+        errors += check_store(enforcer, root, MODELS - 2, False, "other version")
+        try:
+            enforcer._load_binary_policies(str(binary))
+        except ValueError:
+            pass
+        else:
+            errors.append("other version: image was read")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
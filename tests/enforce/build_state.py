@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""BUILD states that would overwrite __module__ or __name__.
+
+REDUCE identifies callables by their __module__ and __name__, so BUILD must
+not set them on an object. The state of a pickled object may be a dict, a
+dict subclass or any other mapping with items() (such as a UserDict), either
+on its own or as the dict or slot state of a (state, slotstate) pair, and it
+may be passed to __setstate__. Each such state naming __module__ must be
+refused by the pure-Python unpickler, and the same states without it must
+load. Exits with status 1 if any check fails.
+"""
+
+import argparse
+import collections
+import json
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+TYPES_MODULE = "pbbuild_types"
+
+TYPES_SOURCE = """\
+class Target:
+    pass
+
+
+class WithSetstate:
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
+class Built:
+    # Pickled as cls() followed by BUILD with the given state
+    def __init__(self, cls, state):
+        self.cls = cls
+        self.state = state
+
+    def __reduce__(self):
+        return self.cls, (), self.state
+"""
+
+
+def write_policy(root: Path) -> str:
+    names = [f"{TYPES_MODULE}.Target", f"{TYPES_MODULE}.WithSetstate"]
+    path = root / "policy.json"
+    path.write_text(
+        json.dumps({f"{TYPES_MODULE}.py:<module>.Model": {
+            "globals": names + ["collections.UserDict", "collections.OrderedDict"],
+            "reduces": names + ["collections.OrderedDict"],
+        }})
+    )
+    return str(path)
+
+
+def states(attrs: dict) -> dict:
+    return {
+        "dict": dict(attrs),
+        "OrderedDict": collections.OrderedDict(attrs),
+        "UserDict": collections.UserDict(attrs),
+        "slot state UserDict": (None, collections.UserDict(attrs)),
+        "dict state UserDict": (collections.UserDict(attrs), None),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / f"{TYPES_MODULE}.py").write_text(TYPES_SOURCE)
+        sys.path.insert(0, tmp)
+        types = __import__(TYPES_MODULE)
+        policy = write_policy(root)
+
+        for cls in (types.Target, types.WithSetstate):
+            for kind, state in states({"__module__": "os", "x": 1}).items():
+                label = f"{cls.__name__}, {kind}"
+                if cls is types.WithSetstate and isinstance(state, tuple):
+                    continue
+                data = pickle.dumps(types.Built(cls, state), protocol=4)
+                try:
+                    obj = enforcer.loads(data, policy=policy)
+                except Exception as exc:
+                    expected = "BUILD attempted to set attribute __module__"
+                    if not str(exc).startswith(expected):
+                        errors.append(f"{label}: failed with {exc!r}")
+                else:
+                    errors.append(f"{label}: loaded, __module__ is {obj.__module__}")
+
+            for kind, state in states({"x": 1}).items():
+                label = f"{cls.__name__}, {kind} without __module__"
+                if cls is types.WithSetstate and isinstance(state, tuple):
+                    continue
+                data = pickle.dumps(types.Built(cls, state), protocol=4)
+                obj = enforcer.loads(data, policy=policy)
+                if type(obj) is not cls or obj.x != 1:
+                    errors.append(f"{label}: loaded {obj!r}")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""Stress test for concurrent enforced loads.
+
+Starts N threads that each load their own pickle under their own policy,
+half of them passing the policy as an argument and half selecting it with
+using_policy(). Each pickle holds an instance of a class its policy allows
+and a reference to the class of the next thread, which its policy denies.
+The test checks that:
+
+- every load returns its own object and a stub for exactly the denied name,
+  and last_load() in each thread reports only that load's stubs;
+- the process-wide telemetry counters, kept while events go to a sink,
+  add up to the number of loads, and no load is counted without a sink;
+- loads per second with N threads are at least --min-scaling times the
+  single-thread rate (about 1.0 with the GIL, higher without it).
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer
+
+TYPES_MODULE = "pbconcurrent_types"
+
+
+def make_fixtures(root: Path, threads: int, items: int) -> list:
+    """Write the types module and per-thread policies; return the cases."""
+    (root / f"{TYPES_MODULE}.py").write_text(
+        "".join(
+            f"class T{i}:\n    def __init__(self, value):\n        self.value = value\n"
+            for i in range(threads)
+        )
+    )
+    sys.path.insert(0, str(root))
+    types = __import__(TYPES_MODULE)
+
+    cases = []
+    for i in range(threads):
+        cls = getattr(types, f"T{i}")
+        denied = f"{TYPES_MODULE}.T{(i + 1) % threads}"
+        policy = root / f"policy_{i}.json"
+        policy.write_text(
+            json.dumps(
+                {f"{TYPES_MODULE}.py:<module>.T{i}": {
+                    "globals": [f"{TYPES_MODULE}.T{i}"],
+                    "reduces": [],
+                }}
+            )
+        )
+        payload = [{"thread": i, "item": k, "name": f"n{k}"} for k in range(items)]
+        data = pickle.dumps(
+            [cls(i), getattr(types, f"T{(i + 1) % threads}"), payload], protocol=4
+        )
+        cases.append((i, str(policy), data, cls, denied, payload))
+    return cases
+
+
+def worker(enforcer, case, loads, barrier, errors, fast, scoped):
+    i, policy, data, cls, denied, payload = case
+    load = enforcer.fast_loads if fast else enforcer.loads
+    barrier.wait()
+    for _ in range(loads):
+        if scoped:
+            with enforcer.using_policy(policy):
+                obj = load(data)
+        else:
+            obj = load(data, policy=policy)
+        record = enforcer.last_load()
+        if type(obj[0]) is not cls or obj[0].value != i:
+            errors.append(f"thread {i}: loaded {obj[0]!r}")
+        elif not isinstance(obj[1], enforcer.StubObject) or obj[1].orig_name != denied:
+            errors.append(f"thread {i}: expected a stub for {denied}, got {obj[1]!r}")
+        elif obj[2] != payload:
+            errors.append(f"thread {i}: payload mismatch")
+        elif record is None or not record["ok"] or record["stubs"] != [denied]:
+            errors.append(f"thread {i}: last_load() reported {record}")
+        if len(errors) > 20:
+            return
+
+
+def run(enforcer, cases, loads, fast):
+    """Load every case on its own thread; return (seconds, errors)."""
+    barrier = threading.Barrier(len(cases) + 1)
+    errors = []
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(enforcer, case, loads, barrier, errors, fast, n % 2 == 1),
+        )
+        for n, case in enumerate(cases)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--loads", type=int, default=200,
+                        help="loads per thread")
+    parser.add_argument("--items", type=int, default=200,
+                        help="payload entries per pickle")
+    parser.add_argument("--fast", action="store_true",
+                        help="load with FastUnpickler")
+    parser.add_argument("--min-scaling", type=float, default=0.5,
+                        help="minimum N-thread / 1-thread throughput ratio")
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+    if args.threads < 2:
+        parser.error("--threads must be at least 2")
+
+    enforcer = import_enforcer(args.enforcer)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = make_fixtures(Path(tmp), args.threads, args.items)
+        enforcer.configure_telemetry(sink=os.devnull)
+
+        # Single thread, as many loads as all threads make together
+        single, single_errors = run(
+            enforcer, cases[:1], args.loads * args.threads, args.fast
+        )
+
+        enforcer.reset_telemetry_counters()
+        concurrent, errors = run(enforcer, cases, args.loads, args.fast)
+        counters = enforcer.telemetry_counters()
+        enforcer.configure_telemetry(sink=False)
+        # Without a sink nothing is counted
+        run(enforcer, cases[:1], 1, args.fast)
+        unchanged = enforcer.telemetry_counters() == counters
+
+    errors = single_errors + errors
+    for error in errors[:20]:
+        print(error, file=sys.stderr)
+    failed |= bool(errors)
+
+    if not unchanged:
+        print("counters changed without a telemetry sink", file=sys.stderr)
+        failed = True
+
+    total = args.threads * args.loads
+    for name in ("loads", "stubs_created", "denied_globals"):
+        if counters[name] != total:
+            print(f"counter {name} is {counters[name]}, expected {total}",
+                  file=sys.stderr)
+            failed = True
+
+    single_rate = total / single
+    concurrent_rate = total / concurrent
+    scaling = concurrent_rate / single_rate
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"{'fast' if args.fast else 'enforce'}: {total} loads, "
+          f"1 thread {single_rate:.0f} loads/s, {args.threads} threads "
+          f"{concurrent_rate:.0f} loads/s, scaling {scaling:.2f} "
+          f"(GIL {'enabled' if gil else 'disabled'})")
+    if scaling < args.min_scaling:
+        print(f"scaling below {args.min_scaling}", file=sys.stderr)
+        failed = True
+
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
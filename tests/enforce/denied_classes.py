@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""Loads of pickles that instantiate or call classes the policy denies.
+
+Pickles written with protocol 2 and later create class instances with NEWOBJ
+(or NEWOBJ_EX for classes with __getnewargs_ex__). When the policy denies the
+class, the class and every instance of it load as the same StubObject; when
+the policy allows it, the instances load normally. A class that is an allowed
+global but not an allowed reduce may be instantiated by NEWOBJ but not called
+by REDUCE.
+
+Every pickle is loaded by the pure-Python unpickler and by FastUnpickler
+(from a seekable and from an unseekable stream), which must agree.
+
+A FastUnpickler subclass that overrides find_class, as torch's does, must
+keep enforcing the policy when it is reused for stacked pickles after a load
+fell back to the pure-Python unpickler, and must load each pickle in turn.
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import io
+import json
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+TYPES_MODULE = "pbdenied_types"
+
+# int subclasses carry their value in the NEWOBJ arguments, so their
+# pickles have no BUILD state
+TYPES_SOURCE = """\
+class Plain(int):
+    def __new__(cls, value):
+        return super().__new__(cls, value)
+
+
+class KeywordNew(int):
+    def __new__(cls, *, value):
+        return super().__new__(cls, value)
+
+    def __getnewargs_ex__(self):
+        return (), {"value": int(self)}
+
+
+class Called(int):
+    # Pickled as a call of the class itself
+    def __reduce__(self):
+        return Called, (int(self),)
+"""
+
+
+class Unseekable:
+    """Stream with only read() and readline(), like a pipe."""
+
+    def __init__(self, data):
+        self._file = io.BytesIO(data)
+
+    def read(self, n=-1):
+        return self._file.read(n)
+
+    def readline(self):
+        return self._file.readline()
+
+
+def loaders(enforcer) -> dict:
+    return {
+        "enforce": lambda data, policy: enforcer.loads(data, policy=policy),
+        "fast": lambda data, policy: enforcer.fast_loads(data, policy=policy),
+        "fast, unseekable": lambda data, policy: enforcer.FastUnpickler(
+            Unseekable(data), policy=policy
+        ).load(),
+    }
+
+
+def write_policy(root: Path, name: str, globals_: list) -> str:
+    path = root / f"{name}.json"
+    path.write_text(
+        json.dumps({f"{TYPES_MODULE}.py:<module>.Model": {
+            "globals": globals_,
+            "reduces": [],
+        }})
+    )
+    return str(path)
+
+
+def check_denied(enforcer, load, data, names, policy, label) -> list:
+    obj = load(data, policy)
+    errors = []
+    if not all(isinstance(o, enforcer.StubObject) for o in obj):
+        errors.append(f"{label}: expected stubs, got {obj!r}")
+    elif len({id(o) for o in obj}) != len(names):
+        errors.append(f"{label}: stubs are not shared per name")
+    elif sorted({o.orig_name for o in obj}) != names:
+        errors.append(f"{label}: stubbed {[o.orig_name for o in obj]}")
+    elif enforcer.last_load()["stubs"] != names:
+        errors.append(f"{label}: last_load() reported {enforcer.last_load()}")
+    return errors
+
+
+def check_allowed(load, data, types, policy, label) -> list:
+    obj = load(data, policy)
+    if [type(o) for o in obj] != types or obj != [1, 2]:
+        return [f"{label}: loaded {obj!r}"]
+    return []
+
+
+def check_refused(load, data, name, policy, label) -> list:
+    try:
+        obj = load(data, policy)
+    except Exception as exc:
+        if str(exc) != f"Tried to call {name}":
+            return [f"{label}: failed with {exc!r}"]
+        return []
+    return [f"{label}: loaded {obj!r} instead of refusing to call {name}"]
+
+
+def check_reused(enforcer, types, policy) -> list:
+    class Subclassed(enforcer.FastUnpickler):
+        def find_class(self, module, name):
+            return super().find_class(module, name)
+
+    # The denied class makes the first load fall back
+    data = b"".join(
+        pickle.dumps(obj, protocol=4)
+        for obj in ([types.Plain(1)], [1, 2], [types.Called(3)])
+    )
+    name = f"{TYPES_MODULE}.Called"
+    errors = []
+    for label, stream in (("seekable", io.BytesIO), ("unseekable", Unseekable)):
+        label = f"reused subclass, {label}"
+        unpickler = Subclassed(stream(data), policy=policy)
+        first = unpickler.load()
+        if not isinstance(first[0], enforcer.StubObject):
+            errors.append(f"{label}: first load gave {first!r}")
+        second = unpickler.load()
+        if second != [1, 2]:
+            errors.append(f"{label}: second load gave {second!r}")
+        errors += check_refused(lambda *_: unpickler.load(), None, name, None, label)
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / f"{TYPES_MODULE}.py").write_text(TYPES_SOURCE)
+        sys.path.insert(0, tmp)
+        types = __import__(TYPES_MODULE)
+        denied = write_policy(root, "denied", [])
+        allowed = write_policy(
+            root, "allowed",
+            [f"{TYPES_MODULE}.{name}" for name in ("Plain", "KeywordNew", "Called")],
+        )
+
+        for loader, load in loaders(enforcer).items():
+            for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+                for cls in (types.Plain, types.KeywordNew):
+                    if cls is types.KeywordNew and protocol < 4:
+                        # NEWOBJ_EX needs protocol 4
+                        continue
+                    label = f"{loader}: {cls.__name__}, protocol {protocol}"
+                    name = f"{TYPES_MODULE}.{cls.__name__}"
+                    data = pickle.dumps(
+                        [cls(value=1), cls(value=2)], protocol=protocol
+                    )
+                    errors += check_denied(
+                        enforcer, load, data, [name], denied, label
+                    )
+                    errors += check_allowed(load, data, [cls, cls], allowed, label)
+
+                # REDUCE of a class that is a global but not a reduce
+                label = f"{loader}: Called, protocol {protocol}"
+                name = f"{TYPES_MODULE}.Called"
+                data = pickle.dumps([types.Called(1)], protocol=protocol)
+                errors += check_refused(load, data, name, denied, label)
+                errors += check_refused(load, data, name, allowed, label)
+
+        errors += check_reused(enforcer, types, denied)
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
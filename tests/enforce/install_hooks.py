@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+"""Enforcement hooked into pickle and torch with install() and enforcing().
+
+With scope="pickle", pickle.load, pickle.loads and pickle.Unpickler of the
+standard library are replaced by the enforcing versions (FastUnpickler and
+its functions with fast=True) and enforce the installed policy, unless
+using_policy() selects another; uninstall() puts the originals back.
+Installing again replaces the previous installation, enforcing() blocks nest
+and restore what was installed around them, and a failed or refused install
+leaves nothing patched. The torch scope patches torch.load when torch is
+installed. Exits with status 1 if any check fails.
+"""
+
+import argparse
+import collections
+import io
+import json
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+# Pickled by reference, so that a load that denies them stubs them
+CLASSES = [collections.OrderedDict, collections.Counter]
+DATA = pickle.dumps(CLASSES, protocol=4)
+
+
+def write_policy(root: Path, name: str) -> str:
+    # Allows one of CLASSES only
+    path = root / f"{name}.json"
+    names = [f"collections.{name}"]
+    path.write_text(
+        json.dumps(
+            {"install_hooks.py:<module>.Model": {"globals": names, "reduces": names}}
+        )
+    )
+    return str(path)
+
+
+def pickle_api() -> tuple:
+    return pickle.load, pickle.loads, pickle.Unpickler
+
+
+def built(enforcer) -> list:
+    # Names of CLASSES built by each of the pickle entry points
+    results = []
+    for loaded in (
+        pickle.loads(DATA),
+        pickle.load(io.BytesIO(DATA)),
+        pickle.Unpickler(io.BytesIO(DATA)).load(),
+    ):
+        results.append(
+            [c.__name__ for c in loaded if not isinstance(c, enforcer.StubObject)]
+        )
+    return results
+
+
+def check_built(enforcer, expected, label) -> list:
+    results = built(enforcer)
+    if results != [expected] * 3:
+        return [f"{label}: built {results}"]
+    return []
+
+
+def check_install(enforcer, ordered, counter, original) -> list:
+    errors = []
+    for fast in (False, True):
+        label = "fast" if fast else "install"
+        unpickler = enforcer.FastUnpickler if fast else enforcer._Unpickler
+        enforcer.install(ordered, scope="pickle", fast=fast)
+        try:
+            if pickle.Unpickler is not unpickler:
+                errors.append(f"{label}: pickle.Unpickler is {pickle.Unpickler!r}")
+            errors += check_built(enforcer, ["OrderedDict"], label)
+            with enforcer.using_policy(counter):
+                errors += check_built(enforcer, ["Counter"], f"{label}, using_policy")
+            # Installing again replaces the policy and the hooks
+            enforcer.install(counter, scope="pickle")
+            errors += check_built(enforcer, ["Counter"], f"{label}, again")
+        finally:
+            enforcer.uninstall()
+        if pickle_api() != original:
+            errors.append(f"{label}: uninstall() left {pickle_api()}")
+    return errors
+
+
+def check_enforcing(enforcer, ordered, counter, original) -> list:
+    errors = []
+    enforcer.install(counter, scope="pickle", fast=True)
+    try:
+        installed = pickle_api()
+        with enforcer.enforcing(ordered, scope="pickle"):
+            errors += check_built(enforcer, ["OrderedDict"], "enforcing")
+            with enforcer.enforcing(counter, scope="pickle"):
+                errors += check_built(enforcer, ["Counter"], "nested enforcing")
+            errors += check_built(enforcer, ["OrderedDict"], "after nested")
+        if pickle_api() != installed:
+            errors.append(f"after enforcing: {pickle_api()}")
+        errors += check_built(enforcer, ["Counter"], "after enforcing")
+    finally:
+        enforcer.uninstall()
+
+    try:
+        with enforcer.enforcing(ordered, scope="pickle"):
+            raise KeyError("body")
+    except KeyError:
+        pass
+    if pickle_api() != original:
+        errors.append(f"enforcing after an error left {pickle_api()}")
+    return errors
+
+
+def check_refused(enforcer, ordered, original) -> list:
+    errors = []
+    try:
+        enforcer.install(ordered, scope=("pickle", "pickles"))
+    except ValueError:
+        pass
+    else:
+        enforcer.uninstall()
+        errors.append("unknown scope accepted")
+    if pickle_api() != original:
+        errors.append(f"unknown scope left {pickle_api()}")
+
+    try:
+        import torch
+    except ImportError:
+        # The pickle hooks installed first are rolled back
+        try:
+            enforcer.install(ordered, scope=("pickle", "torch"))
+        except ImportError:
+            pass
+        else:
+            enforcer.uninstall()
+            errors.append("torch scope installed without torch")
+        if pickle_api() != original:
+            errors.append(f"failed torch scope left {pickle_api()}")
+        return errors
+
+    load = torch.load
+    with enforcer.enforcing(ordered):
+        if torch.load is load:
+            errors.append("torch scope left torch.load")
+        if pickle_api() != original:
+            errors.append(f"torch scope patched pickle: {pickle_api()}")
+    if torch.load is not load:
+        errors.append(f"torch.load is {torch.load!r} after enforcing")
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    original = pickle_api()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        ordered = write_policy(root, "OrderedDict")
+        counter = write_policy(root, "Counter")
+        errors += check_install(enforcer, ordered, counter, original)
+        errors += check_enforcing(enforcer, ordered, counter, original)
+        errors += check_refused(enforcer, ordered, original)
+    enforcer.uninstall()
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""Loads with load_async().
+
+A pickle larger than one read chunk loads from bytes, from a file object
+and from an asyncio.StreamReader fed a piece at a time, and the names the
+policy denies are stubbed. The policy selected with using_policy() in the
+awaiting task applies, and last_load() reports the load in that task only.
+Cancelling the task while the load waits for data raises CancelledError
+and frees the executor thread. Exits with status 1 if any check fails.
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import io
+import json
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+# Allowed by the policy, and a class it denies (pickled by reference)
+ALLOWED = collections.OrderedDict
+DENIED = collections.Counter
+
+
+def write_policy(root: Path) -> str:
+    path = root / "policy.json"
+    names = ["collections.OrderedDict"]
+    path.write_text(
+        json.dumps(
+            {"load_async.py:<module>.Model": {"globals": names, "reduces": names}}
+        )
+    )
+    return str(path)
+
+
+def make_data(enforcer) -> bytes:
+    # Several frames, so the load reads the source more than once
+    count = 4 * enforcer._ASYNC_READ_SIZE // 100
+    rows = [ALLOWED(row=i, text="x" * 100) for i in range(count)]
+    return pickle.dumps([rows, DENIED], protocol=4)
+
+
+def check_loaded(enforcer, loaded, data, label) -> list:
+    rows, denied = pickle.loads(data)
+    if not isinstance(loaded, list) or len(loaded) != 2 or loaded[0] != rows:
+        return [f"{label}: loaded {type(loaded).__name__}"]
+    if not isinstance(loaded[1], enforcer.StubObject):
+        return [f"{label}: denied name loaded {loaded[1]!r}"]
+    return []
+
+
+async def feed(stream, data, pieces=8):
+    step = -(-len(data) // pieces)
+    for start in range(0, len(data), step):
+        await asyncio.sleep(0.001)
+        stream.feed_data(data[start : start + step])
+    stream.feed_eof()
+
+
+async def check_sources(enforcer, policy, data, path) -> list:
+    errors = []
+    with open(path, "rb") as f:
+        sources = {"bytes": data, "BytesIO": io.BytesIO(data), "file": f}
+        for label, source in sources.items():
+            loaded = await enforcer.load_async(source, policy=policy)
+            errors += check_loaded(enforcer, loaded, data, label)
+
+    stream = asyncio.StreamReader()
+    feeding = asyncio.ensure_future(feed(stream, data))
+    loaded = await enforcer.load_async(stream, policy=policy)
+    await feeding
+    errors += check_loaded(enforcer, loaded, data, "StreamReader")
+    return errors
+
+
+async def check_context(enforcer, policy, data) -> list:
+    errors = []
+    # By reference, so that a denied load stubs it rather than failing
+    small = pickle.dumps(ALLOWED, protocol=4)
+
+    async def load(selected):
+        with enforcer.using_policy(selected):
+            loaded = await enforcer.load_async(small)
+            await asyncio.sleep(0.01)
+            return loaded, enforcer.last_load()
+
+    before = enforcer.last_load()
+    # The process default allows nothing
+    (allowed, record), (denied, other) = await asyncio.gather(
+        load(policy), load(enforcer.POLICY_PATH)
+    )
+    if allowed is not ALLOWED or record["policy"] != policy or record["stubs"]:
+        errors.append(f"using_policy(): loaded {allowed!r}, recorded {record}")
+    stubs = ["collections.OrderedDict"]
+    if not isinstance(denied, enforcer.StubObject) or other["stubs"] != stubs:
+        errors.append(f"default policy: loaded {denied!r}, recorded {other}")
+    if enforcer.last_load() != before:
+        errors.append(f"loads of other tasks set last_load() {enforcer.last_load()}")
+
+    await enforcer.load_async(data, policy=policy)
+    record = enforcer.last_load()
+    if record is None or record["stubs"] != ["collections.Counter"]:
+        errors.append(f"last_load() after load_async(): {record}")
+    return errors
+
+
+async def check_cancel(enforcer, policy, data) -> list:
+    errors = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    stream = asyncio.StreamReader()
+    stream.feed_data(data[: len(data) // 2])
+    task = asyncio.ensure_future(
+        enforcer.load_async(stream, executor=executor, policy=policy)
+    )
+    await asyncio.sleep(0.2)
+    if task.done():
+        errors.append(f"load of half a pickle finished: {task!r}")
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as exc:
+        errors.append(f"cancelled load raised {exc!r}")
+    else:
+        errors.append("cancelled load returned")
+    # The only worker is free again once the load thread has stopped
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(loop.run_in_executor(executor, int), 5)
+    except asyncio.TimeoutError:
+        errors.append("cancelled load kept its thread")
+    executor.shutdown(wait=False)
+    return errors
+
+
+async def run(enforcer, policy, path) -> list:
+    data = make_data(enforcer)
+    Path(path).write_bytes(data)
+    errors = await check_sources(enforcer, policy, data, path)
+    errors += await check_context(enforcer, policy, data)
+    errors += await check_cancel(enforcer, policy, data)
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        policy = write_policy(root)
+        # No policy.json there: loads without a policy allow nothing
+        (root / "default").mkdir()
+        enforcer.POLICY_PATH = str(root / "default")
+        errors = asyncio.run(run(enforcer, policy, root / "data.pkl"))
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
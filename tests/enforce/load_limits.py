@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""Loads under LoadLimits budgets.
+
+For each budget (max_opcodes, max_bytes, max_memo, max_stack_depth and
+max_payload) a pickle that needs exactly the budget loads, and one that needs
+one more is refused with an UnpicklingError naming the budget. max_payload
+is checked for every length-prefixed opcode, but not for fixed-width
+arguments or protocol 0 lines, so a budget of a few bytes still loads
+ordinary pickles of every protocol. Budgets of the policy and of the caller
+combine to the stricter of the two. Exits with status 1 if any check fails.
+"""
+
+import argparse
+import io
+import json
+import pickle
+import pickletools
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+# Length-prefixed payloads of 10 bytes and the opcodes that carry them
+PAYLOADS = {
+    "SHORT_BINUNICODE": "x" * 10,
+    "BINUNICODE": "x" * 10,
+    "SHORT_BINBYTES": b"x" * 10,
+    "BINBYTES": b"x" * 10,
+    "LONG1": 2 ** 71,
+    "BYTEARRAY8": bytearray(10),
+}
+
+
+def write_policy(root: Path, limits=None) -> str:
+    spec = {
+        "globals": ["collections.OrderedDict"],
+        "reduces": ["collections.OrderedDict"],
+    }
+    if limits is not None:
+        spec["limits"] = limits
+    path = root / f"policy{len(list(root.iterdir()))}.json"
+    path.write_text(json.dumps({"load_limits.py:<module>.Model": spec}))
+    return str(path)
+
+
+def check_budget(enforcer, data, policy, budget, value, label) -> list:
+    # data needs exactly value of budget: it loads with it and not with less
+    errors = []
+    expected = pickle.loads(data)
+    try:
+        obj = enforcer.loads(data, policy=policy, limits={budget: value})
+    except Exception as exc:
+        errors.append(f"{label}: {budget}={value} failed with {exc!r}")
+    else:
+        if obj != expected:
+            errors.append(f"{label}: loaded {obj!r}")
+    if value > 1:
+        errors += check_refused(
+            enforcer, data, policy, {budget: value - 1}, budget, label
+        )
+    return errors
+
+
+def check_refused(enforcer, data, policy, limits, budget, label) -> list:
+    try:
+        obj = enforcer.loads(data, policy=policy, limits=limits)
+    except enforcer.UnpicklingError as exc:
+        if f"({budget}=" not in str(exc):
+            return [f"{label}: {limits} failed with {exc!r}"]
+        return []
+    except Exception as exc:
+        return [f"{label}: {limits} raised {exc!r}"]
+    return [f"{label}: {limits} loaded {obj!r}"]
+
+
+def opcodes(data) -> int:
+    return sum(1 for _ in pickletools.genops(data))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        policy = write_policy(root)
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            label = f"protocol {protocol}"
+            obj = {"a": [1.5, -7, 300, "ab"], "b": (None, True)}
+            data = pickle.dumps(obj, protocol=protocol)
+            errors += check_budget(
+                enforcer, data, policy, "max_bytes", len(data), label
+            )
+            # STOP ends the load before it is counted
+            errors += check_budget(
+                enforcer, data, policy, "max_opcodes", opcodes(data) - 1, label
+            )
+            # Its strings are at most 2 bytes long; the 8-byte FRAME length
+            # and BINFLOAT are fixed-width, and protocol 0 writes lines
+            for budget in (2, 4):
+                try:
+                    enforcer.loads(data, policy=policy, limits={"max_payload": budget})
+                except Exception as exc:
+                    errors.append(f"{label}: max_payload={budget} failed with {exc!r}")
+
+            distinct = [[i] for i in range(20)]
+            data = pickle.dumps([distinct, distinct[0]], protocol=protocol)
+            unpickler = pickle.Unpickler(io.BytesIO(data))
+            unpickler.load()
+            errors += check_budget(
+                enforcer, data, policy, "max_memo", len(unpickler.memo.copy()), label
+            )
+
+            # Each level is a MARK ... TUPLE inside the MARK of the level
+            # around it
+            nested = 0
+            for _ in range(30):
+                nested = (nested, 1, 2, 3)
+            data = pickle.dumps(nested, protocol=protocol)
+            errors += check_budget(enforcer, data, policy, "max_stack_depth", 30, label)
+
+        for opcode, value in PAYLOADS.items():
+            protocol = 5 if opcode == "BYTEARRAY8" else 4
+            data = pickle.dumps([value], protocol=protocol)
+            if opcode in ("BINUNICODE", "BINBYTES"):
+                # The pickler writes payloads this short with the SHORT_
+                # opcodes; use the 4-byte length form instead
+                short = getattr(pickle, f"SHORT_{opcode}") + bytes([10])
+                data = pickle.dumps([value], protocol=3).replace(
+                    short, getattr(pickle, opcode) + (10).to_bytes(4, "little")
+                )
+            names = {op.name for op, _, _ in pickletools.genops(data)}
+            label = f"max_payload, {opcode}"
+            if opcode not in names:
+                errors.append(f"{label}: pickle uses {sorted(names)}")
+                continue
+            errors += check_budget(enforcer, data, policy, "max_payload", 10, label)
+
+        # The stricter of the policy's and the caller's budgets applies
+        data = pickle.dumps(["x" * 10], protocol=4)
+        strict = write_policy(root, {"max_payload": 9})
+        errors += check_refused(enforcer, data, strict, None, "max_payload", "policy")
+        errors += check_refused(
+            enforcer, data, strict, {"max_payload": 100}, "max_payload",
+            "policy, looser caller",
+        )
+        loose = write_policy(root, {"max_payload": 100})
+        errors += check_refused(
+            enforcer, data, loose, {"max_payload": 9}, "max_payload", "stricter caller"
+        )
+        try:
+            enforcer.LoadLimits(max_payload=0)
+        except ValueError:
+            pass
+        else:
+            errors.append("LoadLimits accepted max_payload=0")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
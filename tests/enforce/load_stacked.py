@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""Loads of pickles stored back to back with load_stacked().
+
+A file written by one dump() per protocol yields every pickle in order,
+from a seekable file and from a pipe, with objects shared within a pickle
+and not across pickles. Every pickle starts with an empty memo and its own
+budget of limits. A name the policy denies in a later pickle is stubbed
+without affecting the others, and a truncated last pickle raises what
+load() raises for it after the complete ones are yielded. Exits with
+status 1 if any check fails.
+"""
+
+import argparse
+import collections
+import io
+import json
+import os
+import pickle
+import pickletools
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+# PROTO 4, BINGET 0, STOP: the first memo entry of the pickle
+GET_FIRST = b"\x80\x04h\x00."
+
+
+def write_policy(root: Path) -> str:
+    path = root / "policy.json"
+    names = ["collections.OrderedDict"]
+    path.write_text(
+        json.dumps(
+            {"load_stacked.py:<module>.Model": {"globals": names, "reduces": names}}
+        )
+    )
+    return str(path)
+
+
+def make_objects() -> list:
+    objects = []
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        shared = ["shared", protocol]
+        objects.append(
+            (protocol, collections.OrderedDict(a=shared, b=shared, n=protocol))
+        )
+    return objects
+
+
+def dump_all(objects) -> bytes:
+    f = io.BytesIO()
+    for protocol, obj in objects:
+        pickle.dump(obj, f, protocol=protocol)
+    return f.getvalue()
+
+
+def check_stream(enforcer, policy, f, objects, label, limits=None) -> list:
+    errors = []
+    try:
+        loaded = list(enforcer.load_stacked(f, policy=policy, limits=limits))
+    except Exception as exc:
+        return [f"{label}: failed with {exc!r}"]
+    expected = [obj for _, obj in objects]
+    if loaded != expected:
+        return [f"{label}: loaded {loaded!r}"]
+    for i, obj in enumerate(loaded):
+        if obj["a"] is not obj["b"]:
+            errors.append(f"{label}: pickle {i} does not share its list")
+        if i and obj["a"] is loaded[i - 1]["a"]:
+            errors.append(f"{label}: pickles {i - 1} and {i} share a list")
+    return errors
+
+
+def check_pipe(enforcer, policy, data, objects) -> list:
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with open(write_fd, "wb") as w:
+            w.write(data)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        with open(read_fd, "rb") as r:
+            if r.seekable():
+                return ["pipe is seekable"]
+            return check_stream(enforcer, policy, r, objects, "pipe")
+    finally:
+        writer.join()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        policy = write_policy(root)
+        objects = make_objects()
+        data = dump_all(objects)
+        path = root / "stacked.pkl"
+        path.write_bytes(data)
+
+        with open(path, "rb") as f:
+            errors += check_stream(enforcer, policy, f, objects, "file")
+        errors += check_pipe(enforcer, policy, data, objects)
+        if list(enforcer.load_stacked(io.BytesIO(b""), policy=policy)):
+            errors.append("empty file yielded a pickle")
+
+        # Enough opcodes for the longest pickle, not for all of them
+        longest = max(
+            sum(1 for _ in pickletools.genops(pickle.dumps(obj, protocol=protocol)))
+            for protocol, obj in objects
+        )
+        errors += check_stream(
+            enforcer, policy, io.BytesIO(data), objects, "limits",
+            limits={"max_opcodes": longest},
+        )
+
+        # The memo of the first pickle is gone when the second one starts
+        first = pickle.dumps(["first"], protocol=4)
+        loaded = enforcer.load_stacked(io.BytesIO(first + GET_FIRST), policy=policy)
+        if next(loaded) != ["first"]:
+            errors.append("memo: first pickle not loaded")
+        try:
+            value = next(loaded)
+        except enforcer.UnpicklingError:
+            pass
+        except Exception as exc:
+            errors.append(f"memo: second pickle raised {exc!r}")
+        else:
+            errors.append(f"memo: second pickle loaded {value!r}")
+
+        # Denied in the second pickle only
+        stream = io.BytesIO()
+        for obj in (["before"], [collections.Counter], ["after"]):
+            pickle.dump(obj, stream, protocol=4)
+        stream.seek(0)
+        loaded = list(enforcer.load_stacked(stream, policy=policy))
+        if (
+            len(loaded) != 3
+            or loaded[0] != ["before"]
+            or loaded[2] != ["after"]
+            or not isinstance(loaded[1][0], enforcer.StubObject)
+        ):
+            errors.append(f"denied name: loaded {loaded!r}")
+
+        # Cut in the last pickle's final frame and at its STOP
+        last = len(pickle.dumps(objects[-1][1], protocol=objects[-1][0]))
+        for cut in (3, 1):
+            try:
+                enforcer.loads(data[-last:-cut], policy=policy)
+            except Exception as exc:
+                expected = type(exc)
+            else:
+                expected = None
+            loaded = []
+            try:
+                truncated = io.BytesIO(data[:-cut])
+                for obj in enforcer.load_stacked(truncated, policy=policy):
+                    loaded.append(obj)
+            except Exception as exc:
+                raised = type(exc)
+            else:
+                raised = None
+            label = f"cut {cut}"
+            if expected is None or raised is not expected:
+                errors.append(f"{label}: raised {raised}, load() raised {expected}")
+            if loaded != [obj for _, obj in objects[:-1]]:
+                errors.append(f"{label}: yielded {len(loaded)} pickles")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""The memo of the pure-Python unpickler as a live mapping.
+
+Entries assigned one by one through Unpickler.memo before a load must be
+found by the GET opcodes of that load, in both the list and the dict form
+of the memo, like a memo assigned as a whole to the stdlib's pure-Python
+unpickler. Entries deleted or cleared through it must be gone, and reads
+after a load must see what the load stored. Exits with status 1 if any
+check fails.
+"""
+
+import argparse
+import io
+import json
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+# PROTO 4, BINGET 0, STOP and the same with LONG_BINGET 5000
+GET_FIRST = b"\x80\x04h\x00."
+GET_FAR = b"\x80\x04j\x88\x13\x00\x00."
+
+
+def write_policy(root: Path) -> str:
+    path = root / "policy.json"
+    path.write_text(
+        json.dumps({"memo.py:<module>.Model": {"globals": [], "reduces": []}})
+    )
+    return str(path)
+
+
+def load(unpickler):
+    try:
+        return unpickler.load()
+    except Exception as exc:
+        return exc
+
+
+def compare(enforcer, policy, data, seed, label) -> list:
+    # The stdlib's pure-Python unpickler only takes a whole new memo (and
+    # the C one drops a memo assigned before its first load)
+    reference = pickle._Unpickler(io.BytesIO(data))
+    reference.memo = seed
+    expected = load(reference)
+    unpickler = enforcer.Unpickler(io.BytesIO(data), policy=policy)
+    memo = unpickler.memo
+    for key, value in seed.items():
+        memo[key] = value
+    got = load(unpickler)
+    if repr(got) != repr(expected):
+        return [f"{label}: loaded {got!r}, pickle loaded {expected!r}"]
+    return []
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        policy = write_policy(Path(tmp))
+        errors += compare(enforcer, policy, GET_FIRST, {0: "seeded"}, "list memo")
+        errors += compare(enforcer, policy, GET_FAR, {5000: "far"}, "dict memo")
+        errors += compare(
+            enforcer, policy, GET_FIRST, {3: "other"}, "missing entry"
+        )
+
+        unpickler = enforcer.Unpickler(io.BytesIO(GET_FIRST), policy=policy)
+        memo = unpickler.memo
+        memo.update({0: "a", 1: "b", 2: "c"})
+        del memo[2]
+        del memo[0]
+        if dict(memo) != {1: "b"} or len(memo) != 1 or 0 in memo:
+            errors.append(f"deleted entries: {memo.copy()}")
+        try:
+            value = unpickler.load()
+        except enforcer.UnpicklingError:
+            pass
+        else:
+            errors.append(f"deleted entry: loaded {value!r}")
+        memo.clear()
+        if len(unpickler.memo) or dict(unpickler.memo):
+            errors.append(f"cleared memo: {unpickler.memo.copy()}")
+
+        data = pickle.dumps(["x", "y"], protocol=4)
+        unpickler = enforcer.Unpickler(io.BytesIO(data), policy=policy)
+        unpickler.load()
+        reference = pickle.Unpickler(io.BytesIO(data))
+        reference.load()
+        if repr(unpickler.memo.copy()) != repr(reference.memo.copy()):
+            errors.append(f"after a load: {unpickler.memo.copy()}")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
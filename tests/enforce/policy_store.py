@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Policies served from a PolicyStore and selected with using_policy().
+
+A store over a directory of JSON policy files is looked up by model key, by
+file name, by unambiguous class name and by model class (including a
+subclass defined elsewhere). Loads under each policy build the classes it
+allows and stub the others. using_policy() and PolicyStore.using() select
+the policy of loads that are not given one, nest, end with their block,
+and do not reach other threads; using_policy(None) is refused. refresh()
+picks up edited, new and removed files. Exits with status 1 if any check
+fails.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+TYPES_MODULE = "pbstore_types"
+
+TYPES_SOURCE = """\
+class Tagger:
+    pass
+
+
+class Other:
+    pass
+"""
+
+TAGGER_KEY = f"{TYPES_MODULE}.py:<module>.Tagger"
+OTHER_KEY = f"{TYPES_MODULE}.py:<module>.Other"
+# A second Tagger makes the class name ambiguous
+LIBRARY_KEY = "library/models.py:<module>.Tagger"
+
+
+def write_file(root: Path, name: str, policies: dict) -> None:
+    path = root / f"{name}.json"
+    data = {
+        key: {"globals": names, "reduces": names} for key, names in policies.items()
+    }
+    path.write_text(json.dumps(data))
+    # Make every rewrite visible to refresh(), however coarse the clock
+    st = path.stat()
+    bump = getattr(write_file, "bump", 0) + 1
+    write_file.bump = bump
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + bump * 10**9))
+
+
+def loaded_names(enforcer, types, policy=None) -> list:
+    # Which of Tagger and Other a load builds rather than stubs
+    data = pickle.dumps([types.Tagger(), types.Other()], protocol=4)
+    if policy is None:
+        loaded = enforcer.loads(data)
+    else:
+        loaded = enforcer.loads(data, policy=policy)
+    stub = enforcer.StubObject
+    return [type(obj).__name__ for obj in loaded if not isinstance(obj, stub)]
+
+
+def check_lookups(enforcer, store, types) -> list:
+    errors = []
+    if sorted(store) != sorted([TAGGER_KEY, OTHER_KEY, LIBRARY_KEY]):
+        errors.append(f"store holds {sorted(store)}")
+    tagger = store[TAGGER_KEY]
+    for key in ("tagger", types.Tagger):
+        if store.get(key) is not tagger:
+            errors.append(f"lookup of {key!r}: {store.get(key)!r}")
+
+    class Subclassed(types.Tagger):
+        pass
+
+    if store.get(Subclassed) is not tagger:
+        errors.append(f"lookup of a subclass: {store.get(Subclassed)!r}")
+    if store.get("Other") is not store[OTHER_KEY]:
+        errors.append(f"lookup of Other: {store.get('Other')!r}")
+    # Two models share the file name and two share the class name
+    for key in ("shared", "Tagger"):
+        try:
+            policy = store[key]
+        except KeyError:
+            pass
+        else:
+            errors.append(f"lookup of {key!r}: {policy!r}")
+    return errors
+
+
+def check_selection(enforcer, store, types) -> list:
+    errors = []
+    with store.using("tagger"):
+        if loaded_names(enforcer, types) != ["Tagger"]:
+            errors.append(f"using tagger: built {loaded_names(enforcer, types)}")
+        with enforcer.using_policy(store[OTHER_KEY]) as policy:
+            if policy is not store[OTHER_KEY]:
+                errors.append(f"using_policy() returned {policy!r}")
+            if loaded_names(enforcer, types) != ["Other"]:
+                errors.append(f"nested: built {loaded_names(enforcer, types)}")
+            # An explicit policy wins
+            built = loaded_names(enforcer, types, store[TAGGER_KEY])
+            if built != ["Tagger"]:
+                errors.append(f"explicit policy: built {built}")
+        if loaded_names(enforcer, types) != ["Tagger"]:
+            errors.append(f"after nested: built {loaded_names(enforcer, types)}")
+
+        # Other threads keep the process default, which allows nothing here
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(loaded_names(enforcer, types))
+        )
+        thread.start()
+        thread.join()
+        if seen != [[]]:
+            errors.append(f"other thread: built {seen}")
+    if loaded_names(enforcer, types) != []:
+        errors.append(f"after using(): built {loaded_names(enforcer, types)}")
+    try:
+        enforcer.using_policy(None)
+    except TypeError:
+        pass
+    else:
+        errors.append("using_policy() accepted None")
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / f"{TYPES_MODULE}.py").write_text(TYPES_SOURCE)
+        sys.path.insert(0, tmp)
+        types = __import__(TYPES_MODULE)
+        # No policy.json there: loads without a policy allow nothing
+        enforcer.POLICY_PATH = tmp
+
+        policies = root / "policies"
+        policies.mkdir()
+        tagger, other = f"{TYPES_MODULE}.Tagger", f"{TYPES_MODULE}.Other"
+        write_file(policies, "tagger", {TAGGER_KEY: [tagger]})
+        write_file(policies, "shared", {OTHER_KEY: [other], LIBRARY_KEY: []})
+        store = enforcer.PolicyStore(policies)
+
+        errors += check_lookups(enforcer, store, types)
+        for key, expected in ((TAGGER_KEY, ["Tagger"]), (OTHER_KEY, ["Other"])):
+            built = loaded_names(enforcer, types, store[key])
+            if built != expected:
+                errors.append(f"policy {key}: built {built}")
+        errors += check_selection(enforcer, store, types)
+
+        write_file(policies, "tagger", {TAGGER_KEY: [tagger, other]})
+        (policies / "shared.json").unlink()
+        write_file(policies, "added", {LIBRARY_KEY: [other]})
+        if loaded_names(enforcer, types, store[TAGGER_KEY]) != ["Tagger"]:
+            errors.append("the store changed before refresh()")
+        store.refresh()
+        built = loaded_names(enforcer, types, store[TAGGER_KEY])
+        if built != ["Tagger", "Other"]:
+            errors.append(f"edited policy: built {built}")
+        if OTHER_KEY in store:
+            errors.append("removed policy is still served")
+        if store.get("added") is not store.get(LIBRARY_KEY) or LIBRARY_KEY not in store:
+            errors.append(f"added policy: {store.get('added')!r}")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
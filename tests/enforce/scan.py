@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""Pre-scans of pickles with scan() and scans().
+
+For every protocol, a pickle that only uses allowed names is accepted. Names
+that are not allowed globals, or that are called without being allowed
+reduces, are reported, and so are the opcodes the enforcer refuses. Scanning
+must not build any object. Every truncation and a set of random corruptions
+of the accepted pickle either scan or raise UnpicklingError. A pickle with a
+payload larger than the scanner reads at once is scanned from a stream that
+has only read() and readline(). Exits with status 1 if any check fails.
+"""
+
+import argparse
+import collections
+import io
+import json
+import pickle
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+
+calls = []
+
+
+def record():
+    # Scanning must not call this
+    calls.append(None)
+
+
+class Built:
+    def __reduce__(self):
+        return record, ()
+
+
+class Unseekable:
+    """Stream with only read() and readline(), like a pipe."""
+
+    def __init__(self, data):
+        self._file = io.BytesIO(data)
+
+    def read(self, n=-1):
+        return self._file.read(n)
+
+    def readline(self):
+        return self._file.readline()
+
+
+def write_policy(root: Path) -> str:
+    path = root / "policy.json"
+    path.write_text(
+        json.dumps({"scan.py:<module>.Model": {
+            "globals": ["collections.OrderedDict", "collections.Counter"],
+            "reduces": ["collections.OrderedDict"],
+        }})
+    )
+    return str(path)
+
+
+def check_verdict(verdict, allowed, globals_, reduces, label) -> list:
+    errors = []
+    if bool(verdict) is not allowed:
+        errors.append(f"{label}: {verdict!r}")
+    if set(verdict.denied_globals) != set(globals_):
+        errors.append(f"{label}: denied globals {sorted(verdict.denied_globals)}")
+    if set(verdict.denied_reduces) != set(reduces):
+        errors.append(f"{label}: denied reduces {sorted(verdict.denied_reduces)}")
+    return errors
+
+
+def check_malformed(enforcer, data, policy, label) -> list:
+    rng = random.Random(label)
+    cases = [data[:i] for i in range(len(data))]
+    for _ in range(300):
+        corrupt = bytearray(data)
+        for _ in range(rng.randint(1, 3)):
+            corrupt[rng.randrange(len(corrupt))] = rng.randrange(256)
+        cases.append(bytes(corrupt))
+    errors = []
+    for case in cases:
+        try:
+            enforcer.scans(case, policy=policy)
+        except enforcer.UnpicklingError:
+            pass
+        except Exception as exc:
+            errors.append(f"{label}: {case!r} raised {exc!r}")
+            break
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        policy = write_policy(Path(tmp))
+        built = f"{__name__}.record"
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            label = f"protocol {protocol}"
+            # Before protocol 3, bytes are pickled as calls of _codecs.encode
+            accepted = pickle.dumps(
+                [collections.OrderedDict(a=1), "text", 2**70, 1.5]
+                + ([b"data"] if protocol >= 3 else []),
+                protocol=protocol,
+            )
+            errors += check_verdict(
+                enforcer.scans(accepted, policy=policy), True, [], [], label
+            )
+            # Allowed as a global, but not as a reduce
+            counted = pickle.dumps(collections.Counter("ab"), protocol=protocol)
+            errors += check_verdict(
+                enforcer.scans(counted, policy=policy),
+                False,
+                [],
+                ["collections.Counter"],
+                f"{label}, Counter",
+            )
+            denied = pickle.dumps([Built()], protocol=protocol)
+            errors += check_verdict(
+                enforcer.scans(denied, policy=policy),
+                False,
+                [built],
+                [built],
+                f"{label}, denied",
+            )
+            errors += check_malformed(enforcer, accepted, policy, label)
+        if calls:
+            errors.append("scanning called a reduce")
+
+        # INST is refused by the enforcer
+        verdict = enforcer.scans(
+            b"(icollections\nOrderedDict\n.", policy=policy
+        )
+        if verdict or not verdict.unsupported:
+            errors.append(f"INST: {verdict!r}")
+
+        for protocol in (4, 5):
+            label = f"unseekable, protocol {protocol}"
+            data = pickle.dumps([b"x" * (2 << 20), Built()], protocol=protocol)
+            try:
+                verdict = enforcer.scan(Unseekable(data), policy=policy)
+            except Exception as exc:
+                errors.append(f"{label}: raised {exc!r}")
+            else:
+                errors += check_verdict(verdict, False, [built], [built], label)
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""Round trips of small torch.save() checkpoints through load_torch().
+
+A state dict of float and integer tensors, one of them a view sharing the
+storage of another, is saved with torch.save() and loaded back with
+load_torch() from the checkpoint path with mmap on and off, on the
+pure-Python and the C unpickler, and from an open file object. The loaded
+tensors must equal the saved ones and keep their storage sharing. The same
+state dict split into two shards is loaded back with load_sharded(). A
+policy that does not allow the tensor rebuild function must fail the load.
+Skipped when torch is not installed; exits with status 1 if any check fails.
+"""
+
+import argparse
+import collections
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+GLOBALS = [
+    "collections.OrderedDict",
+    "torch._utils._rebuild_tensor_v2",
+    "torch.FloatStorage",
+    "torch.LongStorage",
+]
+REDUCES = ["collections.OrderedDict", "torch._utils._rebuild_tensor_v2"]
+
+
+def write_policy(root: Path, name: str, globals_: list, reduces: list) -> str:
+    path = root / f"{name}.json"
+    path.write_text(
+        json.dumps({"torch_checkpoints.py:<module>.Model": {
+            "globals": globals_,
+            "reduces": reduces,
+        }})
+    )
+    return str(path)
+
+
+def state_dict(torch) -> collections.OrderedDict:
+    weight = torch.arange(6, dtype=torch.float32).reshape(2, 3)
+    return collections.OrderedDict(
+        weight=weight,
+        bias=torch.zeros(2),
+        steps=torch.tensor([1, 2, 3], dtype=torch.int64),
+        row=weight[1],
+    )
+
+
+def write_shards(torch, root: Path, saved, shards) -> Path:
+    # Save each list of names of *shards* as a shard and write their index
+    weight_map = {}
+    for i, names in enumerate(shards):
+        shard = f"model-{i + 1:05d}-of-{len(shards):05d}.bin"
+        state_dict = collections.OrderedDict((k, saved[k]) for k in names)
+        torch.save(state_dict, root / shard)
+        weight_map.update(dict.fromkeys(names, shard))
+    index = root / "model.bin.index.json"
+    index.write_text(json.dumps({"metadata": {}, "weight_map": weight_map}))
+    return index
+
+
+def check_loaded(torch, saved, loaded, label) -> list:
+    if list(loaded) != list(saved):
+        return [f"{label}: loaded keys {list(loaded)}"]
+    errors = []
+    for name, tensor in saved.items():
+        got = loaded[name]
+        if got.dtype != tensor.dtype or not torch.equal(got, tensor):
+            errors.append(f"{label}: {name} loaded as {got!r}")
+    if (
+        loaded["row"].untyped_storage().data_ptr()
+        != loaded["weight"].untyped_storage().data_ptr()
+    ):
+        errors.append(f"{label}: row no longer shares the storage of weight")
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    try:
+        import torch
+    except ImportError:
+        print("SKIPPED (torch is not installed)")
+        return 0
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        checkpoint = root / "model.bin"
+        saved = state_dict(torch)
+        torch.save(saved, checkpoint)
+        allowed = write_policy(root, "allowed", GLOBALS, REDUCES)
+        denied = write_policy(
+            root, "denied", GLOBALS, ["collections.OrderedDict"]
+        )
+
+        for mmap in (True, False):
+            for fast in (False, True):
+                label = f"path, mmap={mmap}, fast={fast}"
+                loaded = enforcer.load_torch(
+                    checkpoint, policy=allowed, mmap=mmap, fast=fast
+                )
+                errors += check_loaded(torch, saved, loaded, label)
+                last = enforcer.last_load()
+                if not last["ok"]:
+                    errors.append(f"{label}: last_load() reported {last}")
+        with open(checkpoint, "rb") as f:
+            loaded = enforcer.load_torch(f, policy=allowed)
+        errors += check_loaded(torch, saved, loaded, "file object")
+
+        # weight and row share a storage, so they go in the same shard
+        index = write_shards(
+            torch, root, saved, [["weight", "row"], ["bias", "steps"]]
+        )
+        for fast in (False, True):
+            loaded = enforcer.load_sharded(index, policy=allowed, fast=fast)
+            errors += check_loaded(
+                torch, saved, collections.OrderedDict((k, loaded[k]) for k in saved),
+                f"sharded, fast={fast}",
+            )
+
+        for fast in (False, True):
+            try:
+                loaded = enforcer.load_torch(checkpoint, policy=denied, fast=fast)
+            except Exception:
+                pass
+            else:
+                errors.append(f"denied, fast={fast}: loaded {loaded!r}")
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
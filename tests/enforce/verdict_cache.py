@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""Loads through the verdict cache.
+
+A clean load of an in-memory pickle, and of a pickle at the start of a file
+followed by other data, is recorded and replayed by the next load of the
+same bytes. A file rewritten in place with its old size and modification
+time is not replayed. A verdict entry written into the cache directory by
+someone else, listing a global that the policy allows but does not allow to
+be called, must not let the replay call it. Exits with status 1 if any
+check fails.
+"""
+
+import argparse
+import collections
+import hashlib
+import io
+import json
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "enforce"))
+from enforcer_module import ENFORCER_PATH, import_enforcer, report
+
+
+class Printed:
+    # Pickled as a call of print()
+    def __reduce__(self):
+        return print, ("the replay called print()",)
+
+
+def write_policy(root: Path) -> str:
+    path = root / "policy.json"
+    path.write_text(
+        json.dumps({"verdict_cache.py:<module>.Model": {
+            "globals": ["collections.OrderedDict", "builtins.print"],
+            "reduces": ["collections.OrderedDict"],
+        }})
+    )
+    return str(path)
+
+
+def counts(enforcer) -> tuple:
+    info = enforcer.verdict_cache_info()
+    return info["hits"], info["misses"]
+
+
+def check_loads(enforcer, load, expected, hits, label) -> list:
+    # Two loads: the first is a miss unless hits says otherwise
+    errors = []
+    before = counts(enforcer)
+    for _ in range(2):
+        value = load()
+        if value != expected:
+            errors.append(f"{label}: loaded {value!r}")
+    got = tuple(a - b for a, b in zip(counts(enforcer), before))
+    if got != hits:
+        errors.append(f"{label}: (hits, misses) {got}, expected {hits}")
+    return errors
+
+
+def check_tampered(enforcer, root: Path, policy) -> list:
+    data = pickle.dumps([Printed()], protocol=4)
+    compiled = enforcer._resolve_policy(policy)
+    key = enforcer._VerdictCache.key(hashlib.sha256(data).digest(), compiled)
+    (root / "cache" / f"{key}.json").write_text(
+        json.dumps({
+            "version": enforcer._VERDICT_CACHE_VERSION,
+            "policy": policy,
+            "model": compiled.model_name,
+            "policy_digest": compiled.digest.hex(),
+            "globals": ["builtins.print"],
+            "reduces": [],
+            "span": None,
+        })
+    )
+    try:
+        value = enforcer.Unpickler(io.BytesIO(data), policy=policy).load()
+    except Exception as exc:
+        if str(exc) != "Tried to call builtins.print":
+            return [f"tampered entry: failed with {exc!r}"]
+        return []
+    return [f"tampered entry: loaded {value!r} instead of refusing print()"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--enforcer", type=Path, default=ENFORCER_PATH)
+    args = parser.parse_args()
+
+    enforcer = import_enforcer(args.enforcer)
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        policy = write_policy(root)
+        enforcer.configure_verdict_cache(root / "cache")
+        expected = collections.OrderedDict(a=[1, 2, 3], b="text")
+        data = pickle.dumps(expected, protocol=4)
+
+        errors += check_loads(
+            enforcer,
+            lambda: enforcer.Unpickler(io.BytesIO(data), policy=policy).load(),
+            expected,
+            (1, 1),
+            "in memory",
+        )
+
+        path = root / "model.pkl"
+        path.write_bytes(data + b"\0" * (1 << 20))
+
+        def load_file():
+            with open(path, "rb") as f:
+                value = enforcer.Unpickler(f, policy=policy).load()
+                if f.tell() != len(data):
+                    errors.append(f"file: stopped at {f.tell()}, not {len(data)}")
+            return value
+
+        errors += check_loads(enforcer, load_file, expected, (1, 1), "file")
+
+        # Same size and modification time, different pickle
+        changed = collections.OrderedDict(a=[1, 2, 4], b="text")
+        changed_data = pickle.dumps(changed, protocol=4)
+        st = os.stat(path)
+        with open(path, "r+b") as f:
+            f.write(changed_data)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        errors += check_loads(
+            enforcer, load_file, changed, (1, 1), "file rewritten in place"
+        )
+
+        errors += check_tampered(enforcer, root, policy)
+        enforcer.configure_verdict_cache(enabled=False)
+
+    return report(errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())